@@ -0,0 +1,452 @@
+"""
+Бенчмарки PDFService и репозиториев.
+
+    python bench.py all --out results.json
+    python bench.py images --quick
+    python bench.py merge --docs 4 --pages 100
+    python bench.py db --rows 10000 1000000
+    python bench.py startup --runs 10
+    python bench.py all --baseline results.json --threshold 0.2
+
+Замеры PDF выполняются в отдельном процессе (spawn),
+чтобы пиковая память (RSS) относилась только к самой операции.
+Все фикстуры генерируются на лету, сеть и токен бота не нужны.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+
+# ===================== FIXTURES =====================
+
+def make_pdf(path: str, images: list[str]):
+    """
+    PDF «скан»: по картинке на страницу
+    """
+    from reportlab import rl_config
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    # как PDF самого бота: потоки без ASCII85 (см. services._canvas)
+    rl_config.useA85 = 0
+    c = canvas.Canvas(path, pagesize=A4, invariant=True)
+    for i, image in enumerate(images):
+        c.drawString(40, 800, f"page {i}")
+        c.drawImage(image, 40, 40, 500, 700)
+        c.showPage()
+    c.save()
+
+
+def make_jpeg(path: str, size: tuple[int, int], seed: int = 0):
+    from PIL import Image
+
+    img = Image.effect_noise(size, 64 + seed % 32).convert("RGB")
+    img.save(path, quality=85)
+
+
+def make_image(path: str, kind: str, seed: int = 0):
+    """
+    Фото разных типов, которые встречаются у пользователей
+    """
+    from PIL import Image
+
+    if kind == "jpeg":
+        # так Telegram отдаёт photo[-1]
+        make_jpeg(path, (1280, 960), seed)
+    elif kind == "jpeg_large":
+        make_jpeg(path, (4000, 3000), seed)
+    elif kind == "png":
+        img = Image.effect_noise((1280, 960), 64 + seed % 32).convert("RGBA")
+        img.save(path)
+    elif kind == "cmyk":
+        img = Image.effect_noise((1280, 960), 64 + seed % 32).convert("CMYK")
+        img.save(path, quality=85)
+    elif kind == "exif_rotated":
+        img = Image.effect_noise((1280, 960), 64 + seed % 32).convert("RGB")
+        exif = img.getexif()
+        exif[0x0112] = 6
+        img.save(path, quality=85, exif=exif)
+    else:
+        raise ValueError(f"Unknown image kind: {kind}")
+
+
+IMAGE_EXT = {"png": ".png"}
+
+
+# ===================== MEASURE =====================
+
+def peak_rss() -> int:
+    """
+    Пиковый RSS процесса в байтах.
+    VmHWM, в отличие от ru_maxrss, не наследуется через fork/exec.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss: килобайты на Linux, байты на macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _child(queue, fn, args, kwargs):
+    from services import preload
+
+    # импорт библиотек не входит в замер
+    preload()
+    start = time.perf_counter()
+    fn(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, peak_rss()))
+
+
+def measure(fn, *args, **kwargs) -> dict:
+    """
+    Запускает fn в чистом процессе, возвращает время и пиковый RSS
+    """
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_child, args=(queue, fn, args, kwargs))
+    proc.start()
+    elapsed, peak_rss = queue.get()
+    proc.join()
+    return {"seconds": round(elapsed, 4), "peak_rss": peak_rss}
+
+
+def latency(samples: list[float]) -> dict:
+    samples = sorted(samples)
+    return {
+        "seconds": round(statistics.fmean(samples), 7),
+        "p50": round(samples[len(samples) // 2], 7),
+        "p99": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))], 7),
+        "ops_per_sec": round(len(samples) / sum(samples), 1),
+    }
+
+
+# ===================== IMAGES → PDF =====================
+
+IMAGE_KINDS = ["jpeg", "jpeg_large", "png", "cmyk", "exif_rotated"]
+
+
+def bench_images(counts: list[int], workdir: str) -> list[dict]:
+    from services import PDFService
+
+    results = []
+    for kind in IMAGE_KINDS:
+        images = []
+        for i in range(max(counts)):
+            path = os.path.join(workdir, f"{kind}_{i}{IMAGE_EXT.get(kind, '.jpg')}")
+            make_image(path, kind, seed=i)
+            images.append(path)
+
+        for n in counts:
+            out = os.path.join(workdir, f"{kind}_{n}.pdf")
+            r = measure(PDFService.images_to_pdf, images[:n], out)
+            r.update({
+                "name": f"images_to_pdf/{kind}/n={n}",
+                "output_bytes": os.path.getsize(out),
+                "pages_per_sec": round(n / r["seconds"], 1),
+            })
+            results.append(r)
+    return results
+
+
+# ===================== MERGE =====================
+
+def bench_merge(docs_list: list[int], pages: int, workdir: str) -> list[dict]:
+    from services import PDFService
+
+    images = []
+    for i in range(pages):
+        images.append(os.path.join(workdir, f"page{i}.jpg"))
+        make_jpeg(images[-1], (1240, 1754), seed=i)
+
+    inputs = []
+    for d in range(max(docs_list)):
+        path = os.path.join(workdir, f"doc{d}.pdf")
+        make_pdf(path, images)
+        inputs.append(path)
+
+    results = []
+    for docs in docs_list:
+        input_bytes = sum(os.path.getsize(p) for p in inputs[:docs])
+        for streaming in (False, True):
+            mode = "streaming" if streaming else "merger"
+            out = os.path.join(workdir, f"merged_{docs}_{mode}.pdf")
+            r = measure(PDFService.merge_pdfs, inputs[:docs], out, streaming=streaming)
+            r.update({
+                "name": f"merge_pdfs/{mode}/docs={docs},pages={pages}",
+                "input_bytes": input_bytes,
+                "pages_per_sec": round(docs * pages / r["seconds"], 1),
+                "mb_per_sec": round(input_bytes / r["seconds"] / 1e6, 2),
+            })
+            results.append(r)
+    return results
+
+
+# ===================== DATABASE =====================
+
+BENCH_USERS = 1000
+
+
+def _fill(db, rows: int):
+    """
+    rows файлов у BENCH_USERS пользователей, вставка пачками в обход репозиториев
+    """
+    conn = db.conn
+    conn.executemany(
+        "INSERT INTO users (telegram_id) VALUES (?)",
+        ((1_000_000 + i,) for i in range(BENCH_USERS))
+    )
+    conn.executemany(
+        "INSERT INTO files (user_id, original_name, stored_name) VALUES (?, ?, ?)",
+        ((i % BENCH_USERS + 1, f"file {i}", f"{i:06}.pdf") for i in range(rows))
+    )
+    conn.commit()
+
+
+async def _timed(n: int, make_call) -> dict:
+    samples = []
+    for i in range(n):
+        start = time.perf_counter()
+        await make_call(i)
+        samples.append(time.perf_counter() - start)
+    return latency(samples)
+
+
+async def _bench_repos(db, rows: int, ops: int) -> list[dict]:
+    from database import UserRepo, FileRepo
+
+    users = UserRepo(db)
+    files = FileRepo(db)
+    tg = lambda i: 1_000_000 + i % BENCH_USERS
+    owner = lambda i: i % BENCH_USERS + 1
+    results = {}
+
+    results["users.get_or_create/uncached"] = await _timed(
+        ops, lambda i: users._get_or_create(tg(i))
+    )
+    results["users.get_or_create/cached"] = await _timed(
+        ops, lambda i: users.get_or_create(tg(i % 10))
+    )
+    results["users.set_language"] = await _timed(
+        ops, lambda i: users.set_language(tg(i), "ru")
+    )
+    results["files.page/first"] = await _timed(
+        ops, lambda i: files.page(owner(i))
+    )
+    results["files.page/deep"] = await _timed(
+        ops, lambda i: files.page(owner(i), rows // 2)
+    )
+    # файл с id n принадлежит пользователю (n - 1) % BENCH_USERS + 1
+    results["files.get"] = await _timed(
+        ops, lambda i: files.get(i * 7 % rows + 1, i * 7 % rows % BENCH_USERS + 1)
+    )
+    results["files.get_paths"] = await _timed(
+        ops, lambda i: files.get_paths([i + 1, i + 1 + BENCH_USERS], owner(i))
+    )
+
+    created = []
+
+    async def create(i):
+        created.append(await files.create(owner(i), f"new {i}", ""))
+
+    results["files.create"] = await _timed(ops, create)
+    results["files.rename"] = await _timed(
+        ops, lambda i: files.rename(created[i], owner(i), f"renamed {i}")
+    )
+    results["files.delete"] = await _timed(
+        ops, lambda i: files.delete(created[i], owner(i))
+    )
+
+    # одновременные записи — видно выигрыш от group commit
+    start = time.perf_counter()
+    await asyncio.gather(*(files.create(owner(i), f"burst {i}", "") for i in range(ops)))
+    elapsed = time.perf_counter() - start
+    results["files.create/concurrent"] = {
+        "seconds": round(elapsed / ops, 7),
+        "ops_per_sec": round(ops / elapsed, 1),
+    }
+
+    return [
+        {"name": f"db/{name}/rows={rows}", **r}
+        for name, r in results.items()
+    ]
+
+
+def bench_db(rows_list: list[int], ops: int, workdir: str) -> list[dict]:
+    from database import Database
+
+    results = []
+    for rows in rows_list:
+        db = Database(os.path.join(workdir, f"bench_{rows}.db"))
+        try:
+            _fill(db, rows)
+            results += asyncio.run(_bench_repos(db, rows, ops))
+        finally:
+            db.close()
+    return results
+
+
+# ===================== STARTUP =====================
+
+# должны загружаться только в процессах пула PDF, не при импорте bot
+HEAVY_MODULES = ("reportlab", "PIL", "PyPDF2")
+
+# выполняется в чистом интерпретаторе: хранилище и база — во временном каталоге
+STARTUP_SCRIPT = """
+import json, os, sys, time
+import config
+
+workdir = sys.argv[1]
+config.STORAGE_PDF = os.path.join(workdir, "pdf")
+config.STORAGE_TEMP = os.path.join(workdir, "temp")
+config.STORAGE_PREVIEW = os.path.join(workdir, "previews")
+config.DB_PATH = os.path.join(workdir, "bot.db")
+
+start = time.perf_counter()
+import bot
+imported = time.perf_counter()
+heavy = [m for m in %r if m in sys.modules]
+bot.build_app()
+built = time.perf_counter()
+bot.db.close()
+
+print(json.dumps({"import": imported - start, "build_app": built - imported, "heavy": heavy}))
+""" % (HEAVY_MODULES,)
+
+
+def bench_startup(runs: int, workdir: str) -> list[dict]:
+    """
+    Импорт bot и сборка приложения, каждый прогон — в новом процессе
+    """
+    import subprocess
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join(filter(None, (here, os.environ.get("PYTHONPATH"))))}
+    samples = []
+    for i in range(runs):
+        run_dir = os.path.join(workdir, f"startup{i}")
+        os.makedirs(run_dir)
+        out = subprocess.run(
+            [sys.executable, "-W", "ignore", "-c", STARTUP_SCRIPT, run_dir],
+            env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        samples.append(json.loads(out.splitlines()[-1]))
+
+    # медиана: на первый прогон влияет холодный кэш диска
+    return [
+        {
+            "name": "startup/import_bot",
+            "seconds": round(statistics.median(s["import"] for s in samples), 4),
+            "max": round(max(s["import"] for s in samples), 4),
+            "heavy_modules": samples[0]["heavy"],
+        },
+        {
+            "name": "startup/build_app",
+            "seconds": round(statistics.median(s["build_app"] for s in samples), 4),
+            "max": round(max(s["build_app"] for s in samples), 4),
+        },
+    ]
+
+
+# ===================== BASELINE =====================
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[dict]:
+    """
+    Сравнивает seconds с базовым прогоном.
+    Возвращает замеры, которые стали медленнее больше чем на threshold.
+    """
+    old = {r["name"]: r for r in baseline}
+    regressions = []
+
+    for r in results:
+        base = old.get(r["name"])
+        if not base or not base["seconds"]:
+            continue
+        ratio = r["seconds"] / base["seconds"]
+        r["baseline_seconds"] = base["seconds"]
+        r["ratio"] = round(ratio, 3)
+        if ratio > 1 + threshold:
+            regressions.append(r)
+
+    return regressions
+
+
+# ===================== CLI =====================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("bench", choices=["images", "merge", "db", "startup", "all"])
+    parser.add_argument("--quick", action="store_true", help="small matrix for a smoke run")
+    parser.add_argument("--counts", type=int, nargs="+", help="images per PDF")
+    parser.add_argument("--docs", type=int, nargs="+", help="documents per merge")
+    parser.add_argument("--pages", type=int, help="pages per merged document")
+    parser.add_argument("--rows", type=int, nargs="+", help="files table sizes")
+    parser.add_argument("--ops", type=int, default=2000, help="calls per DB operation")
+    parser.add_argument("--runs", type=int, help="fresh interpreters for the startup bench")
+    parser.add_argument("--out", help="write JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown, 0.2 = 20%%")
+    args = parser.parse_args()
+
+    counts = args.counts or ([1, 10] if args.quick else [1, 10, 40])
+    docs = args.docs or ([2] if args.quick else [2, 8])
+    pages = args.pages or (10 if args.quick else 50)
+    rows = args.rows or ([10_000] if args.quick else [10_000, 1_000_000])
+    runs = args.runs or (3 if args.quick else 10)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix="pdfbench_")
+    try:
+        if args.bench in ("images", "all"):
+            results += bench_images(counts, workdir)
+        if args.bench in ("merge", "all"):
+            results += bench_merge(docs, pages, workdir)
+        if args.bench in ("db", "all"):
+            results += bench_db(rows, args.ops, workdir)
+        if args.bench in ("startup", "all"):
+            results += bench_startup(runs, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+    # тяжёлые библиотеки при импорте bot — регрессия и без базового прогона
+    heavy = [r for r in results if r.get("heavy_modules")]
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    for r in regressions:
+        print(
+            f"REGRESSION {r['name']}: {r['baseline_seconds']}s → {r['seconds']}s (x{r['ratio']})",
+            file=sys.stderr
+        )
+    for r in heavy:
+        print(
+            f"REGRESSION {r['name']}: imports {', '.join(r['heavy_modules'])}",
+            file=sys.stderr
+        )
+    sys.exit(1 if regressions or heavy else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import os
+import time
+import uuid
+import asyncio
 import logging
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import (
     ApplicationBuilder,
     CallbackQueryHandler,
@@ -11,9 +15,12 @@ from telegram.ext import (
     ConversationHandler,
 )
 
+import config
 from config import BOT_TOKEN, STORAGE_PDF, STORAGE_TEMP
-from database import Database, UserRepo, FileRepo
-from services import PDFService
+from database import Database, UserRepo, FileRepo, StateRepo
+from persistence import SQLitePersistence
+from services import PDFService, OPTIMIZE_PRESETS
+from jobs import pdf_jobs, JobError, JobQueueFull, JobCancelled
 from keyboards import (
     lang_kb,
     main_menu,
@@ -21,65 +28,45 @@ from keyboards import (
     files_list_kb,
     file_actions_kb,
     merge_files_kb,
+    merge_toggle_kb,
+    optimize_kb,
+    job_kb,
 )
 from texts import TEXT
-from ui import update_ui, reset_ui
+from ui import update_ui, reset_ui, photo_ui
+import ui
+from previews import PreviewCache
+from janitor import Janitor, TEMP_MAX_AGE
+from logs import setup_logging
+from updates import PerUserUpdateProcessor, WEBHOOK_URL, webhook_settings
+import cluster
+import metrics
+from metrics import timed_handler
 
 # ===================== LOGGER ===================
 
-import logging
-import sys
-
-class HumanFormatter(logging.Formatter):
-    COLORS = {
-        "INFO": "\033[92m",     # green
-        "WARNING": "\033[93m",  # yellow
-        "ERROR": "\033[91m",    # red
-        "RESET": "\033[0m",
-    }
-
-    def format(self, record):
-        color = self.COLORS.get(record.levelname, "")
-        reset = self.COLORS["RESET"]
-        record.levelname = f"{color}{record.levelname:<7}{reset}"
-        return super().format(record)
-
-
-handler = logging.StreamHandler(sys.stdout)
-handler.setFormatter(
-    HumanFormatter(
-        "%(asctime)s | %(levelname)s | %(message)s",
-        datefmt="%H:%M:%S",
-    )
-)
-
-root = logging.getLogger()
-root.handlers.clear()
-root.addHandler(handler)
-root.setLevel(logging.INFO)
-
-# глушим шум
-logging.getLogger("httpx").setLevel(logging.WARNING)
-logging.getLogger("telegram").setLevel(logging.WARNING)
-logging.getLogger("telegram.ext").setLevel(logging.WARNING)
-
-logging.info("🚀 Bot process initialized")
-
-
 def log_user(update: Update, action: str):
     user = update.effective_user
     uid = user.id if user else "unknown"
-    logging.info("👤 User %s %s", uid, action)
+    logging.info("👤 User %s %s", uid, action, extra={"event": "user_action"})
 
 
+def _format_size(size: int) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
 
 
-# ===================== INIT =====================
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
 
-os.makedirs(STORAGE_PDF, exist_ok=True)
-os.makedirs(STORAGE_TEMP, exist_ok=True)
 
-logging.basicConfig(level=logging.INFO)
+# ===================== INIT =====================
 
 (
     LANG,
@@ -92,15 +79,94 @@ logging.basicConfig(level=logging.INFO)
     MERGE_SELECT,
 ) = range(8)
 
-db = Database()
-users = UserRepo(db)
-files = FileRepo(db)
+# фото альбома качаются параллельно, но не больше PHOTO_DOWNLOADS сразу
+PHOTO_DOWNLOADS = getattr(config, "PHOTO_DOWNLOADS", 4)
+# True — фото держатся в памяти и не пишутся в STORAGE_TEMP
+PHOTO_IN_MEMORY = getattr(config, "PHOTO_IN_MEMORY", False)
+
+_download_slots = asyncio.Semaphore(PHOTO_DOWNLOADS)
+
+# собираемые фото: user_id → [(message_id, img_path, page_path, task, size)],
+# size — размер фото по данным Telegram (0, если неизвестен).
+# Не в user_data: задачи не сохраняются в persistence и не переживают перезапуск
+_albums = {}
+# user_id → время последнего фото альбома (для janitor)
+_album_touched = {}
+
+# квоты пользователя, None — без ограничения
+USER_QUOTA_BYTES = getattr(config, "USER_QUOTA_BYTES", 500 * 1024 * 1024)
+USER_QUOTA_FILES = getattr(config, "USER_QUOTA_FILES", 200)
+
+# сколько апдейтов (разных пользователей) обрабатывается одновременно,
+# 1 — строго по очереди, как раньше
+CONCURRENT_UPDATES = getattr(config, "CONCURRENT_UPDATES", 64)
+
+# создаются в build_app: импорт bot не трогает диск и базу
+db = None
+users = None
+files = None
+previews = None
+janitor = None
+
+# ===================== METRICS =====================
+
+STATE_NAMES = {
+    LANG: "lang",
+    MENU: "menu",
+    COLLECT: "collect",
+    NAME: "name",
+    FILES_MENU: "files_menu",
+    SETTINGS_MENU: "settings_menu",
+    RENAME: "rename",
+    MERGE_SELECT: "merge_select",
+}
+
+CONVERSATION_NAME = "main"
+
+# SQLitePersistence, созданный build_app
+_persistence = None
+_metrics_server = None
+# ключи диалогов (chat_id, user_id), в которых идёт PDF-задача
+_job_keys = set()
+
+
+def _conversation_key(update: Update) -> tuple:
+    # как у ConversationHandler с per_chat и per_user
+    return (update.effective_chat.id, update.effective_user.id)
+
+
+def _conversations_by_state() -> dict:
+    counts = dict.fromkeys(((name,) for name in (*STATE_NAMES.values(), "job")), 0)
+    if _persistence is not None:
+        for key, state in _persistence.conversation_states(CONVERSATION_NAME).items():
+            # во время задачи сохранено состояние, из которого она запущена
+            name = "job" if key in _job_keys else STATE_NAMES.get(state)
+            if name:
+                counts[(name,)] += 1
+    return counts
+
+
+metrics.gauge(
+    "bot_conversations_active", "Active conversations by state", ("state",),
+    fn=_conversations_by_state,
+)
+# users нет до init_storage, а в процессе-приёмнике (WORKERS > 1) — вообще
+metrics.counter(
+    "db_user_cache_hits_total", "UserCache hits",
+    fn=lambda: {(): users.cache.hits} if users is not None else {},
+)
+metrics.counter(
+    "db_user_cache_misses_total", "UserCache misses",
+    fn=lambda: {(): users.cache.misses} if users is not None else {},
+)
 
 # ===================== START =====================
 
+@timed_handler
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_user(update, "started bot")
-    users.get_or_create(update.effective_user.id)
+    await users.get_or_create(update.effective_user.id)
+    _drop_pages(update.effective_user.id)
     context.user_data.clear()
     context.user_data["lang"] = "en"
 
@@ -114,12 +180,13 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ===================== LANGUAGE =====================
 
+@timed_handler
 async def set_lang(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
 
     lang = q.data.split("_")[1]
-    users.set_language(q.from_user.id, lang)
+    await users.set_language(q.from_user.id, lang)
     context.user_data["lang"] = lang
 
     await update_ui(
@@ -132,34 +199,43 @@ async def set_lang(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ===================== MENU =====================
 
+@timed_handler
 async def menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     lang = context.user_data["lang"]
 
     if q.data == "create":
-        context.user_data["images"] = []
+        _drop_pages(q.from_user.id)
         await update_ui(update, context, TEXT[lang]["collect_images"], collect_kb(lang))
         return COLLECT
 
     if q.data == "files":
-        return await show_files(update, context)
+        return await _show_files(update, context)
 
     if q.data == "settings":
         await update_ui(update, context, TEXT[lang]["choose_language"], lang_kb())
         return SETTINGS_MENU
 
     if q.data in ("back_menu", "files"):
+        context.user_data.pop("files_page", None)
         await update_ui(update, context, TEXT[lang]["menu_title"], main_menu(lang))
         return MENU
 
 # ===================== FILE LIST =====================
 
-async def show_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def _show_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_user(update, "opened My Files")
     lang = context.user_data["lang"]
-    user = users.get_or_create(update.effective_user.id)
-    items = files.list(user["id"])
+    user = await users.get_or_create(update.effective_user.id)
+
+    cursor, direction = context.user_data.get("files_page", (None, "next"))
+    items, has_prev, has_next = await files.page(user["id"], cursor, direction)
+
+    if not items and cursor is not None:
+        # страница опустела (например, после удаления) — показываем первую
+        context.user_data.pop("files_page", None)
+        items, has_prev, has_next = await files.page(user["id"])
 
     if not items:
         await update_ui(update, context, TEXT[lang]["no_files"], main_menu(lang))
@@ -173,74 +249,349 @@ async def show_files(update: Update, context: ContextTypes.DEFAULT_TYPE):
         update,
         context,
         text,
-        reply_markup=files_list_kb(items, lang)
+        reply_markup=files_list_kb(items, lang, has_prev, has_next)
     )
     return FILES_MENU
 
+@timed_handler
+async def files_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    _, direction, cursor = q.data.split("_")
+    context.user_data["files_page"] = (int(cursor), direction)
+    return await _show_files(update, context)
+
 # ===================== COLLECT IMAGES =====================
 
+@timed_handler
 async def photo_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    context.user_data.setdefault("images", [])
-
-    file = await update.message.photo[-1].get_file()
-    path = os.path.join(
-        STORAGE_TEMP,
-        f"{update.effective_user.id}_{len(context.user_data['images'])}.jpg"
+    """
+    Фото не скачивается в обработчике: загрузка и рендер страницы идут
+    в фоне, поэтому все фото альбома (media group) качаются параллельно.
+    Порядок страниц восстанавливается по message_id.
+    """
+    message = update.message
+    name = f"{update.effective_user.id}_{uuid.uuid4().hex}"
+    img_path = os.path.join(STORAGE_TEMP, name + ".jpg")
+    page_path = os.path.join(STORAGE_TEMP, name + ".pdf")
+
+    photo = message.photo[-1]
+    task = asyncio.create_task(_ingest_photo(photo, img_path, page_path))
+    task.add_done_callback(lambda t, msg_id=message.message_id: _ingest_done(t, msg_id))
+    _albums.setdefault(update.effective_user.id, []).append(
+        (message.message_id, img_path, page_path, task, photo.file_size or 0)
     )
-    await file.download_to_drive(path)
-    context.user_data["images"].append(path)
-
+    _album_touched[update.effective_user.id] = time.monotonic()
+
+async def _ingest_photo(photo, img_path: str, page_path: str):
+    """
+    Скачивает фото (на диск или в память, см. PHOTO_IN_MEMORY)
+    и сразу рендерит его страницу в пуле.
+    Возвращает (источник, отрендерена ли страница).
+    """
+    async with _download_slots:
+        file = await photo.get_file()
+        if PHOTO_IN_MEMORY:
+            src = bytes(await file.download_as_bytearray())
+        else:
+            await file.download_to_drive(img_path)
+            src = img_path
+
+    try:
+        await pdf_jobs.run(PDFService.render_page, src, page_path)
+        return src, True
+    except JobError:
+        return src, False
+
+def _ingest_done(task: asyncio.Task, msg_id: int):
+    # ошибку забираем и у задач, которые никто не дождётся (_drop_pages)
+    if not task.cancelled() and task.exception() is not None:
+        logging.warning("⚠️ Photo %s ingest failed: %r", msg_id, task.exception())
+
+async def _finish_pages(user_id: int) -> tuple[list[str], int]:
+    """
+    Дожидается фоновой загрузки и рендера страниц.
+    Страницы, которые не смогли отрендериться
+    (например, очередь была переполнена), рендерятся повторно.
+    Возвращает (страницы, сколько фото пропущено из-за ошибок).
+    """
+    pages = []
+    dropped = 0
+    for msg_id, img_path, page_path, task, _ in sorted(_albums.get(user_id, [])):
+        try:
+            src, rendered = await task
+        except Exception:
+            # ошибка уже в логе (_ingest_done)
+            dropped += 1
+            continue
+
+        if not rendered:
+            await pdf_jobs.run(PDFService.render_page, src, page_path)
+        pages.append(page_path)
+    return pages, dropped
+
+def _drop_pages(user_id: int):
+    _album_touched.pop(user_id, None)
+    for msg_id, img_path, page_path, task, _ in _albums.pop(user_id, []):
+        task.cancel()
+        _remove_quietly(img_path)
+        _remove_quietly(page_path)
+
+@timed_handler
 async def collect_actions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     lang = context.user_data["lang"]
 
     if q.data == "done":
-        if not context.user_data.get("images"):
+        if not _albums.get(q.from_user.id):
             await update_ui(update, context, TEXT[lang]["no_images"], main_menu(lang))
             return MENU
         await update_ui(update, context, TEXT[lang]["enter_pdf_name"])
         return NAME
 
     if q.data == "cancel":
-        context.user_data.pop("images", None)
+        _drop_pages(q.from_user.id)
         await update_ui(update, context, TEXT[lang]["cancelled"], main_menu(lang))
         return MENU
 
+# ===================== PREVIEWS =====================
+
+_preview_tasks = {}
+# PDF без подходящего изображения на первой странице — не пробуем снова
+_no_preview = set()
+
+
+def _schedule_preview(sha256: str | None, pdf_path: str):
+    """
+    Превью собирается в фоне — ответ пользователю его не ждёт
+    """
+    if not sha256 or sha256 in previews or sha256 in _no_preview or sha256 in _preview_tasks:
+        return
+    task = asyncio.create_task(_build_preview(sha256, pdf_path))
+    _preview_tasks[sha256] = task
+    task.add_done_callback(lambda _: _preview_tasks.pop(sha256, None))
+
+
+async def _build_preview(sha256: str, pdf_path: str):
+    tmp = os.path.join(STORAGE_TEMP, f"{uuid.uuid4().hex}.jpg")
+    try:
+        if await pdf_jobs.run(PDFService.make_preview, pdf_path, tmp):
+            previews.add(sha256, tmp)
+        else:
+            _no_preview.add(sha256)
+    except (JobError, OSError) as e:
+        logging.info("Preview for %s skipped: %r", sha256[:12], e)
+    except Exception as e:
+        logging.warning("⚠️ Preview for %s failed: %r", sha256[:12], e)
+        _no_preview.add(sha256)
+    finally:
+        _remove_quietly(tmp)
+
+# ===================== STORAGE =====================
+
+QUOTA_REJECTED = metrics.counter(
+    "bot_quota_rejected_total", "PDF jobs refused because of the user quota", ("job",)
+)
+
+
+def _album_bytes(user_id: int) -> int:
+    """
+    Размер фото альбома — оценка размера будущего PDF
+    (JPEG кладутся в PDF без перекодирования). Размер из Telegram
+    известен до загрузки и не зависит от PHOTO_IN_MEMORY; если его нет —
+    размер уже скачанного фото, в памяти или на диске.
+    """
+    total = 0
+    for _, img_path, _, task, size in _albums.get(user_id, []):
+        if not size and task.done() and not task.cancelled() and task.exception() is None:
+            src = task.result()[0]
+            if isinstance(src, bytes):
+                size = len(src)
+        if not size:
+            try:
+                size = os.path.getsize(img_path)
+            except OSError:
+                pass
+        total += size
+    return total
+
+
+async def _check_quota(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    user_id: int,
+    job: str,
+    size: int,
+) -> bool:
+    """
+    Поместится ли ещё один файл примерно size байт.
+    Проверяется до того, как задача займёт процесс пула.
+    """
+    used, count = await users.usage(user_id)
+    if (USER_QUOTA_FILES is None or count < USER_QUOTA_FILES) and (
+        USER_QUOTA_BYTES is None or used + size <= USER_QUOTA_BYTES
+    ):
+        return True
+
+    QUOTA_REJECTED.inc(job)
+    lang = context.user_data["lang"]
+    text = TEXT[lang]["quota_exceeded"].format(
+        used=_format_size(used),
+        limit=_format_size(USER_QUOTA_BYTES) if USER_QUOTA_BYTES is not None else "∞",
+        files=count,
+        max_files=USER_QUOTA_FILES if USER_QUOTA_FILES is not None else "∞",
+    )
+    await reset_ui(update, context, text, main_menu(lang))
+    return False
+
+
+def _live_temp_files() -> set:
+    """
+    Временные файлы собираемых альбомов — их janitor не трогает.
+    Альбомы, в которые давно ничего не приходило, освобождаются.
+    """
+    now = time.monotonic()
+    for user_id, touched in list(_album_touched.items()):
+        if now - touched > TEMP_MAX_AGE:
+            _drop_pages(user_id)
+
+    return {
+        path
+        for album in _albums.values()
+        for _, img_path, page_path, _, _ in album
+        for path in (img_path, page_path)
+    }
+
+# ===================== JOBS =====================
+
+async def _start_job(update: Update, context: ContextTypes.DEFAULT_TYPE) -> str:
+    """
+    Новая PDF-задача пользователя: id в user_data (по нему её
+    отменяет кнопка Cancel) и UI-сообщение с прогрессом.
+    """
+    job_id = uuid.uuid4().hex
+    context.user_data["job_id"] = job_id
+    _job_keys.add(_conversation_key(update))
+    lang = context.user_data["lang"]
+    await update_ui(update, context, TEXT[lang]["working"], job_kb(lang))
+    return job_id
+
+
+async def _run_job(update: Update, context: ContextTypes.DEFAULT_TYPE, job_id: str, fn, *args):
+    """
+    pdf_jobs.run с прогрессом в UI-сообщении. Частоту обновлений
+    ограничивают PDF_PROGRESS_INTERVAL и схлопывание запросов в ui.py.
+    """
+    if context.user_data.get("job_cancel") == job_id:
+        raise JobCancelled()
+
+    lang = context.user_data["lang"]
+
+    async def on_progress(done: int, total: int):
+        text = TEXT[lang]["progress"].format(done=done, total=total)
+        await update_ui(update, context, text, job_kb(lang))
+
+    return await pdf_jobs.run(fn, *args, job_id=job_id, on_progress=on_progress)
+
+
+def _end_job(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    _job_keys.discard(_conversation_key(update))
+    context.user_data.pop("job_id", None)
+    context.user_data.pop("job_cancel", None)
+
+
+@timed_handler
+async def job_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    job_id = context.user_data.get("job_id")
+    if job_id and not pdf_jobs.cancel(job_id):
+        # задача ещё не дошла до пула (например, качаются фото)
+        context.user_data["job_cancel"] = job_id
+    await q.answer(TEXT[context.user_data["lang"]]["cancelled"])
+    # новое состояние вернёт обработчик самой задачи
+
+@timed_handler
+async def job_busy(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Нажатия во время задачи ничего не запускают — пользователь
+    видит окно «ещё выполняется» и повторяет нажатие после неё
+    """
+    await update.callback_query.answer(
+        TEXT[context.user_data["lang"]]["job_running"], show_alert=True
+    )
+
 # ===================== CREATE PDF =====================
 
+@timed_handler
 async def create_pdf(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_user(update, f"created PDF '{update.message.text.strip()}'")
     lang = context.user_data["lang"]
     name = update.message.text.strip()
-    user = users.get_or_create(update.effective_user.id)
+    user = await users.get_or_create(update.effective_user.id)
+
+    if not await _check_quota(update, context, user["id"], "create", _album_bytes(update.effective_user.id)):
+        _drop_pages(update.effective_user.id)
+        return MENU
 
-    file_id = files.create(user["id"], name, "")
-    stored = f"{file_id:06}.pdf"
-    pdf_path = os.path.join(STORAGE_PDF, stored)
+    file_id = await files.create(user["id"], name, "")
+    # PDF собирается во временный файл, затем переносится в хранилище по sha256
+    tmp_path = os.path.join(STORAGE_PDF, f"{file_id:06}.pdf.part")
+
+    job_id = await _start_job(update, context)
+    try:
+        pages, dropped = await _finish_pages(update.effective_user.id)
+        if not pages:
+            raise JobError("No photos could be downloaded")
+        info = await _run_job(update, context, job_id, PDFService.join_pages, pages, tmp_path)
+
+        stored = await files.store(file_id, tmp_path, info)
+        pdf_path = os.path.join(STORAGE_PDF, stored)
+        caption = TEXT[lang]["pdf_created"]
+        if dropped:
+            caption += "\n" + TEXT[lang]["pages_dropped"].format(count=dropped)
+        with open(pdf_path, "rb") as f:
+            msg = await update.message.reply_document(
+                document=f,
+                filename=f"{name}.pdf",
+                caption=caption
+            )
+    except Exception as e:
+        # любая ошибка: запись не должна остаться в квоте, а UI — в режиме задачи
+        await files.delete(file_id, user["id"])
+        _remove_quietly(tmp_path)
+
+        if isinstance(e, JobCancelled):
+            _drop_pages(update.effective_user.id)
+            await reset_ui(update, context, TEXT[lang]["cancelled"], main_menu(lang))
+            return MENU
 
-    PDFService.images_to_pdf(context.user_data["images"], pdf_path)
-    files.set_stored_name(file_id, stored)
+        logging.warning(
+            "⚠️ PDF build for user %s failed: %r", update.effective_user.id, e,
+            exc_info=not isinstance(e, JobError),
+        )
+        if isinstance(e, JobQueueFull):
+            # изображения сохраняем — пользователь может повторить ввод имени
+            await reset_ui(update, context, TEXT[lang]["busy"])
+            return NAME
 
-    await update.message.reply_document(
-        document=open(pdf_path, "rb"),
-        filename=f"{name}.pdf",
-        caption=TEXT[lang]["pdf_created"]
-    )
+        await reset_ui(update, context, TEXT[lang]["error"], main_menu(lang))
+        return MENU
+    finally:
+        _end_job(update, context)
 
-    for img in context.user_data["images"]:
-        try:
-            os.remove(img)
-        except FileNotFoundError:
-            pass
+    await files.set_tg_file_id(file_id, msg.document.file_id)
+    _schedule_preview(info["sha256"], pdf_path)
 
-    context.user_data["images"] = []
+    _drop_pages(update.effective_user.id)
 
     await reset_ui(update, context, TEXT[lang]["menu_title"], main_menu(lang))
     return MENU
 
 # ===================== FILE CRUD =====================
 
+@timed_handler
 async def file_select_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     fid = int(update.callback_query.data.split("_")[1])
     log_user(update, f"selected file #{fid}")
@@ -249,20 +600,47 @@ async def file_select_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
     lang = context.user_data["lang"]
 
     fid = int(q.data.split("_")[1])
-    file = files.get(fid, users.get_or_create(q.from_user.id)["id"])
+    user = await users.get_or_create(q.from_user.id)
+    file = await files.get(fid, user["id"])
 
     if not file:
         await reset_ui(update, context, TEXT[lang]["file_not_found"], main_menu(lang))
         return MENU
 
+    sha = file["sha256"]
+    preview = previews.get(sha)
+    if preview is not None:
+        await photo_ui(
+            update,
+            context,
+            preview,
+            _file_text(file, lang),
+            file_actions_kb(fid, lang),
+            on_photo=lambda tg_id: previews.remember(sha, tg_id),
+        )
+        return FILES_MENU
+
     await update_ui(
         update,
         context,
-        f"📄 {file['original_name']}",
+        _file_text(file, lang),
         file_actions_kb(fid, lang)
     )
+    # файлы, созданные до появления превью, получают его при первом просмотре
+    if file["stored_name"]:
+        _schedule_preview(sha, os.path.join(STORAGE_PDF, file["stored_name"]))
     return FILES_MENU
 
+def _file_text(file: dict, lang: str) -> str:
+    text = f"📄 {file['original_name']}"
+    if file["pages"] is not None:
+        text += "\n" + TEXT[lang]["file_info"].format(
+            pages=file["pages"],
+            size=_format_size(file["size"]),
+        )
+    return text
+
+@timed_handler
 async def file_download_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     fid = int(update.callback_query.data.split("_")[1])
     log_user(update, f"downloaded file #{fid}")
@@ -271,8 +649,8 @@ async def file_download_handler(update: Update, context: ContextTypes.DEFAULT_TY
     lang = context.user_data["lang"]
 
     fid = int(q.data.split("_")[1])
-    user = users.get_or_create(q.from_user.id)
-    file = files.get(fid, user["id"])
+    user = await users.get_or_create(q.from_user.id)
+    file = await files.get(fid, user["id"])
 
     if not file or not file["stored_name"]:
         await reset_ui(update, context, TEXT[lang]["error"], main_menu(lang))
@@ -283,34 +661,116 @@ async def file_download_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await reset_ui(update, context, TEXT[lang]["error"], main_menu(lang))
         return MENU
 
-    await q.message.reply_document(
-        document=open(path, "rb"),
-        filename=f"{file['original_name']}.pdf"
-    )
+    if not await _send_cached_document(q.message, file):
+        with open(path, "rb") as f:
+            msg = await q.message.reply_document(
+                document=f,
+                filename=f"{file['original_name']}.pdf"
+            )
+        await files.set_tg_file_id(fid, msg.document.file_id)
 
     await reset_ui(update, context, TEXT[lang]["menu_title"], main_menu(lang))
     return MENU
 
+async def _send_cached_document(message, file: dict) -> bool:
+    """
+    Отправляет PDF по сохранённому file_id.
+    False — file_id нет или Telegram его больше не принимает.
+    """
+    if not file["tg_file_id"]:
+        return False
+
+    try:
+        await message.reply_document(document=file["tg_file_id"])
+        return True
+    except BadRequest:
+        await files.set_tg_file_id(file["id"], None)
+        return False
+
+@timed_handler
 async def file_delete_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    lang = context.user_data["lang"]
 
-    user = users.get_or_create(q.from_user.id)
+    user = await users.get_or_create(q.from_user.id)
     fid = int(q.data.split("_")[1])
-    file = files.get(fid, user["id"])
+    await files.delete(fid, user["id"])
+    return await _show_files(update, context)
 
-    if file and file["stored_name"]:
-        try:
-            os.remove(os.path.join(STORAGE_PDF, file["stored_name"]))
-        except FileNotFoundError:
-            pass
+# ===================== OPTIMIZE =====================
 
-    files.delete(fid, user["id"])
-    return await show_files(update, context)
+@timed_handler
+async def optimize_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    fid = int(q.data.split("_")[1])
+
+    lang = context.user_data["lang"]
+    await update_ui(update, context, TEXT[lang]["optimize_choose"], optimize_kb(fid, lang))
+    return FILES_MENU
+
+@timed_handler
+async def optimize_apply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+    lang = context.user_data["lang"]
+
+    _, preset, fid = q.data.split("_")
+    fid = int(fid)
+    log_user(update, f"optimized file #{fid} ({preset})")
+    user = await users.get_or_create(q.from_user.id)
+    file = await files.get(fid, user["id"])
+
+    if not file or not file["stored_name"]:
+        await reset_ui(update, context, TEXT[lang]["file_not_found"], main_menu(lang))
+        return MENU
+
+    path = os.path.join(STORAGE_PDF, file["stored_name"])
+    out = os.path.join(STORAGE_PDF, f"{fid:06}.opt.part")
+
+    job_id = await _start_job(update, context)
+    try:
+        info = await _run_job(update, context, job_id, PDFService.optimize, path, out, preset)
+
+        if info["size"] >= info["before"]:
+            _remove_quietly(out)
+            result = TEXT[lang]["optimize_no_gain"]
+        else:
+            await files.store(fid, out, info)
+            # первая страница та же, только сжатая
+            previews.link(file["sha256"], info["sha256"])
+            file.update(size=info["size"], pages=info["pages"], sha256=info["sha256"])
+            result = TEXT[lang]["optimized"].format(
+                before=_format_size(info["before"]),
+                after=_format_size(info["size"]),
+            )
+    except Exception as e:
+        # исходный файл не тронут — возвращаемся к его действиям
+        _remove_quietly(out)
+        if isinstance(e, JobCancelled):
+            text = TEXT[lang]["cancelled"]
+        else:
+            logging.warning(
+                "⚠️ Optimize of file %s failed: %r", fid, e,
+                exc_info=not isinstance(e, (JobError, OSError)),
+            )
+            text = TEXT[lang]["busy" if isinstance(e, JobQueueFull) else "error"]
+        await update_ui(update, context, text, file_actions_kb(fid, lang))
+        return FILES_MENU
+    finally:
+        _end_job(update, context)
+
+    await update_ui(
+        update,
+        context,
+        _file_text(file, lang) + "\n\n" + result,
+        file_actions_kb(fid, lang)
+    )
+    return FILES_MENU
 
 # ===================== RENAME =====================
 
+@timed_handler
 async def rename_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
@@ -319,12 +779,13 @@ async def rename_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update_ui(update, context, TEXT[context.user_data["lang"]]["rename"] + ":")
     return RENAME
 
+@timed_handler
 async def rename_apply(update: Update, context: ContextTypes.DEFAULT_TYPE):
     log_user(update, "renamed file")
     fid = context.user_data.pop("rename_id")
-    user = users.get_or_create(update.effective_user.id)
+    user = await users.get_or_create(update.effective_user.id)
 
-    files.rename(fid, user["id"], update.message.text.strip())
+    await files.rename(fid, user["id"], update.message.text.strip())
 
     await reset_ui(
         update,
@@ -336,67 +797,200 @@ async def rename_apply(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ===================== MERGE =====================
 
+@timed_handler
 async def merge_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    context.user_data["merge_ids"] = set()
-    return await merge_show(update, context)
+    context.user_data["merge_ids"] = []
+    context.user_data.pop("merge_page", None)
+    return await _merge_show(update, context)
 
+@timed_handler
+async def merge_page_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    await q.answer()
+
+    direction, cursor = q.data.split("_")[2:]
+    context.user_data["merge_page"] = (int(cursor), direction)
+    return await _merge_show(update, context)
+
+@timed_handler
 async def merge_toggle(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     fid = int(q.data.split("_")[2])
 
-    context.user_data.setdefault("merge_ids", set())
-    context.user_data["merge_ids"].symmetric_difference_update({fid})
-    return await merge_show(update, context)
+    ids = _merge_selection(context)
+    if fid in ids:
+        ids.remove(fid)
+    else:
+        ids.append(fid)
+
+    markup = q.message.reply_markup if q.message else None
+    if not markup:
+        return await _merge_show(update, context)
+
+    # клавиатура уже на экране — обновляем только отметки
+    lang = context.user_data["lang"]
+    await update_ui(
+        update,
+        context,
+        TEXT[lang]["merge_select"],
+        merge_toggle_kb(markup, set(ids))
+    )
+    return MERGE_SELECT
 
-async def merge_show(update: Update, context: ContextTypes.DEFAULT_TYPE):
+def _merge_selection(context: ContextTypes.DEFAULT_TYPE) -> list:
+    """
+    Файлы для объединения в порядке выбора — в нём они и склеиваются
+    """
+    ids = context.user_data.get("merge_ids")
+    # сессии, сохранённые до перехода на список, хранят множество
+    if not isinstance(ids, list):
+        ids = context.user_data["merge_ids"] = sorted(ids or ())
+    return ids
+
+async def _merge_show(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str | None = None):
     lang = context.user_data["lang"]
-    context.user_data.setdefault("merge_ids", set())
+    selected = set(_merge_selection(context))
 
-    user = users.get_or_create(update.effective_user.id)
-    items = files.list(user["id"])
+    user = await users.get_or_create(update.effective_user.id)
+    cursor, direction = context.user_data.get("merge_page", (None, "next"))
+    items, has_prev, has_next = await files.page(user["id"], cursor, direction)
 
     await update_ui(
         update,
         context,
-        TEXT[lang]["merge_select"],
-        merge_files_kb(items, context.user_data["merge_ids"], lang)
+        text or TEXT[lang]["merge_select"],
+        merge_files_kb(items, selected, lang, has_prev, has_next)
     )
     return MERGE_SELECT
 
+@timed_handler
 async def merge_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    ids = list(context.user_data.get("merge_ids", []))
+    ids = list(_merge_selection(context))
     log_user(update, f"merged files {ids}")
     q = update.callback_query
     await q.answer()
 
     lang = context.user_data["lang"]
-    ids = list(context.user_data.get("merge_ids", []))
-    user = users.get_or_create(q.from_user.id)
+    user = await users.get_or_create(q.from_user.id)
 
     if len(ids) < 2:
-        return await merge_show(update, context)
+        return await _merge_show(update, context)
+
+    paths = await files.get_paths(ids, user["id"])
+    size = sum(os.path.getsize(path) for path in paths)
+    if not await _check_quota(update, context, user["id"], "merge", size):
+        return MENU
 
-    paths = files.get_paths(ids, user["id"])
+    fid = await files.create(user["id"], "Merged PDF", "")
+    out = os.path.join(STORAGE_PDF, f"{fid:06}.pdf.part")
 
-    fid = files.create(user["id"], "Merged PDF", "")
-    stored = f"{fid:06}.pdf"
-    out = os.path.join(STORAGE_PDF, stored)
+    job_id = await _start_job(update, context)
+    try:
+        info = await _run_job(update, context, job_id, PDFService.merge_pdfs, paths, out)
+        stored = await files.store(fid, out, info)
+    except Exception as e:
+        await files.delete(fid, user["id"])
+        _remove_quietly(out)
 
-    PDFService.merge_pdfs(paths, out)
-    files.set_stored_name(fid, stored)
+        # выбор файлов сохраняется — можно сразу повторить
+        if isinstance(e, JobCancelled):
+            return await _merge_show(update, context, TEXT[lang]["cancelled"])
+
+        logging.warning(
+            "⚠️ Merge for user %s failed: %r", q.from_user.id, e,
+            exc_info=not isinstance(e, JobError),
+        )
+        if isinstance(e, JobQueueFull):
+            return await _merge_show(update, context, TEXT[lang]["busy"])
+
+        await reset_ui(update, context, TEXT[lang]["error"], main_menu(lang))
+        return MENU
+    finally:
+        _end_job(update, context)
+
+    # первая страница результата — первая страница первого выбранного файла
+    first = await files.get(ids[0], user["id"])
+    if not previews.link(first and first["sha256"], info["sha256"]):
+        _schedule_preview(info["sha256"], os.path.join(STORAGE_PDF, stored))
 
     context.user_data.pop("merge_ids", None)
+    context.user_data.pop("merge_page", None)
 
     await reset_ui(update, context, TEXT[lang]["pdf_created"], main_menu(lang))
     return MENU
 
 # ===================== MAIN =====================
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+async def on_startup(app):
+    global _metrics_server
+    _metrics_server = await metrics.serve()
+    janitor.start()
+
+
+async def on_stop(app):
+    # бот ещё может отправлять запросы — дорисовываем отложенный UI
+    await ui.shutdown()
+    # превью необязательны: отменяем, пока пул ещё принимает флаги отмены
+    for task in list(_preview_tasks.values()):
+        task.cancel()
+    await asyncio.gather(*_preview_tasks.values(), return_exceptions=True)
+
+
+async def on_shutdown(app):
+    if _metrics_server is not None:
+        _metrics_server.close()
+    await janitor.stop()
+    # в потоке: цикл событий должен успеть забрать результаты прерванных задач
+    await asyncio.to_thread(pdf_jobs.shutdown)
+    db.close()
+
+
+def init_storage():
+    """
+    Каталоги хранилища, база (с миграциями), кэш превью и janitor
+    """
+    global db, users, files, previews, janitor
+    os.makedirs(STORAGE_PDF, exist_ok=True)
+    os.makedirs(STORAGE_TEMP, exist_ok=True)
+
+    db = Database()
+    users = UserRepo(db)
+    files = FileRepo(db)
+    previews = PreviewCache()
+    janitor = Janitor(
+        [(STORAGE_TEMP, ""), (STORAGE_PDF, ".part"), (previews.root, ".part")],
+        live=_live_temp_files,
+        files=files,
+    )
+
+
+def build_app():
+    """
+    Приложение со всеми обработчиками.
+    BOT_API_URL / BOT_FILE_URL в config — локальный Bot API сервер
+    (или фейковый из loadtest.py).
+    """
+    global _persistence
+    init_storage()
+    _persistence = SQLitePersistence(StateRepo(db))
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .persistence(_persistence)
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if getattr(config, "BOT_API_URL", None):
+        builder = builder.base_url(config.BOT_API_URL)
+    if getattr(config, "BOT_FILE_URL", None):
+        builder = builder.base_file_url(config.BOT_FILE_URL)
+    if CONCURRENT_UPDATES > 1:
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(CONCURRENT_UPDATES))
+    app = builder.build()
 
     conv = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
@@ -407,29 +1001,69 @@ def main():
                 MessageHandler(filters.PHOTO, photo_handler),
                 CallbackQueryHandler(collect_actions),
             ],
-            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, create_pdf)],
+            NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, create_pdf, block=False)],
             FILES_MENU: [
                 CallbackQueryHandler(rename_start, pattern="^rename_"),
                 CallbackQueryHandler(merge_start, pattern="^merge_start$"),
                 CallbackQueryHandler(file_select_handler, pattern="^file_"),
                 CallbackQueryHandler(file_download_handler, pattern="^download_"),
                 CallbackQueryHandler(file_delete_handler, pattern="^delete_"),
+                CallbackQueryHandler(optimize_start, pattern="^optimize_\\d+$"),
+                CallbackQueryHandler(
+                    optimize_apply,
+                    pattern=f"^opt_({'|'.join(OPTIMIZE_PRESETS)})_\\d+$",
+                    block=False,
+                ),
+                CallbackQueryHandler(files_page_handler, pattern="^files_(prev|next)_"),
                 CallbackQueryHandler(menu_handler),
             ],
             RENAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, rename_apply)],
             MERGE_SELECT: [
                 CallbackQueryHandler(merge_toggle, pattern="^merge_toggle_"),
-                CallbackQueryHandler(merge_done, pattern="^merge_done$"),
+                CallbackQueryHandler(merge_page_handler, pattern="^merge_page_(prev|next)_"),
+                CallbackQueryHandler(merge_done, pattern="^merge_done$", block=False),
                 CallbackQueryHandler(menu_handler, pattern="^back_menu$"),
             ],
             SETTINGS_MENU: [CallbackQueryHandler(set_lang)],
+            # PDF-задачи (block=False) идут в фоне, апдейты пользователя
+            # в это время попадают сюда: отмена или ответ «уже выполняется»
+            ConversationHandler.WAITING: [
+                CallbackQueryHandler(job_cancel, pattern="^job_cancel$"),
+                CallbackQueryHandler(job_busy),
+            ],
         },
         fallbacks=[CommandHandler("start", start)],
         allow_reentry=True,
+        # после перезапуска пользователь продолжает с того же шага
+        name=CONVERSATION_NAME,
+        persistent=True,
     )
 
     app.add_handler(conv)
-    app.run_polling()
+    return app
+
+
+def main():
+    listener = setup_logging()
+    logging.info("🚀 Bot process initialized")
+    try:
+        if cluster.WORKERS > 1:
+            # этот процесс только принимает апдейты — база и PDF в воркерах,
+            # миграции применяются один раз до их запуска
+            Database().close()
+            cluster.serve()
+        else:
+            run(build_app())
+    finally:
+        # дописываем очередь логов
+        listener.stop()
+
+
+def run(app):
+    if WEBHOOK_URL:
+        app.run_webhook(**webhook_settings())
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
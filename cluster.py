@@ -0,0 +1,293 @@
+"""
+Режим нескольких процессов: WORKERS = 4 в config.py, запуск как обычно (bot.py).
+
+Процесс-приёмник получает апдейты (long polling или вебхук) и раздаёт их
+воркерам по user id: все апдейты пользователя попадают в один процесс
+и в порядке получения, поэтому состояние ConversationHandler согласовано.
+Каждый воркер (worker.py) — обычный бот со своим event loop, соединением
+SQLite к общей базе (WAL) и пулом PDF-процессов.
+
+Воркер, который завершился или перестал присылать heartbeat, перезапускается;
+апдейты для него за это время ждут в очереди приёмника. Апдейт, уже отданный
+воркеру, но не обработанный до падения, теряется (доставка не более одного раза).
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import config
+import metrics
+from updates import WEBHOOK_URL, webhook_settings, shard
+
+WORKERS = getattr(config, "WORKERS", 1)
+# как часто воркер сообщает, что его event loop жив, секунды
+WORKER_HEARTBEAT = getattr(config, "WORKER_HEARTBEAT", 5)
+WORKER_HEARTBEAT_TIMEOUT = getattr(config, "WORKER_HEARTBEAT_TIMEOUT", 30)
+# апдейты, ждущие воркера; при переполнении новые отбрасываются
+WORKER_QUEUE_SIZE = getattr(config, "WORKER_QUEUE_SIZE", 10000)
+WORKER_STOP_TIMEOUT = getattr(config, "WORKER_STOP_TIMEOUT", 30)
+
+# настройки config приёмника (с переопределениями) передаются воркеру через окружение,
+# а не в argv — там их видят все пользователи системы
+CONFIG_ENV = "BOT_WORKER_CONFIG"
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+
+_workers = []
+
+ROUTED = metrics.counter(
+    "cluster_updates_routed_total", "Updates delivered to workers", ("worker",)
+)
+DROPPED = metrics.counter(
+    "cluster_updates_dropped_total", "Updates dropped because a worker queue was full", ("worker",)
+)
+RESTARTS = metrics.counter(
+    "cluster_worker_restarts_total", "Worker restarts by reason", ("worker", "reason")
+)
+metrics.gauge(
+    "cluster_worker_up", "1 if the worker process is alive and sends heartbeats", ("worker",),
+    fn=lambda: {(str(w.index),): int(w.healthy()) for w in _workers},
+)
+metrics.gauge(
+    "cluster_worker_queue", "Updates waiting to be delivered to a worker", ("worker",),
+    fn=lambda: {(str(w.index),): w.queue.qsize() for w in _workers},
+)
+
+
+def _config_snapshot() -> dict:
+    snapshot = {}
+    for name, value in vars(config).items():
+        if not name.isupper():
+            continue
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        snapshot[name] = value
+    return snapshot
+
+
+class WorkerProcess:
+    """
+    Один воркер со стороны приёмника: процесс, сокет к нему
+    и очередь апдейтов, которые ещё не отданы.
+    """
+
+    def __init__(self, index: int, count: int):
+        self.index = index
+        self.count = count
+        self.queue = asyncio.Queue(WORKER_QUEUE_SIZE)
+        self.proc = None
+        self.writer = None
+        self.last_seen = 0.0
+        self.restarts = 0
+        # сокет к живому процессу открыт — можно отдавать апдейты
+        self.ready = asyncio.Event()
+        self._reader = None
+        self._sender = None
+        self._restarting = None
+
+    def healthy(self) -> bool:
+        return (
+            self.proc is not None
+            and self.proc.returncode is None
+            and time.monotonic() - self.last_seen <= WORKER_HEARTBEAT_TIMEOUT
+        )
+
+    async def spawn(self):
+        parent, child = socket.socketpair()
+        self.proc = await asyncio.create_subprocess_exec(
+            sys.executable, WORKER_SCRIPT,
+            str(self.index), str(self.count), str(child.fileno()),
+            pass_fds=(child.fileno(),),
+            env={**os.environ, CONFIG_ENV: json.dumps(_config_snapshot())},
+        )
+        child.close()
+
+        reader, self.writer = await asyncio.open_connection(sock=parent)
+        self.last_seen = time.monotonic()
+        self._reader = asyncio.create_task(self._read_heartbeats(reader))
+        if self._sender is None:
+            self._sender = asyncio.create_task(self._send_loop())
+        self.ready.set()
+        logging.info("👷 Worker %s started (pid %s)", self.index, self.proc.pid)
+
+    async def _read_heartbeats(self, reader: asyncio.StreamReader):
+        try:
+            while await reader.readline():
+                self.last_seen = time.monotonic()
+        except ConnectionError:
+            pass
+
+    def send(self, data: bytes):
+        try:
+            self.queue.put_nowait(data)
+        except asyncio.QueueFull:
+            DROPPED.inc(str(self.index))
+            logging.warning("⚠️ Worker %s queue is full, update dropped", self.index)
+
+    async def _send_loop(self):
+        data = None
+        while True:
+            if data is None:
+                data = await self.queue.get()
+            await self.ready.wait()
+            writer = self.writer
+            try:
+                writer.write(data)
+                await writer.drain()
+            except (ConnectionError, OSError):
+                # процесс умер — апдейт уйдёт перезапущенному
+                if self.writer is writer:
+                    self.ready.clear()
+                continue
+            data = None
+            ROUTED.inc(str(self.index))
+
+    async def _kill(self):
+        self.ready.clear()
+        if self._reader is not None:
+            self._reader.cancel()
+        if self.writer is not None:
+            self.writer.close()
+        if self.proc.returncode is None:
+            self.proc.kill()
+        await self.proc.wait()
+
+    def check(self):
+        """
+        Перезапускает завершившийся или зависший воркер — в своей задаче:
+        пауза перед перезапуском не задерживает проверку остальных
+        """
+        if self._restarting is not None and not self._restarting.done():
+            return
+        if self.proc.returncode is not None:
+            reason = "exit"
+        elif time.monotonic() - self.last_seen > WORKER_HEARTBEAT_TIMEOUT:
+            reason = "heartbeat"
+        else:
+            return
+
+        logging.warning(
+            "⚠️ Worker %s is down (%s, code %s), restarting",
+            self.index, reason, self.proc.returncode,
+        )
+        RESTARTS.inc(str(self.index), reason)
+        self._restarting = asyncio.create_task(self._restart())
+
+    async def _restart(self):
+        try:
+            await self._kill()
+            # падающий при старте воркер не перезапускается в цикле без паузы
+            self.restarts += 1
+            await asyncio.sleep(min(30, 2 ** min(self.restarts, 5) / 4))
+            await self.spawn()
+        except Exception as e:
+            # следующая проверка увидит мёртвый процесс и попробует снова
+            logging.warning("⚠️ Worker %s restart failed: %r", self.index, e)
+
+    async def stop(self):
+        """
+        Отдаёт оставшиеся апдейты и закрывает сокет: воркер дорабатывает
+        полученное, сохраняет состояние и завершается сам.
+        """
+        if self._restarting is not None:
+            self._restarting.cancel()
+            await asyncio.gather(self._restarting, return_exceptions=True)
+        if self.proc is None:
+            return
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        while not self.queue.empty() and self.healthy() and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        for task in (self._sender, self._reader):
+            if task is not None:
+                task.cancel()
+        if self.writer is not None:
+            self.writer.close()
+
+        try:
+            await asyncio.wait_for(self.proc.wait(), max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            logging.warning("⚠️ Worker %s did not stop in time, killing", self.index)
+            self.proc.kill()
+            await self.proc.wait()
+
+
+async def _supervise(workers: list, stopping: asyncio.Event):
+    while not stopping.is_set():
+        try:
+            await asyncio.wait_for(stopping.wait(), 1)
+        except asyncio.TimeoutError:
+            pass
+        if stopping.is_set():
+            return
+        for worker in workers:
+            worker.check()
+
+
+def _route(update, workers: list):
+    data = json.dumps(update.to_dict(), ensure_ascii=False).encode() + b"\n"
+    workers[shard(update, len(workers))].send(data)
+
+
+async def _ingress(count: int):
+    from telegram import Bot
+    from telegram.ext import Updater
+
+    bot_kwargs = {}
+    if getattr(config, "BOT_API_URL", None):
+        bot_kwargs["base_url"] = config.BOT_API_URL
+    if getattr(config, "BOT_FILE_URL", None):
+        bot_kwargs["base_file_url"] = config.BOT_FILE_URL
+
+    workers = _workers
+    workers[:] = [WorkerProcess(i, count) for i in range(count)]
+    for worker in workers:
+        await worker.spawn()
+
+    metrics_server = await metrics.serve()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    updates = asyncio.Queue()
+    supervisor = asyncio.create_task(_supervise(workers, stopping))
+    try:
+        async with Updater(Bot(config.BOT_TOKEN, **bot_kwargs), updates) as updater:
+            if WEBHOOK_URL:
+                await updater.start_webhook(**webhook_settings())
+            else:
+                await updater.start_polling()
+            logging.info("🚦 Ingress is routing updates to %s workers", count)
+
+            stop = asyncio.create_task(stopping.wait())
+            while not stopping.is_set():
+                get = asyncio.create_task(updates.get())
+                done, _ = await asyncio.wait((get, stop), return_when=asyncio.FIRST_COMPLETED)
+                if get in done:
+                    _route(get.result(), workers)
+                else:
+                    get.cancel()
+
+            await updater.stop()
+            # уже полученные апдейты тоже отдаём воркерам
+            while not updates.empty():
+                _route(updates.get_nowait(), workers)
+    finally:
+        stopping.set()
+        await supervisor
+        await asyncio.gather(*(worker.stop() for worker in workers))
+        if metrics_server is not None:
+            metrics_server.close()
+
+
+def serve(count: int = WORKERS):
+    """
+    Запускает приёмник и count воркеров, работает до SIGINT / SIGTERM
+    """
+    asyncio.run(_ingress(count))
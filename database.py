@@ -1,50 +1,439 @@
+import asyncio
+import functools
+import logging
+import queue
 import sqlite3
 import os
+import threading
+import time
+from collections import OrderedDict
 from typing import List
+
+import config
+import metrics
 from config import DB_PATH, STORAGE_PDF
 
+# сколько записей максимум попадает в один COMMIT
+DB_BATCH_SIZE = getattr(config, "DB_BATCH_SIZE", 100)
+
+FILES_PAGE_SIZE = getattr(config, "FILES_PAGE_SIZE", 10)
+
+USER_CACHE_SIZE = getattr(config, "USER_CACHE_SIZE", 10000)
+USER_CACHE_TTL = getattr(config, "USER_CACHE_TTL", 600)
+
+
+# ===================== MIGRATIONS =====================
+
+def _m001_initial(cur: sqlite3.Cursor):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        telegram_id INTEGER UNIQUE,
+        language TEXT DEFAULT 'en'
+    )
+    """)
+
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS files (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        original_name TEXT,
+        stored_name TEXT
+    )
+    """)
+
+
+def _m002_tg_file_id(cur: sqlite3.Cursor):
+    # file_id документа в Telegram — повторная отправка без загрузки байтов
+    columns = {r["name"] for r in cur.execute("PRAGMA table_info(files)")}
+    if "tg_file_id" not in columns:
+        cur.execute("ALTER TABLE files ADD COLUMN tg_file_id TEXT")
+
+
+def _m003_files_metadata(cur: sqlite3.Cursor):
+    # внешний ключ в SQLite добавляется только пересборкой таблицы
+    cur.execute("""
+    CREATE TABLE files_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        original_name TEXT,
+        stored_name TEXT,
+        tg_file_id TEXT,
+        size INTEGER,
+        pages INTEGER,
+        sha256 TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+
+    cur.execute("""
+    INSERT INTO files_new (id, user_id, original_name, stored_name, tg_file_id, created_at)
+    SELECT id, user_id, original_name, stored_name, tg_file_id, NULL FROM files
+    """)
+
+    cur.execute("DROP TABLE files")
+    cur.execute("ALTER TABLE files_new RENAME TO files")
+    cur.execute("CREATE INDEX idx_files_user_id ON files (user_id, id)")
+
+
+def _m004_blobs(cur: sqlite3.Cursor):
+    # PDF хранятся по sha256, одинаковые файлы делят один blob
+    cur.execute("""
+    CREATE TABLE blobs (
+        sha256 TEXT PRIMARY KEY,
+        refs INTEGER NOT NULL,
+        size INTEGER
+    )
+    """)
+
+
+def _m005_persistence(cur: sqlite3.Cursor):
+    # состояние диалогов и user_data (persistence.SQLitePersistence)
+    cur.execute("""
+    CREATE TABLE user_data (
+        user_id INTEGER PRIMARY KEY,
+        data TEXT NOT NULL
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE conversations (
+        name TEXT NOT NULL,
+        key TEXT NOT NULL,
+        state TEXT NOT NULL,
+        PRIMARY KEY (name, key)
+    ) WITHOUT ROWID
+    """)
+
+
+def _m006_user_usage(cur: sqlite3.Cursor):
+    # занятое место и число файлов пользователя для квот,
+    # дальше поддерживаются FileRepo при каждом изменении
+    cur.execute("ALTER TABLE users ADD COLUMN bytes_used INTEGER NOT NULL DEFAULT 0")
+    cur.execute("ALTER TABLE users ADD COLUMN files_count INTEGER NOT NULL DEFAULT 0")
+    cur.execute("""
+    UPDATE users SET
+        bytes_used = (SELECT COALESCE(SUM(size), 0) FROM files WHERE user_id=users.id),
+        files_count = (SELECT COUNT(*) FROM files WHERE user_id=users.id)
+    """)
+
+
+MIGRATIONS = [
+    _m001_initial,
+    _m002_tg_file_id,
+    _m003_files_metadata,
+    _m004_blobs,
+    _m005_persistence,
+    _m006_user_usage,
+]
+
 
 # ===================== DATABASE =====================
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    """
+    Одно соединение SQLite, которым владеет отдельный поток.
+
+    Асинхронные обработчики ставят запросы в очередь (run) и не блокируют
+    event loop. Записи не коммитятся по одной: поток делает COMMIT,
+    когда очередь опустела или набралось DB_BATCH_SIZE записей,
+    и только после этого отвечает всем записавшим (group commit).
+
+    Пишущие вызовы (write=True) идут в транзакции BEGIN IMMEDIATE:
+    базу могут делить несколько процессов (WORKERS > 1), и запись
+    в транзакции, начатой чтением, упала бы с SQLITE_BUSY_SNAPSHOT,
+    если другой процесс закоммитил после её первого SELECT.
+
+    Действия с файлами, которые должны совпасть с записью в базе,
+    вызов регистрирует через after_commit: они выполняются только
+    после успешного COMMIT и пропадают вместе с откатом.
+    """
+
+    def __init__(self, path: str = DB_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
         self.conn.row_factory = sqlite3.Row
+        self.pragmas()
         self.init()
 
+        self._queue = queue.SimpleQueue()
+        # транзакция открыта BEGIN IMMEDIATE и уже держит блокировку записи
+        self._immediate = False
+        self._after_commit = []
+        self._thread = threading.Thread(target=self._worker, name="db", daemon=True)
+        self._thread.start()
+
+    def pragmas(self):
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # в WAL-режиме NORMAL не теряет целостность, fsync только на checkpoint
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA temp_store=MEMORY")
+        self.conn.execute("PRAGMA cache_size=-16000")
+        self.conn.execute("PRAGMA busy_timeout=5000")
+
     def init(self):
+        """
+        Применяет недостающие миграции по порядку.
+        Номер последней применённой хранится в schema_version.
+        Каждая миграция вместе с номером — одна транзакция (DDL в SQLite
+        транзакционен): упавшая на середине не оставляет таблиц-обрубков.
+        """
         cur = self.conn.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
 
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            telegram_id INTEGER UNIQUE,
-            language TEXT DEFAULT 'en'
-        )
-        """)
-
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS files (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            original_name TEXT,
-            stored_name TEXT
-        )
-        """)
-
+        row = cur.execute("SELECT version FROM schema_version").fetchone()
+        current = row["version"] if row else 0
+        if not row:
+            cur.execute("INSERT INTO schema_version (version) VALUES (0)")
         self.conn.commit()
 
+        for version, migrate in enumerate(MIGRATIONS, 1):
+            if version <= current:
+                continue
+            # модуль sqlite3 сам не открывает транзакцию перед DDL
+            cur.execute("BEGIN")
+            try:
+                migrate(cur)
+                cur.execute("UPDATE schema_version SET version=?", (version,))
+            except BaseException:
+                self.conn.rollback()
+                raise
+            self.conn.commit()
+
+        # включаем после миграций: пересборка таблиц идёт без проверки ключей
+        self.conn.execute("PRAGMA foreign_keys=ON")
+
+    # ---------- DB THREAD ----------
+
+    async def run(self, fn, *args, write: bool = False):
+        """
+        Выполняет fn(*args) в потоке БД и возвращает результат.
+        Если fn что-то записала — ответ приходит после COMMIT.
+        write — fn может писать: она выполняется под блокировкой записи.
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        self._queue.put((loop, fut, fn, args, write))
+        return await fut
+
+    def _worker(self):
+        pending = []
+
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._commit(pending)
+                break
+
+            loop, fut, fn, args, write = item
+            if write and self.conn.in_transaction and not self._immediate:
+                # снимок транзакции чтения мог устареть — пишем в новой
+                self._commit(pending)
+                pending = []
+
+            changes = self.conn.total_changes
+            try:
+                result = self._call(fn, args, write)
+            except Exception as e:
+                _resolve(loop, fut, error=e)
+                if not self.conn.in_transaction:
+                    # SQLite откатил всю транзакцию — записи пачки потеряны
+                    for p_loop, p_fut, _ in pending:
+                        _resolve(p_loop, p_fut, error=e)
+                    pending = []
+                    self._after_commit = []
+            else:
+                if self.conn.total_changes == changes:
+                    _resolve(loop, fut, result)
+                else:
+                    pending.append((loop, fut, result))
+
+            # COMMIT и без записей: завершает транзакцию чтения
+            if self._queue.empty() or len(pending) >= DB_BATCH_SIZE:
+                self._commit(pending)
+                pending = []
+
+    def _call(self, fn, args: tuple, write: bool = False):
+        """
+        fn(*args) в своей точке сохранения: если вызов упал, его частичные
+        записи откатываются, а записи остальных вызовов пачки остаются.
+        """
+        conn = self.conn
+        # SAVEPOINT вне транзакции сам стал бы транзакцией, и RELEASE её закоммитил
+        if not conn.in_transaction:
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            self._immediate = write
+        conn.execute("SAVEPOINT call")
+        actions = len(self._after_commit)
+        try:
+            result = fn(*args)
+        except Exception:
+            del self._after_commit[actions:]
+            # SQLite мог уже откатить транзакцию целиком (например, SQLITE_FULL)
+            if conn.in_transaction:
+                conn.execute("ROLLBACK TO call")
+                conn.execute("RELEASE call")
+            raise
+        conn.execute("RELEASE call")
+        return result
+
+    def after_commit(self, fn, *args):
+        """
+        Выполнить fn(*args) в потоке БД после COMMIT текущего вызова.
+        Вызывать только изнутри fn, переданной в run.
+        """
+        self._after_commit.append((fn, args))
+
+    def _commit(self, pending: list):
+        actions, self._after_commit = self._after_commit, []
+        try:
+            self.conn.commit()
+        except Exception as e:
+            self.conn.rollback()
+            for loop, fut, _ in pending:
+                _resolve(loop, fut, error=e)
+            return
+
+        # до ответов: вернувшийся store уже может отдавать свой файл
+        for fn, args in actions:
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.warning("⚠️ Post-commit %s failed: %r", fn.__qualname__, e)
+
+        for loop, fut, result in pending:
+            _resolve(loop, fut, result)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self.conn.close()
+
+
+def _resolve(loop, fut, result=None, error=None):
+    def apply():
+        if fut.done():
+            return
+        if error is not None:
+            fut.set_exception(error)
+        else:
+            fut.set_result(result)
+
+    try:
+        loop.call_soon_threadsafe(apply)
+    except RuntimeError:
+        # event loop уже закрыт — отвечать некому
+        pass
+
+
+DB_SECONDS = metrics.histogram(
+    "db_query_seconds", "Repository call time including the DB thread queue", ("method",)
+)
+DB_ERRORS = metrics.counter(
+    "db_query_errors_total", "Repository calls that raised", ("method",)
+)
+
+
+def db_method(fn, write: bool = False):
+    """
+    Превращает синхронный метод репозитория в корутину,
+    которая выполняется в потоке БД.
+    """
+    name = fn.__qualname__
+
+    @functools.wraps(fn)
+    async def wrapper(self, *args):
+        start = time.perf_counter()
+        try:
+            return await self.db.run(fn, self, *args, write=write)
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - start, name)
+    return wrapper
+
+
+def db_write(fn):
+    """
+    db_method для методов, которые пишут в базу
+    """
+    return db_method(fn, write=True)
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# ===================== USER CACHE =====================
+
+class UserCache:
+    """
+    LRU-кэш telegram_id → строка users с ограничением по времени жизни.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def get(self, telegram_id: int) -> dict | None:
+        item = self._items.get(telegram_id)
+        if item is None or item[0] < time.monotonic():
+            self._items.pop(telegram_id, None)
+            self.misses += 1
+            return None
+
+        self._items.move_to_end(telegram_id)
+        self.hits += 1
+        return item[1]
+
+    def put(self, telegram_id: int, user: dict):
+        self._items[telegram_id] = (time.monotonic() + self.ttl, user)
+        self._items.move_to_end(telegram_id)
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def update(self, telegram_id: int, **fields):
+        item = self._items.get(telegram_id)
+        if item is not None:
+            self._items[telegram_id] = (item[0], {**item[1], **fields})
+
+    def invalidate(self, telegram_id: int):
+        self._items.pop(telegram_id, None)
+
 
 # ===================== USER REPO =====================
 
 class UserRepo:
     def __init__(self, db: Database):
         self.db = db
-
-    def get_or_create(self, telegram_id: int) -> dict:
+        self.cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+    async def get_or_create(self, telegram_id: int) -> dict:
+        user = self.cache.get(telegram_id)
+        if user is None:
+            user = await self._get_or_create(telegram_id)
+            self.cache.put(telegram_id, user)
+        # копия — чтобы обработчики не меняли закэшированную строку
+        return dict(user)
+
+    async def set_language(self, telegram_id: int, lang: str):
+        await self._set_language(telegram_id, lang)
+        self.cache.update(telegram_id, language=lang)
+
+    # в кэш попадают только редко меняющиеся поля —
+    # занятое место читается из базы (usage)
+    _CACHED = "id, telegram_id, language"
+
+    @db_write
+    def _get_or_create(self, telegram_id: int) -> dict:
         cur = self.db.conn.cursor()
         cur.execute(
-            "SELECT * FROM users WHERE telegram_id=?",
+            f"SELECT {self._CACHED} FROM users WHERE telegram_id=?",
             (telegram_id,)
         )
         row = cur.fetchone()
@@ -54,45 +443,98 @@ class UserRepo:
                 "INSERT INTO users (telegram_id) VALUES (?)",
                 (telegram_id,)
             )
-            self.db.conn.commit()
-            return self.get_or_create(telegram_id)
+            row = cur.execute(
+                f"SELECT {self._CACHED} FROM users WHERE id=?",
+                (cur.lastrowid,)
+            ).fetchone()
 
         return dict(row)
 
-    def set_language(self, telegram_id: int, lang: str):
+    @db_method
+    def usage(self, user_id: int) -> tuple[int, int]:
+        """
+        (байт, файлов) пользователя — всегда свежие, мимо UserCache
+        """
+        row = self.db.conn.execute(
+            "SELECT bytes_used, files_count FROM users WHERE id=?",
+            (user_id,)
+        ).fetchone()
+        return (row["bytes_used"], row["files_count"]) if row else (0, 0)
+
+    @db_write
+    def _set_language(self, telegram_id: int, lang: str):
         self.db.conn.execute(
             "UPDATE users SET language=? WHERE telegram_id=?",
             (lang, telegram_id)
         )
-        self.db.conn.commit()
 
 
 # ===================== FILE REPO =====================
 
 class FileRepo:
+    """
+    Файлы пользователей. Каждое изменение сразу правит users.bytes_used /
+    files_count в той же транзакции — квоты не требуют SUM по files.
+    """
+
     def __init__(self, db: Database):
         self.db = db
 
+    def _add_usage(self, user_id: int, size: int, count: int = 0):
+        self.db.conn.execute(
+            "UPDATE users SET bytes_used=bytes_used+?, files_count=files_count+? WHERE id=?",
+            (size, count, user_id)
+        )
+
     # ---------- CREATE ----------
 
+    @db_write
     def create(self, user_id: int, name: str, stored: str) -> int:
         cur = self.db.conn.cursor()
         cur.execute("""
             INSERT INTO files (user_id, original_name, stored_name)
             VALUES (?, ?, ?)
         """, (user_id, name, stored))
-        self.db.conn.commit()
+        self._add_usage(user_id, 0, 1)
         return cur.lastrowid
 
     # ---------- READ ----------
 
-    def list(self, user_id: int) -> List[dict]:
+    @db_method
+    def page(
+        self,
+        user_id: int,
+        cursor: int | None = None,
+        direction: str = "next",
+        limit: int = FILES_PAGE_SIZE,
+    ) -> tuple[List[dict], bool, bool]:
+        """
+        Страница файлов пользователя (новые сверху) по ключу id.
+        next — файлы старше cursor, prev — новее cursor.
+        Возвращает (items, has_prev, has_next).
+        """
+        if cursor is None:
+            rows = self.db.conn.execute(
+                "SELECT * FROM files WHERE user_id=? ORDER BY id DESC LIMIT ?",
+                (user_id, limit + 1)
+            ).fetchall()
+            return [dict(r) for r in rows[:limit]], False, len(rows) > limit
+
+        if direction == "prev":
+            rows = self.db.conn.execute(
+                "SELECT * FROM files WHERE user_id=? AND id>? ORDER BY id ASC LIMIT ?",
+                (user_id, cursor, limit + 1)
+            ).fetchall()
+            items = [dict(r) for r in reversed(rows[:limit])]
+            return items, len(rows) > limit, True
+
         rows = self.db.conn.execute(
-            "SELECT * FROM files WHERE user_id=? ORDER BY id DESC",
-            (user_id,)
+            "SELECT * FROM files WHERE user_id=? AND id<? ORDER BY id DESC LIMIT ?",
+            (user_id, cursor, limit + 1)
         ).fetchall()
-        return [dict(r) for r in rows]
+        return [dict(r) for r in rows[:limit]], True, len(rows) > limit
 
+    @db_method
     def get(self, file_id: int, user_id: int) -> dict | None:
         row = self.db.conn.execute(
             "SELECT * FROM files WHERE id=? AND user_id=?",
@@ -102,31 +544,174 @@ class FileRepo:
 
     # ---------- UPDATE ----------
 
+    @db_write
     def rename(self, file_id: int, user_id: int, new_name: str):
+        # имя документа зашито в file_id — после переименования нужна новая загрузка
         self.db.conn.execute(
-            "UPDATE files SET original_name=? WHERE id=? AND user_id=?",
+            "UPDATE files SET original_name=?, tg_file_id=NULL WHERE id=? AND user_id=?",
             (new_name, file_id, user_id)
         )
-        self.db.conn.commit()
 
-    def set_stored_name(self, file_id: int, stored_name: str):
+    @db_write
+    def set_tg_file_id(self, file_id: int, tg_file_id: str | None):
         self.db.conn.execute(
-            "UPDATE files SET stored_name=? WHERE id=?",
-            (stored_name, file_id)
+            "UPDATE files SET tg_file_id=? WHERE id=?",
+            (tg_file_id, file_id)
         )
-        self.db.conn.commit()
 
     # ---------- DELETE ----------
 
+    @db_write
     def delete(self, file_id: int, user_id: int):
+        """
+        Удаляет запись; сам PDF удаляется с диска,
+        только когда на него больше никто не ссылается
+        """
+        row = self.db.conn.execute(
+            "SELECT stored_name, sha256, size FROM files WHERE id=? AND user_id=?",
+            (file_id, user_id)
+        ).fetchone()
+        if not row:
+            return
+
         self.db.conn.execute(
             "DELETE FROM files WHERE id=? AND user_id=?",
             (file_id, user_id)
         )
-        self.db.conn.commit()
+        self._add_usage(user_id, -(row["size"] or 0), -1)
+        if row["stored_name"] and self._release_blob(row["stored_name"], row["sha256"]):
+            self.db.after_commit(self._drop_blob, row["stored_name"], row["sha256"])
+
+    @db_write
+    def delete_unfinished(self, max_age: float) -> int:
+        """
+        Удаляет записи старше max_age секунд, PDF которых так и не был
+        сохранён (процесс упал между create и store): иначе они навсегда
+        остаются в files_count и квоте. Возвращает число удалённых.
+        """
+        rows = self.db.conn.execute(
+            """
+            SELECT id, user_id, size FROM files
+            WHERE (stored_name IS NULL OR stored_name='')
+              AND (created_at IS NULL OR created_at < datetime('now', ?))
+            """,
+            (f"-{int(max_age)} seconds",)
+        ).fetchall()
+
+        for row in rows:
+            self.db.conn.execute("DELETE FROM files WHERE id=?", (row["id"],))
+            self._add_usage(row["user_id"], -(row["size"] or 0), -1)
+        return len(rows)
+
+    # ---------- BLOB STORE ----------
+
+    @staticmethod
+    def blob_name(sha256: str) -> str:
+        """
+        Путь blob'а относительно STORAGE_PDF: ab/cd/abcd….pdf
+        """
+        return os.path.join(sha256[:2], sha256[2:4], sha256 + ".pdf")
+
+    @db_write
+    def store(self, file_id: int, tmp_path: str, info: dict) -> str:
+        """
+        Кладёт готовый PDF в хранилище по sha256 и привязывает к записи.
+        Если такой blob уже есть, временный файл удаляется
+        и увеличивается счётчик ссылок. Прежний PDF записи
+        (например, до optimize) освобождается. Возвращает stored_name.
+        Файлы переносятся и удаляются после COMMIT.
+        """
+        sha = info["sha256"]
+        stored = self.blob_name(sha)
+        path = os.path.join(STORAGE_PDF, stored)
+
+        old = self.db.conn.execute(
+            "SELECT user_id, stored_name, sha256, size FROM files WHERE id=?",
+            (file_id,)
+        ).fetchone()
+        if old and old["sha256"] == sha and old["stored_name"] == stored:
+            _remove_quietly(tmp_path)
+            return stored
+
+        self.db.conn.execute(
+            """
+            INSERT INTO blobs (sha256, refs, size) VALUES (?, 1, ?)
+            ON CONFLICT(sha256) DO UPDATE SET refs=refs+1
+            """,
+            (sha, info.get("size"))
+        )
+
+        # сам перенос — после COMMIT, а отсутствие файла должно откатить запись
+        if not os.path.exists(tmp_path):
+            raise FileNotFoundError(tmp_path)
+        self.db.after_commit(self._publish_blob, tmp_path, path)
+        self.db.conn.execute(
+            """
+            UPDATE files
+            SET stored_name=?, tg_file_id=NULL, size=?, pages=?, sha256=?
+            WHERE id=?
+            """,
+            (stored, info.get("size"), info.get("pages"), sha, file_id)
+        )
+        if old:
+            self._add_usage(old["user_id"], (info.get("size") or 0) - (old["size"] or 0))
+
+        if old and old["stored_name"] and self._release_blob(old["stored_name"], old["sha256"]):
+            self.db.after_commit(self._drop_blob, old["stored_name"], old["sha256"])
+        return stored
+
+    @staticmethod
+    def _publish_blob(tmp_path: str, path: str):
+        if os.path.exists(path):
+            _remove_quietly(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+
+    def _drop_blob(self, stored_name: str, sha256: str | None):
+        """
+        Удаляет освобождённый PDF после COMMIT — если за это время
+        другой процесс не сохранил тот же blob заново
+        """
+        path = os.path.join(STORAGE_PDF, stored_name)
+        if not sha256 or stored_name != self.blob_name(sha256):
+            _remove_quietly(path)
+            return
+
+        conn = self.db.conn
+        # под блокировкой записи новая ссылка не появится между проверкой и удалением
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute("SELECT 1 FROM blobs WHERE sha256=?", (sha256,)).fetchone():
+                _remove_quietly(path)
+        finally:
+            conn.commit()
+
+    def _release_blob(self, stored_name: str, sha256: str | None) -> bool:
+        """
+        Уменьшает счётчик ссылок. True — ссылок не осталось
+        (или файл хранится по-старому, вне blobs) и его можно удалять.
+        """
+        if not sha256 or stored_name != self.blob_name(sha256):
+            return True
+
+        self.db.conn.execute(
+            "UPDATE blobs SET refs=refs-1 WHERE sha256=?",
+            (sha256,)
+        )
+        row = self.db.conn.execute(
+            "SELECT refs FROM blobs WHERE sha256=?",
+            (sha256,)
+        ).fetchone()
+        if row and row["refs"] > 0:
+            return False
+
+        self.db.conn.execute("DELETE FROM blobs WHERE sha256=?", (sha256,))
+        return True
 
     # ---------- MERGE SUPPORT ----------
 
+    @db_method
     def get_paths(self, file_ids: List[int], user_id: int) -> List[str]:
         """
         Возвращает абсолютные пути к PDF-файлам
@@ -159,3 +744,55 @@ class FileRepo:
             for i in file_ids
             if i in id_to_path and os.path.exists(id_to_path[i])
         ]
+
+
+# ===================== STATE =====================
+
+class StateRepo:
+    """
+    user_data и состояния ConversationHandler в виде JSON-строк
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    @db_method
+    def user_data(self, user_id: int) -> str | None:
+        row = self.db.conn.execute(
+            "SELECT data FROM user_data WHERE user_id=?", (user_id,)
+        ).fetchone()
+        return row["data"] if row else None
+
+    @db_method
+    def conversations(self, name: str) -> dict:
+        rows = self.db.conn.execute(
+            "SELECT key, state FROM conversations WHERE name=?", (name,)
+        )
+        return {row["key"]: row["state"] for row in rows}
+
+    @db_write
+    def save(self, user_data: dict, conversations: dict):
+        """
+        Одна транзакция на пачку изменений.
+        user_data: user_id → JSON или None (удалить),
+        conversations: (name, key) → JSON состояния или None (диалог завершён).
+        """
+        conn = self.db.conn
+        conn.executemany(
+            "INSERT INTO user_data (user_id, data) VALUES (?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET data=excluded.data",
+            [(uid, data) for uid, data in user_data.items() if data is not None]
+        )
+        conn.executemany(
+            "DELETE FROM user_data WHERE user_id=?",
+            [(uid,) for uid, data in user_data.items() if data is None]
+        )
+        conn.executemany(
+            "INSERT INTO conversations (name, key, state) VALUES (?, ?, ?) "
+            "ON CONFLICT(name, key) DO UPDATE SET state=excluded.state",
+            [(name, key, state) for (name, key), state in conversations.items() if state is not None]
+        )
+        conn.executemany(
+            "DELETE FROM conversations WHERE name=? AND key=?",
+            [(name, key) for (name, key), state in conversations.items() if state is None]
+        )
@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+import time
+
+import config
+import metrics
+
+# временный файл старше этого и не принадлежащий живой сессии — мусор, секунды
+TEMP_MAX_AGE = getattr(config, "TEMP_MAX_AGE", 3600)
+JANITOR_INTERVAL = getattr(config, "JANITOR_INTERVAL", 600)
+
+REMOVED_FILES = metrics.counter(
+    "janitor_removed_files_total", "Orphaned temporary files removed by the janitor"
+)
+REMOVED_BYTES = metrics.counter(
+    "janitor_removed_bytes_total", "Bytes freed by the janitor"
+)
+REMOVED_ROWS = metrics.counter(
+    "janitor_removed_rows_total", "File records without a stored PDF removed by the janitor"
+)
+
+
+class Janitor:
+    """
+    Периодически удаляет брошенные временные файлы: фото отменённых
+    и заброшенных альбомов, .part после падения процесса.
+
+    targets — [(каталог, суффикс)], "" — все файлы каталога (без подкаталогов).
+    live() — пути, которые ещё нужны живым сессиям, их не трогаем в любом возрасте.
+    files — FileRepo: записи старше max_age без сохранённого PDF
+    (процесс упал посреди создания) тоже удаляются.
+    """
+
+    def __init__(
+        self,
+        targets: list[tuple[str, str]],
+        live=set,
+        max_age: float = TEMP_MAX_AGE,
+        interval: float = JANITOR_INTERVAL,
+        files=None,
+    ):
+        self.targets = targets
+        self.live = live
+        self.files = files
+        self.max_age = max_age
+        self.interval = interval
+        self._task = None
+
+    def sweep(self, live: set) -> tuple[int, int]:
+        """
+        Один проход по каталогам. Возвращает (удалено файлов, освобождено байт).
+        """
+        cutoff = time.time() - self.max_age
+        removed = freed = 0
+
+        for root, suffix in self.targets:
+            try:
+                entries = list(os.scandir(root))
+            except FileNotFoundError:
+                continue
+
+            for entry in entries:
+                if not entry.name.endswith(suffix) or entry.path in live:
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                    if stat.st_mtime > cutoff:
+                        continue
+                    os.remove(entry.path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+
+        return removed, freed
+
+    async def run_once(self) -> tuple[int, int]:
+        # live() читает состояние бота — только из event loop,
+        # обход диска — в отдельном потоке
+        removed, freed = await asyncio.to_thread(self.sweep, set(self.live()))
+        REMOVED_FILES.inc(amount=removed)
+        REMOVED_BYTES.inc(amount=freed)
+        if removed:
+            logging.info("🧹 Janitor removed %s temp files (%s bytes)", removed, freed)
+
+        if self.files is not None:
+            rows = await self.files.delete_unfinished(self.max_age)
+            REMOVED_ROWS.inc(amount=rows)
+            if rows:
+                logging.info("🧹 Janitor removed %s unfinished file records", rows)
+        return removed, freed
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.warning("⚠️ Janitor sweep failed: %r", e)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
@@ -0,0 +1,337 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import config
+import metrics
+
+PDF_WORKERS = getattr(config, "PDF_WORKERS", None) or os.cpu_count() or 1
+PDF_QUEUE_SIZE = getattr(config, "PDF_QUEUE_SIZE", 32)
+PDF_JOB_TIMEOUT = getattr(config, "PDF_JOB_TIMEOUT", 120)
+# как часто run() проверяет прогресс задачи для on_progress, секунды
+PDF_PROGRESS_INTERVAL = getattr(config, "PDF_PROGRESS_INTERVAL", 1.0)
+# сколько задача после таймаута может не доходить до progress(),
+# прежде чем её процесс будет убит, секунды
+PDF_KILL_GRACE = getattr(config, "PDF_KILL_GRACE", 1.0)
+
+
+# ===================== ERRORS =====================
+
+class JobError(Exception):
+    pass
+
+
+class JobQueueFull(JobError):
+    pass
+
+
+class JobTimeout(JobError):
+    pass
+
+
+class JobCancelled(JobError):
+    pass
+
+
+# ===================== WORKER SIDE =====================
+
+# флаги отмены, по одному на слот пула, прогресс слотов
+# парами (done, total) и pid процесса слота — общая память с родителем
+_cancel_flags = None
+_progress = None
+_pids = None
+
+
+def _init_worker(flags, progress, pids):
+    global _cancel_flags, _progress, _pids
+    _cancel_flags = flags
+    _progress = progress
+    _pids = pids
+
+
+def _run_job(slot: int, fn, args: tuple, kwargs: dict):
+    """
+    Выполняется в процессе пула.
+    progress() вызывается сервисом после каждой страницы / файла —
+    это точка, где задача узнаёт об отмене.
+    """
+    def progress(done: int, total: int):
+        _progress[2 * slot] = done
+        _progress[2 * slot + 1] = total
+        if _cancel_flags[slot]:
+            raise JobCancelled()
+
+    _pids[slot] = os.getpid()
+    return fn(*args, progress=progress, **kwargs)
+
+
+# ===================== METRICS =====================
+
+JOB_SECONDS = metrics.histogram(
+    "pdf_job_seconds", "PDF job run time in the worker pool", ("job",)
+)
+JOB_WAIT_SECONDS = metrics.histogram(
+    "pdf_job_wait_seconds", "Time a PDF job waited for a free worker", ("job",)
+)
+JOBS = metrics.counter(
+    "pdf_jobs_total", "Finished PDF jobs by result", ("job", "result")
+)
+PAGES = metrics.counter(
+    "pdf_pages_total", "Pages in built PDF files", ("job",)
+)
+PAGES_PER_SECOND = metrics.histogram(
+    "pdf_pages_per_second", "PDF build speed", ("job",),
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000),
+)
+
+
+# ===================== ENGINE =====================
+
+class JobEngine:
+    """
+    Пул процессов для тяжёлых PDF-операций.
+
+    - одновременно выполняется не больше workers задач;
+    - ожидающих задач не больше queue_size, остальные получают JobQueueFull;
+    - у каждой задачи есть таймаут, по таймауту / отмене
+      задача останавливается на ближайшем progress(); если до него
+      дольше PDF_KILL_GRACE (одна долгая операция PIL), процесс
+      убивается, а пул пересоздаётся — вместе с соседними задачами;
+    - отменить можно и задачу, которая ещё ждёт свободный процесс.
+    """
+
+    def __init__(
+        self,
+        workers: int = PDF_WORKERS,
+        queue_size: int = PDF_QUEUE_SIZE,
+        timeout: float = PDF_JOB_TIMEOUT,
+    ):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.timeout = timeout
+
+        self._pool = None
+        self._flags = None
+        self._progress = None
+        self._pids = None
+        self._free_slots = None
+        self._waiting = 0
+        # job_id → слот; None — задача ещё ждёт свободный процесс
+        self._running = {}
+        self._cancelled = set()
+        self._ids = itertools.count(1)
+
+    def _start(self):
+        ctx = multiprocessing.get_context()
+        if self._flags is None:
+            self._flags = ctx.Array("b", self.workers, lock=False)
+            self._progress = ctx.Array("i", 2 * self.workers, lock=False)
+            self._pids = ctx.Array("i", self.workers, lock=False)
+            self._free_slots = asyncio.Queue()
+            for slot in range(self.workers):
+                self._free_slots.put_nowait(slot)
+
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=ctx,
+            initializer=_init_worker,
+            initargs=(self._flags, self._progress, self._pids),
+        )
+
+    def _restart(self, broken: ProcessPoolExecutor):
+        # пул мог уже перезапустить соседний вызов
+        if self._pool is broken:
+            broken.shutdown(wait=False, cancel_futures=True)
+            self._start()
+
+    def _release(self, slot: int, fut: asyncio.Future):
+        # забираем исключение, чтобы asyncio не ругался в лог
+        if not fut.cancelled():
+            fut.exception()
+        self._free_slots.put_nowait(slot)
+
+    async def run(
+        self,
+        fn,
+        *args,
+        timeout: float | None = None,
+        job_id=None,
+        on_progress=None,
+        **kwargs,
+    ):
+        """
+        Выполняет fn(*args, **kwargs) в пуле и возвращает результат.
+        fn должна принимать именованный аргумент progress и вызывать его
+        между этапами работы — иначе отмена и таймаут ждут её завершения.
+
+        job_id — для cancel(); on_progress(done, total) — корутина,
+        вызывается не чаще PDF_PROGRESS_INTERVAL и только если прогресс изменился.
+        """
+        if self._pool is None:
+            self._start()
+
+        name = getattr(fn, "__name__", "job")
+        if self._free_slots.empty() and self._waiting >= self.queue_size:
+            JOBS.inc(name, "queue_full")
+            raise JobQueueFull()
+
+        if job_id is None:
+            job_id = next(self._ids)
+
+        self._waiting += 1
+        self._running[job_id] = None
+        queued = time.perf_counter()
+        try:
+            slot = await self._free_slots.get()
+        except BaseException:
+            self._running.pop(job_id, None)
+            self._cancelled.discard(job_id)
+            raise
+        finally:
+            self._waiting -= 1
+        start = time.perf_counter()
+        JOB_WAIT_SECONDS.observe(start - queued, name)
+
+        if job_id in self._cancelled:
+            self._cancelled.discard(job_id)
+            self._running.pop(job_id, None)
+            self._free_slots.put_nowait(slot)
+            JOBS.inc(name, "cancelled")
+            raise JobCancelled()
+
+        self._flags[slot] = 0
+        self._progress[2 * slot] = self._progress[2 * slot + 1] = 0
+        self._pids[slot] = 0
+        pool = self._pool
+        try:
+            fut = asyncio.wrap_future(
+                pool.submit(_run_job, slot, fn, args, kwargs)
+            )
+        except BrokenProcessPool:
+            self._running.pop(job_id, None)
+            self._free_slots.put_nowait(slot)
+            self._restart(pool)
+            JOBS.inc(name, "error")
+            raise JobError("PDF worker pool was restarted")
+
+        # слот освобождается только когда процесс реально закончил работу
+        fut.add_done_callback(lambda f: self._release(slot, f))
+        self._running[job_id] = slot
+
+        result = "error"
+        try:
+            value = await self._wait(fut, slot, start + (timeout or self.timeout), on_progress)
+            result = "ok"
+            self._observe(name, time.perf_counter() - start, value)
+            return value
+        except asyncio.TimeoutError:
+            self._flags[slot] = 1
+            result = "timeout"
+            asyncio.get_running_loop().call_later(
+                PDF_KILL_GRACE, self._kill_stuck, fut, slot, pool
+            )
+            raise JobTimeout()
+        except (asyncio.CancelledError, JobCancelled):
+            self._flags[slot] = 1
+            result = "cancelled"
+            raise
+        except BrokenProcessPool:
+            self._restart(pool)
+            raise JobError("PDF worker pool was restarted")
+        finally:
+            self._running.pop(job_id, None)
+            JOBS.inc(name, result)
+
+    async def _wait(self, fut: asyncio.Future, slot: int, deadline: float, on_progress):
+        """
+        Ждёт результат задачи до deadline, по пути сообщая прогресс.
+        Отмена ожидания не отменяет fut — его останавливает флаг слота.
+        """
+        shown = None
+        while True:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                raise asyncio.TimeoutError()
+            if on_progress is not None:
+                left = min(left, PDF_PROGRESS_INTERVAL)
+
+            done, _ = await asyncio.wait((fut,), timeout=left)
+            if done:
+                return fut.result()
+
+            state = (self._progress[2 * slot], self._progress[2 * slot + 1])
+            if on_progress is not None and state[1] and state != shown:
+                shown = state
+                try:
+                    await on_progress(*state)
+                except Exception as e:
+                    logging.warning("⚠️ Job progress callback failed: %r", e)
+
+    def _kill_stuck(self, fut: asyncio.Future, slot: int, pool: ProcessPoolExecutor):
+        """
+        Задача после таймаута так и не дошла до progress() — иначе
+        её слот занят до конца операции
+        """
+        pid = self._pids[slot]
+        if fut.done() or self._pool is not pool or not pid:
+            return
+        logging.warning("⚠️ PDF job in slot %s ignored timeout, killing pid %s", slot, pid)
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self._restart(pool)
+
+    @staticmethod
+    def _observe(name: str, seconds: float, value):
+        JOB_SECONDS.observe(seconds, name)
+        # сборка PDF возвращает file_info с числом страниц
+        pages = value.get("pages") if isinstance(value, dict) else None
+        if pages:
+            PAGES.inc(name, amount=pages)
+            PAGES_PER_SECOND.observe(pages / max(seconds, 1e-6), name)
+
+    def cancel(self, job_id) -> bool:
+        """
+        Просит задачу остановиться: выполняющаяся прервётся на ближайшем
+        progress(), ожидающая процесс — не начнётся.
+        False — такой задачи нет (ещё не запущена или уже закончилась).
+        """
+        if job_id not in self._running:
+            return False
+        slot = self._running[job_id]
+        if slot is None:
+            self._cancelled.add(job_id)
+        else:
+            self._flags[slot] = 1
+        return True
+
+    def shutdown(self):
+        """
+        Останавливает пул: выполняющиеся задачи прерываются
+        на ближайшем progress(), ожидающие — отменяются.
+        """
+        if self._pool is None:
+            return
+        for slot in range(self.workers):
+            self._flags[slot] = 1
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        self._pool = None
+
+
+pdf_jobs = JobEngine()
+
+metrics.gauge(
+    "pdf_jobs_running", "PDF jobs running in the worker pool",
+    fn=lambda: {(): len(pdf_jobs._running) - pdf_jobs._waiting},
+)
+metrics.gauge(
+    "pdf_jobs_waiting", "PDF jobs waiting for a free worker",
+    fn=lambda: {(): pdf_jobs._waiting},
+)
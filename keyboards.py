@@ -1,10 +1,18 @@
+from functools import lru_cache
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 from texts import TEXT
-from typing import Set, Iterable
+from services import OPTIMIZE_PRESETS
+from typing import Set
+
+# Клавиатуры неизменяемы (TelegramObject frozen), поэтому статичные
+# собираются один раз на язык и дальше переиспользуются.
+
+MERGE_MARKS = {True: "✅", False: "⬜"}
 
 
 # ===================== LANGUAGE =====================
 
+@lru_cache(maxsize=None)
 def lang_kb():
     return InlineKeyboardMarkup([
         [
@@ -17,6 +25,7 @@ def lang_kb():
 
 # ===================== MAIN MENU =====================
 
+@lru_cache(maxsize=None)
 def main_menu(lang: str):
     t = TEXT[lang]
     return InlineKeyboardMarkup([
@@ -28,6 +37,7 @@ def main_menu(lang: str):
 
 # ===================== COLLECT IMAGES =====================
 
+@lru_cache(maxsize=None)
 def collect_kb(lang: str):
     t = TEXT[lang]
     return InlineKeyboardMarkup([
@@ -40,9 +50,14 @@ def collect_kb(lang: str):
 
 # ===================== FILES LIST =====================
 
-def files_list_kb(files: Iterable[dict], lang: str):
+def files_list_kb(
+    files: list[dict],
+    lang: str,
+    has_prev: bool = False,
+    has_next: bool = False,
+):
     """
-    Список файлов пользователя
+    Список файлов пользователя (одна страница)
     """
     t = TEXT[lang]
     buttons = []
@@ -55,6 +70,10 @@ def files_list_kb(files: Iterable[dict], lang: str):
             )
         ])
 
+    nav = _page_nav("files", files, has_prev, has_next, t)
+    if nav:
+        buttons.append(nav)
+
     buttons.append([
         InlineKeyboardButton(t["btn_create"], callback_data="create")
     ])
@@ -67,6 +86,7 @@ def files_list_kb(files: Iterable[dict], lang: str):
 
 # ===================== FILE ACTIONS =====================
 
+@lru_cache(maxsize=4096)
 def file_actions_kb(file_id: int, lang: str):
     """
     Действия над конкретным PDF
@@ -78,7 +98,8 @@ def file_actions_kb(file_id: int, lang: str):
             InlineKeyboardButton(t["rename"], callback_data=f"rename_{file_id}"),
         ],
         [
-            InlineKeyboardButton(t["delete"], callback_data=f"delete_{file_id}")
+            InlineKeyboardButton(t["delete"], callback_data=f"delete_{file_id}"),
+            InlineKeyboardButton(t["optimize"], callback_data=f"optimize_{file_id}"),
         ],
         [
             InlineKeyboardButton(t["merge"], callback_data="merge_start")
@@ -89,22 +110,54 @@ def file_actions_kb(file_id: int, lang: str):
     ])
 
 
+@lru_cache(maxsize=4096)
+def optimize_kb(file_id: int, lang: str):
+    """
+    Выбор пресета сжатия
+    """
+    t = TEXT[lang]
+    return InlineKeyboardMarkup([
+        [
+            InlineKeyboardButton(t[f"preset_{preset}"], callback_data=f"opt_{preset}_{file_id}")
+            for preset in OPTIMIZE_PRESETS
+        ],
+        [
+            InlineKeyboardButton(t["cancel"], callback_data=f"file_{file_id}")
+        ]
+    ])
+
+
+# ===================== JOBS =====================
+
+@lru_cache(maxsize=None)
+def job_kb(lang: str):
+    """
+    Отмена выполняющейся PDF-задачи
+    """
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(TEXT[lang]["cancel"], callback_data="job_cancel")]
+    ])
+
+
 # ===================== MERGE FILES =====================
 
 def merge_files_kb(
-    files: Iterable[dict],
+    files: list[dict],
     selected_ids: Set[int],
-    lang: str
+    lang: str,
+    has_prev: bool = False,
+    has_next: bool = False,
 ):
     """
-    UI выбора PDF для объединения
+    UI выбора PDF для объединения (одна страница,
+    выбор хранится отдельно и сохраняется между страницами)
     """
     t = TEXT[lang]
     buttons = []
 
     for f in files:
         fid = f["id"]
-        mark = "✅" if fid in selected_ids else "⬜"
+        mark = MERGE_MARKS[fid in selected_ids]
 
         buttons.append([
             InlineKeyboardButton(
@@ -113,9 +166,50 @@ def merge_files_kb(
             )
         ])
 
+    nav = _page_nav("merge_page", files, has_prev, has_next, t)
+    if nav:
+        buttons.append(nav)
+
     buttons.append([
         InlineKeyboardButton(t["merge_confirm"], callback_data="merge_done"),
         InlineKeyboardButton(t["cancel"], callback_data="back_menu"),
     ])
 
     return InlineKeyboardMarkup(buttons)
+
+
+def merge_toggle_kb(markup: InlineKeyboardMarkup, selected_ids: Set[int]):
+    """
+    Клавиатура на экране с отметками по selected_ids, без запроса к базе.
+    Отмечаются все файлы, а не только нажатый: markup может быть
+    устаревшим, если предыдущее редактирование ещё не отправлено.
+    """
+    rows = []
+
+    for row in markup.inline_keyboard:
+        data = row[0].callback_data if len(row) == 1 else None
+        if data and data.startswith("merge_toggle_"):
+            fid = int(data.rsplit("_", 1)[1])
+            text = row[0].text.split(" ", 1)[-1]
+            row = (InlineKeyboardButton(f"{MERGE_MARKS[fid in selected_ids]} {text}", callback_data=data),)
+        rows.append(row)
+
+    return InlineKeyboardMarkup(rows)
+
+
+# ===================== PAGINATION =====================
+
+def _page_nav(prefix: str, files: list[dict], has_prev: bool, has_next: bool, t: dict):
+    """
+    Кнопки ◀ / ▶ — курсором служит id крайнего файла на странице
+    """
+    row = []
+    if has_prev and files:
+        row.append(InlineKeyboardButton(
+            t["prev_page"], callback_data=f"{prefix}_prev_{files[0]['id']}"
+        ))
+    if has_next and files:
+        row.append(InlineKeyboardButton(
+            t["next_page"], callback_data=f"{prefix}_next_{files[-1]['id']}"
+        ))
+    return row
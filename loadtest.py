@@ -0,0 +1,726 @@
+"""
+Нагрузочный прогон бота без Telegram.
+
+    python loadtest.py --users 10 50 100 --photos 3
+    python loadtest.py --users 200 --no-rate-limit --out load.json
+    python loadtest.py --users 50 --set CONCURRENT_UPDATES=1
+
+Поднимает локальную заглушку Bot API (getUpdates, sendMessage,
+editMessageText, sendDocument, sendPhoto, getFile и скачивание файлов),
+запускает настоящий bot.py отдельным процессом поверх неё
+и гоняет N одновременных пользователей по сценарию
+start → create (с фото) → files → merge.
+
+Для каждого обработчика печатаются перцентили задержки
+(от отправки апдейта до ответа бота), ошибки и общая пропускная
+способность. Несколько значений --users — серия раундов на одном
+процессе бота: по ним видно, где пропускная способность упирается в потолок.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from urllib.parse import parse_qsl, unquote
+
+from bench import make_image
+
+BOT_TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "PDF Bot", "username": "pdf_load_bot"}
+
+
+# ===================== HTTP =====================
+
+def _parse_multipart(body: bytes, content_type: str) -> dict:
+    """
+    Поля multipart/form-data. У файлов вместо содержимого — его размер.
+    """
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    params = {}
+    for part in body.split(b"--" + boundary)[1:-1]:
+        head, _, value = part.strip(b"\r\n").partition(b"\r\n\r\n")
+        disposition = head.decode(errors="replace")
+        name = disposition.split('name="', 1)[1].split('"', 1)[0]
+        if 'filename="' in disposition:
+            params[name] = {"size": len(value)}
+        else:
+            params[name] = value.decode()
+    return params
+
+
+def _parse_params(body: bytes, content_type: str) -> dict:
+    if content_type.startswith("multipart/form-data"):
+        return _parse_multipart(body, content_type)
+    if content_type.startswith("application/json"):
+        return json.loads(body or b"{}")
+    return dict(parse_qsl(body.decode()))
+
+
+async def _read_body(reader, headers: dict) -> bytes:
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        body = b""
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            chunk = await reader.readexactly(size + 2)
+            if not size:
+                return body
+            body += chunk[:-2]
+    length = int(headers.get("content-length", 0))
+    return await reader.readexactly(length) if length else b""
+
+
+# ===================== FAKE BOT API =====================
+
+class ApiError(Exception):
+    def __init__(self, code: int, description: str):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+class _Chat:
+    __slots__ = ("id", "message_ids", "messages", "ui_message_id", "events")
+
+    def __init__(self, chat_id: int):
+        self.id = chat_id
+        self.message_ids = itertools.count(1)
+        # message_id → (text, reply_markup) сообщений бота
+        self.messages = {}
+        self.ui_message_id = None
+        self.events = asyncio.Queue()
+
+
+class FakeBotAPI:
+    """
+    Заглушка Bot API: хранит сообщения бота по чатам,
+    отдаёт апдейты через long polling и складывает каждый
+    вызов бота в очередь событий чата — по ним драйвер ждёт ответа.
+    """
+
+    def __init__(self, photo: bytes):
+        self.photo = photo
+        self.chats = {}
+        self.calls = defaultdict(int)
+        self.api_errors = defaultdict(int)
+        self.polling = asyncio.Event()
+
+        self._updates = []
+        self._has_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._file_ids = itertools.count(1)
+        # id callback_query → чат, чтобы связать answerCallbackQuery с пользователем
+        self._callbacks = {}
+        self._server = None
+        self._connections = set()
+
+    async def start(self, host: str = "127.0.0.1") -> int:
+        self._server = await asyncio.start_server(self._handle, host, 0)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        # висящие long polling запросы
+        for task in self._connections:
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def chat(self, chat_id: int) -> _Chat:
+        chat = self.chats.get(chat_id)
+        if chat is None:
+            chat = self.chats[chat_id] = _Chat(chat_id)
+        return chat
+
+    # ---------- апдейты от «пользователей» ----------
+
+    def push(self, kind: str, payload: dict):
+        self._updates.append({"update_id": next(self._update_ids), kind: payload})
+        self._has_updates.set()
+
+    def user_message(self, user_id: int, **fields) -> int:
+        chat = self.chat(user_id)
+        message_id = next(chat.message_ids)
+        self.push("message", {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            **fields,
+        })
+        return message_id
+
+    def send_text(self, user_id: int, text: str):
+        fields = {"text": text}
+        if text.startswith("/"):
+            command = text.split()[0]
+            fields["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        self.user_message(user_id, **fields)
+
+    def send_photo(self, user_id: int, media_group_id: str | None = None):
+        n = next(self._file_ids)
+        fields = {"photo": [{
+            "file_id": f"photo_{n}",
+            "file_unique_id": f"uphoto_{n}",
+            "width": 1280,
+            "height": 960,
+            "file_size": len(self.photo),
+        }]}
+        if media_group_id:
+            fields["media_group_id"] = media_group_id
+        self.user_message(user_id, **fields)
+
+    def press(self, user_id: int, data: str):
+        """
+        Нажатие кнопки на текущем UI-сообщении чата
+        """
+        chat = self.chat(user_id)
+        text, markup = chat.messages[chat.ui_message_id]
+        message = {
+            "message_id": chat.ui_message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+        if markup:
+            message["reply_markup"] = markup
+        callback_id = str(next(self._update_ids))
+        self._callbacks[callback_id] = user_id
+        self.push("callback_query", {
+            "id": callback_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "chat_instance": str(user_id),
+            "message": message,
+            "data": data,
+        })
+
+    def buttons(self, user_id: int) -> list[str]:
+        chat = self.chat(user_id)
+        _, markup = chat.messages.get(chat.ui_message_id, (None, None))
+        if not markup:
+            return []
+        return [
+            button["callback_data"]
+            for row in markup["inline_keyboard"]
+            for button in row
+            if "callback_data" in button
+        ]
+
+    # ---------- методы Bot API ----------
+
+    def _bot_message(self, chat: _Chat, **fields) -> dict:
+        return {
+            "message_id": next(chat.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat.id, "type": "private"},
+            "from": BOT_USER,
+            **fields,
+        }
+
+    def _chat_param(self, params: dict) -> _Chat:
+        return self.chat(int(params["chat_id"]))
+
+    async def get_updates(self, params: dict):
+        self.polling.set()
+        offset = int(params.get("offset", 0))
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+
+        if not self._updates and float(params.get("timeout", 0)):
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params["timeout"]))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit", 100))]
+
+    async def send_message(self, params: dict):
+        chat = self._chat_param(params)
+        markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        message = self._bot_message(chat, text=params["text"])
+        if markup:
+            message["reply_markup"] = markup
+        chat.messages[message["message_id"]] = (params["text"], markup)
+        chat.ui_message_id = message["message_id"]
+        return message
+
+    async def edit_message_text(self, params: dict):
+        chat = self._chat_param(params)
+        message_id = int(params["message_id"])
+        if message_id not in chat.messages:
+            raise ApiError(400, "Bad Request: message to edit not found")
+
+        markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        if chat.messages[message_id][0] is None:
+            raise ApiError(400, "Bad Request: there is no text in the message to edit")
+        if chat.messages[message_id] == (params["text"], markup):
+            raise ApiError(400, "Bad Request: message is not modified")
+
+        chat.messages[message_id] = (params["text"], markup)
+        chat.ui_message_id = message_id
+        message = self._bot_message(chat, text=params["text"])
+        message["message_id"] = message_id
+        if markup:
+            message["reply_markup"] = markup
+        return message
+
+    async def delete_message(self, params: dict):
+        chat = self._chat_param(params)
+        if chat.messages.pop(int(params["message_id"]), None) is None:
+            raise ApiError(400, "Bad Request: message to delete not found")
+        return True
+
+    async def send_document(self, params: dict):
+        chat = self._chat_param(params)
+        document = params["document"]
+        n = next(self._file_ids)
+        size = document["size"] if isinstance(document, dict) else 0
+        return self._bot_message(chat, document={
+            "file_id": f"doc_{n}",
+            "file_unique_id": f"udoc_{n}",
+            "file_name": "document.pdf",
+            "file_size": size,
+        })
+
+    async def send_photo_message(self, params: dict):
+        chat = self._chat_param(params)
+        markup = json.loads(params["reply_markup"]) if params.get("reply_markup") else None
+        n = next(self._file_ids)
+        message = self._bot_message(chat, caption=params.get("caption", ""), photo=[{
+            "file_id": f"preview_{n}",
+            "file_unique_id": f"upreview_{n}",
+            "width": 320,
+            "height": 320,
+        }])
+        if markup:
+            message["reply_markup"] = markup
+        # у фото только подпись — editMessageText к нему неприменим
+        chat.messages[message["message_id"]] = (None, markup)
+        chat.ui_message_id = message["message_id"]
+        return message
+
+    async def get_file(self, params: dict):
+        file_id = params["file_id"]
+        if not file_id.startswith("photo_"):
+            raise ApiError(400, "Bad Request: invalid file_id")
+        return {
+            "file_id": file_id,
+            "file_unique_id": "u" + file_id,
+            "file_size": len(self.photo),
+            "file_path": f"photos/{file_id}.jpg",
+        }
+
+    async def get_me(self, params: dict):
+        return BOT_USER
+
+    async def answer_callback_query(self, params: dict):
+        user_id = self._callbacks.pop(params.get("callback_query_id"), None)
+        # окно «ещё выполняется» — драйвер повторит нажатие
+        if user_id is not None and str(params.get("show_alert")).lower() == "true":
+            self.chat(user_id).events.put_nowait(("busy", time.perf_counter()))
+        return True
+
+    async def _ok(self, params: dict):
+        return True
+
+    METHODS = {
+        "getUpdates": get_updates,
+        "sendMessage": send_message,
+        "editMessageText": edit_message_text,
+        "deleteMessage": delete_message,
+        "sendDocument": send_document,
+        "sendPhoto": send_photo_message,
+        "getFile": get_file,
+        "getMe": get_me,
+        "answerCallbackQuery": answer_callback_query,
+        "deleteWebhook": _ok,
+        "close": _ok,
+    }
+
+    async def _call(self, method: str, params: dict):
+        handler = self.METHODS.get(method)
+        if handler is None:
+            raise ApiError(404, f"Not Found: method {method} is not emulated")
+        self.calls[method] += 1
+
+        try:
+            result = await handler(self, params)
+        except ApiError:
+            self.api_errors[method] += 1
+            raise
+
+        if "chat_id" in params:
+            # прогресс PDF-задачи (сообщение с кнопкой отмены) — не ответ на шаг
+            if "job_cancel" in str(params.get("reply_markup") or ""):
+                method = "progress"
+            self._chat_param(params).events.put_nowait((method, time.perf_counter()))
+        return result
+
+    # ---------- HTTP ----------
+
+    async def _route(self, verb: str, path: str, headers: dict, body: bytes):
+        if path.startswith(f"/file/bot{BOT_TOKEN}/photos/"):
+            return 200, "image/jpeg", self.photo
+
+        prefix = f"/bot{BOT_TOKEN}/"
+        if not path.startswith(prefix):
+            return 404, "application/json", b'{"ok":false,"error_code":404,"description":"Not Found"}'
+
+        params = _parse_params(body, headers.get("content-type", ""))
+        try:
+            result = await self._call(path[len(prefix):], params)
+            payload = {"ok": True, "result": result}
+            status = 200
+        except ApiError as e:
+            payload = {"ok": False, "error_code": e.code, "description": e.description}
+            status = e.code
+        return status, "application/json", json.dumps(payload).encode()
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                verb, target, _ = line.decode().split(" ", 2)
+
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    key, value = header.decode().split(":", 1)
+                    headers[key.strip().lower()] = value.strip()
+
+                body = await _read_body(reader, headers)
+                status, content_type, payload = await self._route(
+                    verb, unquote(target.split("?", 1)[0]), headers, body
+                )
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+
+# ===================== DRIVER =====================
+
+UI_METHODS = ("sendMessage", "editMessageText", "sendPhoto")
+
+
+class StepFailed(Exception):
+    pass
+
+
+class StepBusy(Exception):
+    pass
+
+
+# пауза перед повторным нажатием, если бот ответил «ещё выполняется»
+BUSY_RETRY = 0.2
+
+
+class Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.retries = defaultdict(int)
+        self.flows = 0
+        self.failed_flows = 0
+
+    def report(self, elapsed: float) -> dict:
+        handlers = {}
+        for name in sorted(set(self.latency) | set(self.errors)):
+            samples = sorted(self.latency[name])
+            row = {"count": len(samples), "errors": self.errors[name]}
+            if self.retries[name]:
+                row["busy_retries"] = self.retries[name]
+            if samples:
+                pick = lambda q: round(samples[min(len(samples) - 1, int(len(samples) * q))], 4)
+                row.update({"p50": pick(0.5), "p90": pick(0.9), "p99": pick(0.99), "max": round(samples[-1], 4)})
+            handlers[name] = row
+
+        steps = sum(len(s) for s in self.latency.values())
+        errors = sum(self.errors.values())
+        return {
+            "seconds": round(elapsed, 3),
+            "flows": self.flows,
+            "failed_flows": self.failed_flows,
+            "steps_per_sec": round(steps / elapsed, 2),
+            "flows_per_sec": round(self.flows / elapsed, 3),
+            "error_rate": round(errors / max(1, steps + errors), 4),
+            "handlers": handlers,
+        }
+
+
+class User:
+    def __init__(self, api: FakeBotAPI, stats: Stats, user_id: int, timeout: float):
+        self.api = api
+        self.stats = stats
+        self.id = user_id
+        self.timeout = timeout
+        self.chat = api.chat(user_id)
+
+    async def _expect(self, methods: tuple, deadline: float) -> float:
+        while True:
+            left = deadline - time.perf_counter()
+            if left <= 0:
+                raise StepFailed(f"no {'/'.join(methods)}")
+            try:
+                method, at = await asyncio.wait_for(self.chat.events.get(), left)
+            except asyncio.TimeoutError:
+                raise StepFailed(f"no {'/'.join(methods)}")
+            if method in methods:
+                return at
+            if method == "busy":
+                raise StepBusy()
+            # бот ответил сообщением раньше ожидаемого (например, ошибкой)
+            if method in UI_METHODS:
+                raise StepFailed(f"{method} instead of {'/'.join(methods)}")
+
+    async def step(self, name: str, send, *expect: tuple):
+        """
+        Отправляет апдейт и ждёт ответы бота по порядку,
+        задержка — до последнего из них.
+        """
+        while not self.chat.events.empty():
+            self.chat.events.get_nowait()
+
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        try:
+            while True:
+                send()
+                try:
+                    at = start
+                    for methods in expect:
+                        at = await self._expect(methods, deadline)
+                    break
+                except StepBusy:
+                    # как пользователь: подождать и нажать ещё раз
+                    self.stats.retries[name] += 1
+                    await asyncio.sleep(BUSY_RETRY)
+        except StepFailed:
+            self.stats.errors[name] += 1
+            raise
+        self.stats.latency[name].append(at - start)
+
+    def button(self, prefix: str, skip: int = 0) -> str:
+        found = [b for b in self.api.buttons(self.id) if b.startswith(prefix)]
+        if len(found) <= skip:
+            raise StepFailed(f"no {prefix}* button")
+        return found[skip]
+
+    async def create(self, photos: int, name: str):
+        api, uid = self.api, self.id
+        await self.step("menu_handler:create", lambda: api.press(uid, "create"), UI_METHODS)
+
+        group = f"album_{uid}_{name}"
+        for _ in range(photos):
+            api.send_photo(uid, group)
+
+        await self.step("collect_actions:done", lambda: api.press(uid, "done"), UI_METHODS)
+        await self.step(
+            "create_pdf",
+            lambda: api.send_text(uid, name),
+            ("sendDocument",),
+            UI_METHODS,
+        )
+
+    async def run(self, photos: int):
+        api, uid = self.api, self.id
+        await self.step("start", lambda: api.send_text(uid, "/start"), UI_METHODS)
+        await self.step("set_lang", lambda: api.press(uid, "lang_en"), UI_METHODS)
+
+        await self.create(photos, "first")
+        await self.create(photos, "second")
+
+        await self.step("show_files", lambda: api.press(uid, "files"), UI_METHODS)
+        file_button = self.button("file_")
+        await self.step("file_select_handler", lambda: api.press(uid, file_button), UI_METHODS)
+        await self.step("merge_start", lambda: api.press(uid, "merge_start"), UI_METHODS)
+
+        for skip in range(2):
+            toggle = self.button("merge_toggle_", skip)
+            await self.step("merge_toggle", lambda: api.press(uid, toggle), UI_METHODS)
+
+        await self.step("merge_done", lambda: api.press(uid, "merge_done"), UI_METHODS)
+
+
+async def run_round(api: FakeBotAPI, user_ids: range, photos: int, ramp: float, timeout: float) -> dict:
+    stats = Stats()
+
+    async def flow(n: int, user_id: int):
+        await asyncio.sleep(n * ramp)
+        try:
+            await User(api, stats, user_id, timeout).run(photos)
+            stats.flows += 1
+        except StepFailed:
+            stats.failed_flows += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(flow(n, uid) for n, uid in enumerate(user_ids)))
+    return stats.report(time.perf_counter() - start)
+
+
+# ===================== BOT PROCESS =====================
+
+# config подменяется до импорта bot: отдельные токен, хранилище и база
+_BOOTSTRAP = """
+import json, sys
+import config
+for key, value in json.loads(sys.argv[1]).items():
+    setattr(config, key, value)
+import bot
+bot.main()
+"""
+
+
+def start_bot(port: int, workdir: str, overrides: dict, log) -> subprocess.Popen:
+    settings = {
+        "BOT_TOKEN": BOT_TOKEN,
+        "BOT_API_URL": f"http://127.0.0.1:{port}/bot",
+        "BOT_FILE_URL": f"http://127.0.0.1:{port}/file/bot",
+        "STORAGE_PDF": os.path.join(workdir, "pdf"),
+        "STORAGE_TEMP": os.path.join(workdir, "temp"),
+        "DB_PATH": os.path.join(workdir, "bot.db"),
+        **overrides,
+    }
+    return subprocess.Popen(
+        [sys.executable, "-c", _BOOTSTRAP, json.dumps(settings)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+
+
+def stop_bot(proc: subprocess.Popen):
+    if proc.poll() is None:
+        proc.send_signal(signal.SIGINT)
+        try:
+            proc.wait(30)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+async def _wait_polling(api: FakeBotAPI, proc: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while not api.polling.is_set():
+        if proc.poll() is not None:
+            raise RuntimeError(f"Bot exited with code {proc.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("Bot did not start polling")
+        await asyncio.sleep(0.1)
+
+
+def _setting(arg: str) -> tuple:
+    name, _, value = arg.partition("=")
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def _delta(now: dict, before: dict) -> dict:
+    return {k: v - before.get(k, 0) for k, v in now.items() if v != before.get(k, 0)}
+
+
+async def run(args) -> list[dict]:
+    workdir = tempfile.mkdtemp(prefix="pdfload_")
+    photo_path = os.path.join(workdir, "photo.jpg")
+    make_image(photo_path, "jpeg")
+    with open(photo_path, "rb") as f:
+        api = FakeBotAPI(f.read())
+
+    overrides = dict(_setting(s) for s in args.set)
+    if args.no_rate_limit:
+        overrides.update(UI_GLOBAL_RATE=1e6, UI_CHAT_RATE=1e6, UI_CHAT_BURST=1e6)
+
+    port = await api.start()
+    log = open(args.bot_log, "w") if args.bot_log else subprocess.DEVNULL
+    proc = start_bot(port, workdir, overrides, log)
+    results = []
+    try:
+        await _wait_polling(api, proc)
+
+        first_id = 10_000
+        for users in args.users:
+            calls, api_errors = dict(api.calls), dict(api.api_errors)
+            result = await run_round(
+                api, range(first_id, first_id + users), args.photos, args.ramp, args.timeout
+            )
+            result["users"] = users
+            result["api_calls"] = _delta(api.calls, calls)
+            result["api_errors"] = _delta(api.api_errors, api_errors)
+            results.append(result)
+            first_id += users
+            print_round(result)
+    finally:
+        await asyncio.get_running_loop().run_in_executor(None, stop_bot, proc)
+        await api.stop()
+        if log is not subprocess.DEVNULL:
+            log.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def print_round(r: dict):
+    print(
+        f"\nusers={r['users']}  flows={r['flows']} failed={r['failed_flows']}  "
+        f"{r['steps_per_sec']} steps/s  {r['flows_per_sec']} flows/s  "
+        f"errors={r['error_rate']:.2%}  ({r['seconds']}s)",
+        file=sys.stderr,
+    )
+    print(f"  {'handler':<24}{'count':>7}{'err':>6}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}", file=sys.stderr)
+    for name, h in r["handlers"].items():
+        cols = "".join(f"{h.get(k, float('nan')):>9.3f}" for k in ("p50", "p90", "p99", "max"))
+        print(f"  {name:<24}{h['count']:>7}{h['errors']:>6}{cols}", file=sys.stderr)
+
+
+# ===================== CLI =====================
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, nargs="+", default=[10], help="concurrent users per round")
+    parser.add_argument("--photos", type=int, default=3, help="photos per created PDF")
+    parser.add_argument("--ramp", type=float, default=0.0, help="delay between user starts, seconds")
+    parser.add_argument("--timeout", type=float, default=120, help="max wait for a bot reply, seconds")
+    parser.add_argument("--no-rate-limit", action="store_true", help="disable the UI rate limits of ui.py")
+    parser.add_argument(
+        "--set", action="append", default=[], metavar="NAME=VALUE",
+        help="override a config setting of the bot, e.g. --set CONCURRENT_UPDATES=1",
+    )
+    parser.add_argument("--bot-log", help="write the bot process output to this file")
+    parser.add_argument("--out", help="write JSON results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    failed = sum(r["failed_flows"] for r in results)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
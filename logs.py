@@ -0,0 +1,182 @@
+"""
+Логирование без блокировок event loop.
+
+Обработчики логгеров только кладут запись в очередь, форматирует
+и пишет её в stdout отдельный поток (QueueListener).
+
+    LOG_FORMAT = "json"                 # или "human" — цветной текст для разработки
+    LOG_SAMPLE = {"handler": 0.05}      # доля записей события, которая попадает в лог
+"""
+import contextvars
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+import config
+
+LOG_FORMAT = getattr(config, "LOG_FORMAT", "human")
+LOG_LEVEL = getattr(config, "LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = getattr(config, "LOG_QUEUE_SIZE", 10000)
+# event → доля записей (0..1); события без записи пишутся всегда
+LOG_SAMPLE = getattr(config, "LOG_SAMPLE", {"handler": 0.05})
+
+# поля записи, которые попадают в JSON, если заданы
+FIELDS = ("worker", "user_id", "handler", "state", "duration", "event")
+
+# пользователь и обработчик текущего апдейта (см. metrics.timed_handler),
+# в режиме нескольких процессов — ещё и номер воркера
+log_context = contextvars.ContextVar("log_context", default={})
+
+
+# ===================== FORMATTERS =====================
+
+class HumanFormatter(logging.Formatter):
+    COLORS = {
+        "INFO": "\033[92m",     # green
+        "WARNING": "\033[93m",  # yellow
+        "ERROR": "\033[91m",    # red
+        "RESET": "\033[0m",
+    }
+
+    def format(self, record):
+        color = self.COLORS.get(record.levelname, "")
+        reset = self.COLORS["RESET"]
+        record.levelname = f"{color}{record.levelname:<7}{reset}"
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# ===================== FILTERS =====================
+
+class ContextFilter(logging.Filter):
+    """
+    Добавляет в запись user_id и handler текущего апдейта
+    """
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, value)
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Из записей с event из LOG_SAMPLE пропускает только заданную долю.
+    Предупреждения и ошибки не отбрасываются.
+    """
+    def __init__(self, rates: dict):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+# ===================== QUEUE =====================
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Если поток записи не успевает и очередь полна — запись теряется,
+    а не блокирует event loop.
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        # форматирование — в потоке записи, здесь только то,
+        # что нельзя отложить: аргументы и traceback
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+def dropped_records() -> int:
+    return _DroppingQueueHandler.dropped
+
+
+class _LogListener(logging.handlers.QueueListener):
+    """
+    stop() ещё и отключает очередь от корневого логгера, возвращая
+    прежние обработчики: записи при завершении интерпретатора
+    не должны уходить в очередь, которую уже никто не читает.
+    """
+
+    def __init__(self, queue_handler: logging.Handler, output: logging.Handler, previous: list):
+        super().__init__(queue_handler.queue, output)
+        self.queue_handler = queue_handler
+        self.previous = previous
+
+    def stop(self):
+        super().stop()
+        root = logging.getLogger()
+        root.removeHandler(self.queue_handler)
+        for handler in self.previous:
+            root.addHandler(handler)
+
+
+def _formatter(fmt: str) -> logging.Formatter:
+    if fmt == "json":
+        return JsonFormatter()
+    return HumanFormatter("%(asctime)s | %(levelname)s | %(message)s", datefmt="%H:%M:%S")
+
+
+def setup_logging(fmt: str = LOG_FORMAT, level: str = LOG_LEVEL):
+    """
+    Настраивает корневой логгер. Возвращает QueueListener —
+    его stop() дописывает очередь при завершении процесса.
+    """
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(_formatter(fmt))
+
+    handler = _DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter())
+    handler.addFilter(SamplingFilter(LOG_SAMPLE))
+
+    root = logging.getLogger()
+    previous = root.handlers[:]
+    root.handlers.clear()
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    # глушим шум
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    logging.getLogger("telegram").setLevel(logging.WARNING)
+    logging.getLogger("telegram.ext").setLevel(logging.WARNING)
+
+    listener = _LogListener(handler, output, previous)
+    listener.start()
+    return listener
@@ -0,0 +1,263 @@
+"""
+Метрики процесса в текстовом формате Prometheus.
+
+    METRICS_PORT = 9464   # в config.py
+    curl http://127.0.0.1:9464/metrics
+
+Все метрики меняются только из event loop, поэтому без блокировок.
+"""
+import asyncio
+import functools
+import logging
+import math
+import time
+
+import config
+from logs import log_context, dropped_records
+
+METRICS_HOST = getattr(config, "METRICS_HOST", "127.0.0.1")
+# None — HTTP-эндпоинт не поднимается
+METRICS_PORT = getattr(config, "METRICS_PORT", None)
+# клиент, не приславший запрос (или не читающий ответ) за это время, отключается, секунды
+METRICS_READ_TIMEOUT = getattr(config, "METRICS_READ_TIMEOUT", 5)
+
+# секунды: от быстрых запросов в БД до сборки больших PDF
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120
+)
+
+
+# ===================== METRICS =====================
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Значение растёт через inc() или считается при каждом опросе
+    функцией fn, которая возвращает {значения меток: число}.
+    """
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), fn=None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.fn = fn
+        self.values = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        if self.fn is not None:
+            self.values = dict(self.fn())
+        for labels, value in self.values.items():
+            yield self.name, _labels(self.labels, labels), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (math.inf,)
+        # значения меток → [счётчики по корзинам..., сумма, количество]
+        self.values = {}
+
+    def observe(self, value: float, *labels):
+        row = self.values.get(labels)
+        if row is None:
+            row = self.values[labels] = [0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += value
+        row[-1] += 1
+
+    def time(self, *labels):
+        return _Timer(self, labels)
+
+    def samples(self):
+        for labels, row in self.values.items():
+            names = self.labels + ("le",)
+            cumulative = 0
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(names, labels + (_number(bound),)), cumulative
+            yield f"{self.name}_sum", _labels(self.labels, labels), row[-2]
+            yield f"{self.name}_count", _labels(self.labels, labels), row[-1]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+# ===================== REGISTRY =====================
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+
+    def add(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{labels} {_number(value)}")
+            except Exception as e:
+                logging.warning("⚠️ Metric %s failed: %r", metric.name, e)
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, help: str, labels: tuple = (), fn=None) -> Counter:
+    return REGISTRY.add(Counter(name, help, labels, fn))
+
+
+def gauge(name: str, help: str, labels: tuple = (), fn=None) -> Gauge:
+    return REGISTRY.add(Gauge(name, help, labels, fn))
+
+
+def histogram(name: str, help: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.add(Histogram(name, help, labels, buckets))
+
+
+# ===================== COMMON =====================
+
+HANDLER_SECONDS = histogram(
+    "bot_handler_seconds", "Update handler latency", ("handler",)
+)
+HANDLER_ERRORS = counter(
+    "bot_handler_errors_total", "Update handlers that raised", ("handler",)
+)
+
+LOG_DROPPED = counter(
+    "log_records_dropped_total", "Log records dropped because the log queue was full",
+    fn=lambda: {(): dropped_records()},
+)
+
+_handler_log = logging.getLogger("bot.handler")
+
+
+def timed_handler(fn):
+    """
+    Задержка и ошибки обработчика апдейта под его именем.
+    Записи лога внутри обработчика получают user_id и handler,
+    по завершении пишется событие handler с длительностью и новым состоянием.
+    """
+    name = fn.__name__
+
+    @functools.wraps(fn)
+    async def wrapper(update, *args, **kwargs):
+        user = getattr(update, "effective_user", None)
+        token = log_context.set({
+            **log_context.get(),
+            "user_id": user.id if user else None,
+            "handler": name,
+        })
+        start = time.perf_counter()
+        state = None
+        try:
+            state = await fn(update, *args, **kwargs)
+            return state
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            duration = time.perf_counter() - start
+            HANDLER_SECONDS.observe(duration, name)
+            if _handler_log.isEnabledFor(logging.INFO):
+                _handler_log.info(
+                    "⏱ %s %.3fs", name, duration,
+                    extra={"event": "handler", "duration": round(duration, 4), "state": state},
+                )
+            log_context.reset(token)
+    return wrapper
+
+
+# ===================== HTTP =====================
+
+async def _read_request(reader) -> bytes:
+    request = await reader.readline()
+    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+        pass
+    return request
+
+
+async def _handle(reader, writer):
+    try:
+        request = await asyncio.wait_for(_read_request(reader), METRICS_READ_TIMEOUT)
+
+        parts = request.decode(errors="replace").split()
+        if len(parts) >= 2 and parts[1].split("?", 1)[0] == "/metrics":
+            status, body = "200 OK", REGISTRY.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not Found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await asyncio.wait_for(writer.drain(), METRICS_READ_TIMEOUT)
+    except (ConnectionError, asyncio.TimeoutError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host: str = METRICS_HOST, port: int | None = METRICS_PORT):
+    """
+    Поднимает эндпоинт /metrics. Возвращает asyncio.Server или None, если порт не задан.
+    """
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    logging.info("📈 Metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,193 @@
+import asyncio
+import json
+import logging
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+import config
+from database import StateRepo
+
+# как часто Application сбрасывает изменённые user_data и состояния, секунды
+PERSISTENCE_INTERVAL = getattr(config, "PERSISTENCE_INTERVAL", 5)
+
+
+def _encode(obj):
+    if isinstance(obj, (set, frozenset)):
+        return {"__set__": sorted(obj)}
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+def _decode(obj: dict):
+    if "__set__" in obj:
+        return set(obj["__set__"])
+    return obj
+
+
+def dumps(data) -> str:
+    return json.dumps(data, default=_encode, sort_keys=True, ensure_ascii=False)
+
+
+def loads(data: str):
+    return json.loads(data, object_hook=_decode)
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Состояния ConversationHandler и user_data в SQLite (через StateRepo).
+
+    - user_data читается лениво: при первом апдейте пользователя
+      после старта (refresh_user_data), а не вся таблица сразу;
+    - пишутся только изменившиеся записи: то, что совпадает
+      с последним сохранённым JSON, пропускается;
+    - все изменения одного цикла Application.update_persistence
+      уходят в базу одной транзакцией.
+
+    Состояния диалогов — маленькие числа, их ConversationHandler
+    требует целиком при старте, поэтому они читаются сразу.
+    """
+
+    def __init__(self, repo: StateRepo, update_interval: float = PERSISTENCE_INTERVAL):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.repo = repo
+
+        # user_id → последний сохранённый JSON
+        self._stored = {}
+        self._loaded = set()
+
+        self._dirty_users = {}
+        self._dirty_conversations = {}
+        self._flushing = None
+        # name → {ключ: состояние} — последние состояния диалогов, для метрик
+        self._states = {}
+
+    # ---------- загрузка ----------
+
+    async def get_user_data(self) -> dict:
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: dict):
+        if user_id in self._loaded:
+            return
+        self._loaded.add(user_id)
+
+        data = await self.repo.user_data(user_id)
+        if data is None:
+            return
+        self._stored[user_id] = data
+        # то, что успел записать текущий апдейт, важнее сохранённого
+        for key, value in loads(data).items():
+            user_data.setdefault(key, value)
+
+    async def get_conversations(self, name: str) -> dict:
+        conversations = {
+            tuple(json.loads(key)): loads(state)
+            for key, state in (await self.repo.conversations(name)).items()
+        }
+        self._states[name] = dict(conversations)
+        return conversations
+
+    def conversation_states(self, name: str) -> dict:
+        """
+        Состояния диалогов name (ключ → состояние) на момент последнего
+        update_conversation — отстают не больше чем на update_interval
+        """
+        return self._states.get(name, {})
+
+    # ---------- запись ----------
+
+    async def update_user_data(self, user_id: int, data: dict):
+        try:
+            encoded = dumps(data)
+        except TypeError as e:
+            logging.warning("⚠️ user_data of %s is not serializable: %s", user_id, e)
+            return
+
+        if self._stored.get(user_id) == encoded:
+            return
+        self._dirty_users[user_id] = encoded
+        await self._schedule_flush()
+
+    async def drop_user_data(self, user_id: int):
+        self._dirty_users[user_id] = None
+        await self._schedule_flush()
+
+    async def update_conversation(self, name: str, key, new_state):
+        states = self._states.setdefault(name, {})
+        if new_state is None:
+            states.pop(tuple(key), None)
+        else:
+            states[tuple(key)] = new_state
+
+        state = None if new_state is None else dumps(new_state)
+        self._dirty_conversations[(name, json.dumps(list(key)))] = state
+        await self._schedule_flush()
+
+    async def _schedule_flush(self):
+        # update_* одного цикла вызываются одновременно (gather) —
+        # все они дожидаются одной общей записи
+        if self._flushing is None:
+            self._flushing = asyncio.ensure_future(self._flush())
+        await asyncio.shield(self._flushing)
+
+    async def _flush(self):
+        await asyncio.sleep(0)
+        users, self._dirty_users = self._dirty_users, {}
+        conversations, self._dirty_conversations = self._dirty_conversations, {}
+        self._flushing = None
+
+        if not users and not conversations:
+            return
+
+        try:
+            await self.repo.save(users, conversations)
+        except Exception as e:
+            logging.warning("⚠️ Persistence flush failed: %r", e)
+            # вернём в очередь, не затирая более свежие изменения
+            for uid, data in users.items():
+                self._dirty_users.setdefault(uid, data)
+            for key, state in conversations.items():
+                self._dirty_conversations.setdefault(key, state)
+            return
+
+        for uid, data in users.items():
+            if data is None:
+                self._stored.pop(uid, None)
+            else:
+                self._stored[uid] = data
+
+    async def flush(self):
+        if self._flushing is not None:
+            await self._flushing
+        await self._flush()
+
+    # ---------- не используется ----------
+
+    async def get_chat_data(self) -> dict:
+        return {}
+
+    async def get_bot_data(self) -> dict:
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id: int, data: dict):
+        pass
+
+    async def update_bot_data(self, data: dict):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id: int):
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: dict):
+        pass
+
+    async def refresh_bot_data(self, bot_data: dict):
+        pass
@@ -0,0 +1,159 @@
+import os
+import time
+from collections import OrderedDict
+
+import config
+from config import STORAGE_PDF
+
+# превью лежат рядом с хранилищем PDF, по sha256 файла
+STORAGE_PREVIEW = getattr(
+    config, "STORAGE_PREVIEW",
+    os.path.join(os.path.dirname(os.path.abspath(STORAGE_PDF)), "previews")
+)
+PREVIEW_CACHE_BYTES = getattr(config, "PREVIEW_CACHE_BYTES", 64 * 1024 * 1024)
+# как часто add() перечитывает общий каталог превью, секунды
+PREVIEW_RESCAN_INTERVAL = getattr(config, "PREVIEW_RESCAN_INTERVAL", 30)
+
+
+class PreviewCache:
+    """
+    JPEG-превью первой страницы на диске, ключ — sha256 PDF.
+
+    Общий размер ограничен max_bytes: при переполнении удаляются
+    давно не показанные превью (LRU). Порядок хранится в mtime файлов,
+    поэтому переживает перезапуск.
+    Каталог общий для всех воркеров (WORKERS > 1), поэтому размер
+    и порядок перечитываются из каталога — не чаще раза
+    в PREVIEW_RESCAN_INTERVAL, при добавлении: лимит — на весь кэш,
+    а не на процесс, но между пересчётами его можно ненадолго превысить.
+    Запомненные file_id фото позволяют показывать превью без повторной загрузки.
+    """
+
+    def __init__(self, root: str = STORAGE_PREVIEW, max_bytes: int = PREVIEW_CACHE_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.total = 0
+        # sha256 → размер, от давних к свежим
+        self._entries = OrderedDict()
+        self._file_ids = {}
+        self._loaded_at = 0.0
+
+        os.makedirs(root, exist_ok=True)
+        self._load()
+        self._evict()
+
+    def _load(self):
+        """
+        Записи кэша по каталогу, от давних к свежим —
+        вместе с превью, добавленными другими процессами
+        """
+        self._loaded_at = time.monotonic()
+        found = []
+        for entry in os.scandir(self.root):
+            if not entry.name.endswith(".jpg"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            found.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+
+        self._entries = OrderedDict((sha, size) for _, sha, size in sorted(found))
+        self.total = sum(self._entries.values())
+        for sha in [sha for sha in self._file_ids if sha not in self._entries]:
+            del self._file_ids[sha]
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, f"{sha256}.jpg")
+
+    def __contains__(self, sha256: str) -> bool:
+        return self._known(sha256)
+
+    def _known(self, sha256: str) -> bool:
+        if sha256 in self._entries:
+            return True
+        # превью мог добавить другой воркер
+        try:
+            size = os.path.getsize(self.path(sha256))
+        except FileNotFoundError:
+            return False
+        self._entries[sha256] = size
+        self.total += size
+        return True
+
+    def get(self, sha256: str | None):
+        """
+        file_id уже отправленного превью, байты JPEG или None
+        """
+        if not sha256 or not self._known(sha256):
+            return None
+
+        self._entries.move_to_end(sha256)
+        try:
+            os.utime(self.path(sha256))
+            if sha256 in self._file_ids:
+                return self._file_ids[sha256]
+            with open(self.path(sha256), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            self._forget(sha256)
+            return None
+
+    def remember(self, sha256: str, file_id: str):
+        if sha256 in self._entries:
+            self._file_ids[sha256] = file_id
+
+    def add(self, sha256: str, tmp_path: str):
+        """
+        Переносит готовое превью в кэш
+        """
+        path = self.path(sha256)
+        os.replace(tmp_path, path)
+        # жёсткая ссылка из link() наследует старый mtime исходника
+        os.utime(path)
+        self._forget(sha256)
+        self._entries[sha256] = os.path.getsize(path)
+        self.total += self._entries[sha256]
+        if time.monotonic() - self._loaded_at >= PREVIEW_RESCAN_INTERVAL:
+            self._load()
+        self._evict()
+
+    def link(self, src_sha256: str | None, sha256: str) -> bool:
+        """
+        Превью нового PDF = превью исходного (merge, optimize).
+        False — у исходного превью нет.
+        """
+        if not src_sha256 or not self._known(src_sha256):
+            return False
+        if self._known(sha256):
+            return True
+
+        # имя уникально для процесса — кэш может делить несколько воркеров
+        tmp = f"{self.path(sha256)}.{os.getpid()}.part"
+        try:
+            try:
+                os.link(self.path(src_sha256), tmp)
+            except OSError:
+                with open(self.path(src_sha256), "rb") as src, open(tmp, "wb") as dst:
+                    dst.write(src.read())
+        except FileNotFoundError:
+            self._forget(src_sha256)
+            return False
+
+        self.add(sha256, tmp)
+        return True
+
+    def _forget(self, sha256: str):
+        size = self._entries.pop(sha256, None)
+        if size is not None:
+            self.total -= size
+        self._file_ids.pop(sha256, None)
+
+    def _evict(self):
+        while self.total > self.max_bytes and len(self._entries) > 1:
+            sha256 = next(iter(self._entries))
+            self._forget(sha256)
+            try:
+                os.remove(self.path(sha256))
+            except FileNotFoundError:
+                pass
@@ -1,8 +1,230 @@
+"""
+Операции с PDF. Выполняются в пуле PDF-процессов (jobs.py), поэтому
+reportlab, PIL и PyPDF2 импортируются внутри функций: bot.py нужен
+только этот модуль ради ссылок на функции, а тяжёлые библиотеки
+загружаются в процессе пула при первой операции.
+"""
+import hashlib
+import io
 import os
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
-from PIL import Image, ImageOps
-from PyPDF2 import PdfMerger
+
+import config
+
+# максимальное разрешение изображений в PDF; всё, что больше, уменьшается
+PDF_MAX_DPI = getattr(config, "PDF_MAX_DPI", 200)
+
+# склейка PDF постранично с ограниченной памятью (см. _StreamingMerge)
+PDF_MERGE_STREAMING = getattr(config, "PDF_MERGE_STREAMING", True)
+
+# пресеты optimize: (максимальное разрешение, качество JPEG).
+# Единственный список: по нему строятся кнопки (keyboards.optimize_kb)
+# и шаблон обработчика optimize_apply в bot.py
+OPTIMIZE_PRESETS = {
+    "screen": (72, 50),
+    "ebook": (150, 70),
+    "print": (300, 85),
+}
+
+# сторона превью первой страницы, пиксели
+PREVIEW_SIZE = getattr(config, "PREVIEW_SIZE", 320)
+
+EXIF_ORIENTATION = 0x0112
+
+
+def preload():
+    """
+    Импортирует библиотеки заранее, чтобы первая операция не ждала импорта
+    """
+    import reportlab.pdfgen.canvas
+    import reportlab.lib.utils
+    import PIL.Image
+    import PIL.ImageOps
+    import PyPDF2.generic
+
+
+def _canvas(output: str):
+    from reportlab import rl_config
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    # потоки изображений пишутся в PDF бинарно, без ASCII85 (+25% к размеру)
+    rl_config.useA85 = 0
+    return canvas.Canvas(output, pagesize=A4, invariant=True)
+
+
+class _JPEGSource:
+    """
+    JPEG из памяти для canvas.drawImage.
+    reportlab берёт поток из jpeg_fh() как есть, а str() служит ключом
+    для дедупликации изображений внутри документа.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def jpeg_fh(self):
+        return io.BytesIO(self.data)
+
+    def __str__(self):
+        return "jpeg:" + hashlib.sha1(self.data).hexdigest()
+
+
+class _StreamingMerge:
+    """
+    Склейка PDF с ограниченной памятью.
+
+    Страницы копируются по одной: объекты страницы (и всё, на что она
+    ссылается) сразу пишутся в выходной файл с новыми номерами, после
+    чего кэш исходного документа сбрасывается. В памяти остаются только
+    таблица номеров и смещения объектов; общие ресурсы (шрифты, картинки)
+    пишутся один раз на исходный документ.
+    """
+
+    def __init__(self, output: str):
+        self.output = output
+        self.offsets = [None, None, None]  # 0 — свободный, 1 — Pages, 2 — Catalog
+        self.kids = []
+
+    def _alloc(self) -> int:
+        self.offsets.append(None)
+        return len(self.offsets) - 1
+
+    def run(self, sources: list, progress=None, total: int | None = None) -> int:
+        from PyPDF2 import PdfReader
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject, NumberObject
+
+        with open(self.output, "wb") as out:
+            self.out = out
+            out.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+
+            for done, (path, pages) in enumerate(sources, 1):
+                with open(path, "rb") as f:
+                    self._copy_document(PdfReader(f), pages)
+                if progress:
+                    progress(done, total or len(sources))
+
+            kids = ArrayObject(IndirectObject(n, 0, None) for n in self.kids)
+            self._write_raw(1, DictionaryObject({
+                NameObject("/Type"): NameObject("/Pages"),
+                NameObject("/Kids"): kids,
+                NameObject("/Count"): NumberObject(len(self.kids)),
+            }))
+            self._write_raw(2, DictionaryObject({
+                NameObject("/Type"): NameObject("/Catalog"),
+                NameObject("/Pages"): IndirectObject(1, 0, None),
+            }))
+            self._write_trailer()
+
+        return len(self.kids)
+
+    def _copy_document(self, reader, pages: tuple | None):
+        from PyPDF2.generic import IndirectObject
+
+        if reader.is_encrypted:
+            reader.decrypt("")
+
+        selected = range(*pages) if pages else range(len(reader.pages))
+
+        # номера страниц выделяем заранее: ссылки между страницами
+        # (аннотации, закладки) указывают на уже известные объекты
+        mapping = {}
+        page_nums = []
+        for i in selected:
+            ref = reader.pages[i].indirect_reference
+            num = self._alloc()
+            mapping[(ref.idnum, ref.generation)] = num
+            page_nums.append(num)
+
+        for i, num in zip(selected, page_nums):
+            page = reader.pages[i]
+            queue = []
+            self._write_object(num, page, reader, mapping, queue, is_page=True)
+
+            while queue:
+                key, obj_num = queue.pop()
+                obj = reader.get_object(IndirectObject(key[0], key[1], reader))
+                self._write_object(obj_num, obj, reader, mapping, queue)
+
+            self.kids.append(num)
+            # объекты страницы уже записаны — кэш исходника больше не нужен
+            reader.resolved_objects.clear()
+
+    def _write_object(self, num: int, obj, reader, mapping: dict, queue: list, is_page=False):
+        from PyPDF2.generic import DictionaryObject
+
+        self.offsets[num] = self.out.tell()
+        self.out.write(b"%d 0 obj\n" % num)
+
+        if (
+            not is_page
+            and isinstance(obj, DictionaryObject)
+            and obj.get("/Type") in ("/Page", "/Pages")
+        ):
+            # чужая страница или дерево страниц исходника — не тянем за собой
+            self.out.write(b"null")
+        else:
+            self._serialize(obj, reader, mapping, queue, is_page)
+
+        self.out.write(b"\nendobj\n")
+
+    def _write_raw(self, num: int, obj):
+        self.offsets[num] = self.out.tell()
+        self.out.write(b"%d 0 obj\n" % num)
+        obj.write_to_stream(self.out, None)
+        self.out.write(b"\nendobj\n")
+
+    def _serialize(self, obj, reader, mapping: dict, queue: list, is_page=False):
+        from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+        out = self.out
+
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            num = mapping.get(key)
+            if num is None:
+                num = mapping[key] = self._alloc()
+                queue.append((key, num))
+            out.write(b"%d 0 R" % num)
+
+        elif isinstance(obj, DictionaryObject):
+            data = getattr(obj, "_data", None) if isinstance(obj, StreamObject) else None
+            out.write(b"<<")
+            for key, value in obj.items():
+                if key == "/Length" and data is not None:
+                    continue
+                out.write(b"\n")
+                key.write_to_stream(out, None)
+                out.write(b" ")
+                if is_page and key == "/Parent":
+                    out.write(b"1 0 R")
+                else:
+                    self._serialize(value, reader, mapping, queue)
+            if data is not None:
+                out.write(b"\n/Length %d" % len(data))
+            out.write(b"\n>>")
+            if data is not None:
+                out.write(b"\nstream\n")
+                out.write(data)
+                out.write(b"\nendstream")
+
+        elif isinstance(obj, ArrayObject):
+            out.write(b"[")
+            for value in obj:
+                out.write(b" ")
+                self._serialize(value, reader, mapping, queue)
+            out.write(b" ]")
+
+        else:
+            obj.write_to_stream(out, None)
+
+    def _write_trailer(self):
+        xref = self.out.tell()
+        self.out.write(b"xref\n0 %d\n" % len(self.offsets))
+        self.out.write(b"0000000000 65535 f \n")
+        for offset in self.offsets[1:]:
+            self.out.write(b"%010d 00000 n \n" % offset)
+        self.out.write(b"trailer\n<< /Size %d /Root 2 0 R >>\n" % len(self.offsets))
+        self.out.write(b"startxref\n%d\n%%%%EOF\n" % xref)
 
 
 class PDFService:
@@ -10,64 +232,374 @@ class PDFService:
     # ===================== IMAGES → PDF =====================
 
     @staticmethod
-    def images_to_pdf(images: list[str], output: str):
+    def images_to_pdf(images: list[str], output: str, progress=None):
         """
         Конвертирует изображения в PDF (A4),
         корректно обрабатывает:
         - PNG / JPG / CMYK
         - EXIF orientation
         - масштабирование и центрирование
+
+        progress(done, total) вызывается перед каждой страницей
+        Возвращает метаданные результата (см. file_info)
         """
         if not images:
             raise ValueError("No images provided")
 
-        c = canvas.Canvas(output, pagesize=A4)
-        page_w, page_h = A4
+        c = _canvas(output)
+        pages = 0
+
+        for i, img_path in enumerate(images):
+            if progress:
+                progress(i, len(images))
 
-        for img_path in images:
             if not os.path.exists(img_path):
                 continue
 
-            with Image.open(img_path) as img:
-                # исправление ориентации (EXIF)
-                img = ImageOps.exif_transpose(img)
+            PDFService._draw_page(c, img_path)
+            pages += 1
 
-                # гарантируем RGB
-                img = img.convert("RGB")
+        c.save()
+        return PDFService.file_info(output, pages)
 
-                w, h = img.size
-                scale = min(page_w / w, page_h / h)
+    @staticmethod
+    def render_page(image: str | bytes, output: str, progress=None):
+        """
+        Рендерит одно изображение (путь или байты) в одностраничный PDF.
+        Используется для сборки документа по мере прихода фото,
+        готовые страницы потом склеиваются через join_pages.
+
+        progress(done, total) — между этапами: отмена / таймаут
+        останавливают задачу, не дожидаясь записи файла.
+        """
+        if isinstance(image, str) and not os.path.exists(image):
+            raise FileNotFoundError(image)
+
+        if progress:
+            progress(0, 2)
+        c = _canvas(output)
+        PDFService._draw_page(c, image)
+        if progress:
+            progress(1, 2)
+        c.save()
+        if progress:
+            progress(2, 2)
+
+    @staticmethod
+    def _draw_page(c, src: str | bytes):
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.utils import ImageReader
+        from PIL import Image, ImageOps
+
+        page_w, page_h = A4
+        in_memory = isinstance(src, bytes)
+
+        with Image.open(io.BytesIO(src) if in_memory else src) as img:
+            # размеры с учётом EXIF-поворота, без декодирования пикселей
+            raw_w, raw_h = img.size
+            orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+            rotated = orientation in (5, 6, 7, 8)
+            w, h = (raw_h, raw_w) if rotated else (raw_w, raw_h)
+
+            scale = min(page_w / w, page_h / h)
+
+            new_w = w * scale
+            new_h = h * scale
 
-                new_w = w * scale
-                new_h = h * scale
+            x = (page_w - new_w) / 2
+            y = (page_h - new_h) / 2
 
-                x = (page_w - new_w) / 2
-                y = (page_h - new_h) / 2
+            # сколько пикселей нужно странице при PDF_MAX_DPI
+            max_w = max(1, int(new_w / 72 * PDF_MAX_DPI))
+            max_h = max(1, int(new_h / 72 * PDF_MAX_DPI))
 
-                # drawInlineImage безопаснее, чем drawImage(path)
-                c.drawInlineImage(img, x, y, new_w, new_h)
+            if (
+                img.format == "JPEG"
+                and img.mode in ("RGB", "L")
+                and orientation == 1
+                and w <= max_w and h <= max_h
+                and (in_memory or os.path.splitext(src)[1].lower() in (".jpg", ".jpeg"))
+            ):
+                # JPEG встраивается как есть (DCTDecode), без декодирования
+                c.drawImage(_JPEGSource(src) if in_memory else src, x, y, new_w, new_h)
                 c.showPage()
+                return
 
-        c.save()
+            if w > max_w or h > max_h:
+                # JPEG декодируется сразу в уменьшенном масштабе (1/2 … 1/8)
+                img.draft(img.mode, (max_h, max_w) if rotated else (max_w, max_h))
+
+            # исправление ориентации (EXIF)
+            img = ImageOps.exif_transpose(img)
+
+            # гарантируем RGB
+            img = img.convert("RGB")
+
+            # ограничиваем разрешение до PDF_MAX_DPI
+            img.thumbnail((max_w, max_h))
+
+            # уже декодированное изображение, а не путь: в PDF оно
+            # попадает как XObject с FlateDecode (inline-картинки несовместимы
+            # с бинарными потоками при useA85 = 0)
+            c.drawImage(ImageReader(img), x, y, new_w, new_h)
+            c.showPage()
 
     # ===================== MERGE PDFs =====================
 
     @staticmethod
-    def merge_pdfs(pdf_paths: list[str], output: str):
+    def merge_pdfs(pdf_paths: list, output: str, progress=None, streaming: bool = PDF_MERGE_STREAMING):
         """
-        Объединяет несколько PDF в один
+        Объединяет несколько PDF в один.
+        Элемент списка — путь или (путь, (start, stop)) для диапазона страниц.
+
+        streaming — копировать страницы по одной с ограниченной памятью
+        (иначе PdfMerger держит все документы целиком до записи)
+
+        progress(done, total) вызывается после каждого файла
         """
         if len(pdf_paths) < 2:
             raise ValueError("Need at least two PDFs to merge")
 
+        return PDFService._concat(pdf_paths, output, progress, streaming)
+
+    @staticmethod
+    def join_pages(pages: list[str], output: str, progress=None):
+        """
+        Склеивает страницы, отрендеренные render_page, в итоговый PDF.
+        Изображения повторно не декодируются — копируются готовые страницы.
+        """
+        if not pages:
+            raise ValueError("No pages provided")
+
+        return PDFService._concat(pages, output, progress, PDF_MERGE_STREAMING)
+
+    @staticmethod
+    def _concat(inputs: list, output: str, progress, streaming: bool):
+        sources = []
+        for item in inputs:
+            path, pages = (item, None) if isinstance(item, str) else item
+            if os.path.exists(path):
+                sources.append((path, pages))
+
+        if streaming:
+            count = _StreamingMerge(output).run(sources, progress, len(inputs))
+            return PDFService.file_info(output, count)
+
+        from PyPDF2 import PdfMerger
+
         merger = PdfMerger()
 
         try:
-            for path in pdf_paths:
-                if not os.path.exists(path):
-                    continue
-                merger.append(path)
+            for done, (path, pages) in enumerate(sources, 1):
+                merger.append(path, pages=pages)
+                if progress:
+                    progress(done, len(inputs))
 
             merger.write(output)
+            count = len(merger.pages)
         finally:
             merger.close()
+
+        return PDFService.file_info(output, count)
+
+    # ===================== OPTIMIZE =====================
+
+    @staticmethod
+    def optimize(path: str, output: str, preset: str = "ebook", progress=None):
+        """
+        Пережимает изображения PDF под пресет из OPTIMIZE_PRESETS:
+        уменьшает до разрешения пресета и перекодирует в JPEG,
+        одинаковые изображения оставляет в одном экземпляре.
+        Неиспользуемые объекты не попадают в результат — PdfWriter
+        копирует только то, на что ссылаются страницы.
+
+        progress(done, total) вызывается после каждой страницы.
+        Возвращает file_info результата и размер исходника в "before".
+        """
+        from PyPDF2 import PdfReader, PdfWriter
+
+        dpi, quality = OPTIMIZE_PRESETS[preset]
+        reader = PdfReader(path)
+        writer = PdfWriter()
+        # хэш изображения → первая ссылка на него; idnum → итоговая ссылка
+        seen, done = {}, {}
+
+        total = len(reader.pages)
+        for i, page in enumerate(reader.pages):
+            max_px = int(max(page.mediabox.width, page.mediabox.height) / 72 * dpi)
+            PDFService._optimize_images(page, max_px, quality, seen, done)
+            writer.add_page(page)
+            if progress:
+                progress(i + 1, total)
+
+        for page in writer.pages:
+            page.compress_content_streams()
+
+        with open(output, "wb") as f:
+            writer.write(f)
+
+        info = PDFService.file_info(output, total)
+        info["before"] = os.path.getsize(path)
+        return info
+
+    @staticmethod
+    def _optimize_images(page, max_px: int, quality: int, seen: dict, done: dict):
+        from PyPDF2.generic import IndirectObject, NameObject
+
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else None
+        xobjects = resources.get("/XObject") if resources else None
+        if xobjects is None:
+            return
+        xobjects = xobjects.get_object()
+
+        for name, ref in list(xobjects.items()):
+            if not isinstance(ref, IndirectObject):
+                continue
+
+            if ref.idnum not in done:
+                image = ref.get_object()
+                if image.get("/Subtype") != "/Image":
+                    continue
+                PDFService._recompress(image, max_px, quality)
+
+                key = hashlib.sha1(image._data)
+                for param in ("/Width", "/Height", "/ColorSpace", "/BitsPerComponent", "/Filter", "/Decode"):
+                    key.update(repr(image.get(param)).encode())
+                done[ref.idnum] = seen.setdefault(key.hexdigest(), ref)
+
+            xobjects[NameObject(name)] = done[ref.idnum]
+
+    @staticmethod
+    def _decode_image(image, max_px: int):
+        """
+        PIL-изображение из XObject (JPEG или 8-битный RGB/Gray без фильтров и Flate).
+        None — формат не поддерживается: маски, палитра, CMYK и прочее.
+        """
+        from PIL import Image
+        from PyPDF2.generic import ArrayObject
+
+        if "/SMask" in image or "/Mask" in image or image.get("/ImageMask"):
+            return None
+
+        filters = image.get("/Filter")
+        if filters is None:
+            filters = []
+        elif not isinstance(filters, ArrayObject):
+            filters = [filters]
+        color_space = image.get("/ColorSpace")
+        width, height = image["/Width"], image["/Height"]
+
+        if filters == ["/DCTDecode"]:
+            img = Image.open(io.BytesIO(image._data))
+            # JPEG уменьшается уже при декодировании
+            img.draft(img.mode, (max_px, max_px))
+        elif (
+            filters in ([], ["/FlateDecode"])
+            and "/DecodeParms" not in image
+            and color_space in ("/DeviceRGB", "/DeviceGray")
+            and image.get("/BitsPerComponent") == 8
+        ):
+            mode = "RGB" if color_space == "/DeviceRGB" else "L"
+            img = Image.frombytes(mode, (width, height), image.get_data())
+        else:
+            return None
+
+        if img.mode not in ("RGB", "L"):
+            return None
+        return img
+
+    @staticmethod
+    def _recompress(image, max_px: int, quality: int):
+        """
+        Перекодирует поток изображения в JPEG, если это уменьшает его.
+        """
+        from PyPDF2.generic import NameObject, NumberObject
+
+        img = PDFService._decode_image(image, max_px)
+        if img is None:
+            return
+
+        img.thumbnail((max_px, max_px))
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=quality, optimize=True)
+        data = buf.getvalue()
+        if len(data) >= len(image._data):
+            return
+
+        image._data = data
+        if hasattr(image, "decoded_self"):
+            image.decoded_self = None
+        image[NameObject("/Filter")] = NameObject("/DCTDecode")
+        image[NameObject("/Width")] = NumberObject(img.width)
+        image[NameObject("/Height")] = NumberObject(img.height)
+        image[NameObject("/ColorSpace")] = NameObject(
+            "/DeviceRGB" if img.mode == "RGB" else "/DeviceGray"
+        )
+        image[NameObject("/BitsPerComponent")] = NumberObject(8)
+        image.pop("/DecodeParms", None)
+
+    # ===================== PREVIEW =====================
+
+    @staticmethod
+    def make_preview(pdf_path: str, output: str, size: int = PREVIEW_SIZE, progress=None) -> bool:
+        """
+        JPEG-превью первой страницы.
+        Растеризатора PDF нет, поэтому берётся самое большое изображение
+        первой страницы — у сканов и PDF из фото это и есть вся страница.
+        False — подходящего изображения на странице нет.
+        progress(done, total) — между этапами (чтение, декодирование, запись).
+        """
+        from PyPDF2 import PdfReader
+
+        if progress:
+            progress(0, 3)
+        reader = PdfReader(pdf_path)
+        if not reader.pages:
+            return False
+
+        resources = reader.pages[0].get("/Resources")
+        xobjects = resources.get_object().get("/XObject") if resources is not None else None
+        if xobjects is None:
+            return False
+
+        images = [
+            obj for obj in (ref.get_object() for ref in xobjects.get_object().values())
+            if obj.get("/Subtype") == "/Image"
+        ]
+        if not images:
+            return False
+
+        largest = max(images, key=lambda obj: obj["/Width"] * obj["/Height"])
+        if progress:
+            progress(1, 3)
+        img = PDFService._decode_image(largest, size)
+        if img is None:
+            return False
+
+        img = img.convert("RGB")
+        img.thumbnail((size, size))
+        if progress:
+            progress(2, 3)
+        img.save(output, "JPEG", quality=70, optimize=True)
+        if progress:
+            progress(3, 3)
+        return True
+
+    # ===================== METADATA =====================
+
+    @staticmethod
+    def file_info(path: str, pages: int) -> dict:
+        """
+        Размер, число страниц и sha256 готового PDF
+        """
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        return {
+            "size": os.path.getsize(path),
+            "pages": pages,
+            "sha256": digest.hexdigest(),
+        }
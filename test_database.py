@@ -0,0 +1,196 @@
+"""
+Регрессии потока БД (Database._worker): упавший вызов не должен
+подвешивать записи пачки и не должен оставлять свои частичные записи.
+
+    python -m pytest test_database.py
+"""
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import database
+from database import Database, FileRepo, UserRepo
+
+
+class WorkerErrorTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="dbtest_")
+        patcher = mock.patch.object(database, "STORAGE_PDF", os.path.join(self.workdir, "pdf"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.db = Database(os.path.join(self.workdir, "test.db"))
+        self.users = UserRepo(self.db)
+        self.files = FileRepo(self.db)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    async def test_failed_call_does_not_hang_pending_writes(self):
+        user = await self.users.get_or_create(1)
+
+        # create попадает в пачку, следом в очереди — падающий вызов
+        created, failed = await asyncio.wait_for(
+            asyncio.gather(
+                self.files.create(user["id"], "doc", ""),
+                self.files.store(1, os.path.join(self.workdir, "missing.pdf"), {"sha256": "ab" * 32}),
+                return_exceptions=True,
+            ),
+            timeout=2,
+        )
+
+        self.assertIsInstance(created, int)
+        self.assertIsInstance(failed, FileNotFoundError)
+        self.assertEqual(await self.users.usage(user["id"]), (0, 1))
+
+    async def test_failed_call_rolls_back_its_writes(self):
+        user = await self.users.get_or_create(1)
+        file_id = await self.files.create(user["id"], "doc", "")
+
+        with self.assertRaises(FileNotFoundError):
+            await self.files.store(
+                file_id, os.path.join(self.workdir, "missing.pdf"), {"sha256": "cd" * 32, "size": 10}
+            )
+        # любой следующий вызов коммитит пачку — в ней не должно быть blobs от store
+        await self.files.create(user["id"], "other", "")
+
+        blobs = await self.db.run(
+            lambda: self.db.conn.execute("SELECT COUNT(*) FROM blobs").fetchone()[0]
+        )
+        self.assertEqual(blobs, 0)
+        self.assertEqual((await self.files.get(file_id, user["id"]))["sha256"], None)
+
+
+    async def test_failed_call_drops_its_file_actions(self):
+        done = []
+
+        def failing():
+            self.db.after_commit(done.append, "failing")
+            raise ValueError("boom")
+
+        with self.assertRaises(ValueError):
+            await self.db.run(failing, write=True)
+        await self.db.run(lambda: self.db.after_commit(done.append, "ok"), write=True)
+        self.assertEqual(done, ["ok"])
+
+    async def test_blob_moves_after_commit(self):
+        user = await self.users.get_or_create(1)
+        file_id = await self.files.create(user["id"], "doc", "")
+        tmp = os.path.join(self.workdir, "doc.pdf")
+        with open(tmp, "wb") as f:
+            f.write(b"%PDF")
+
+        stored = await self.files.store(file_id, tmp, {"sha256": "ef" * 32, "size": 4})
+        path = os.path.join(database.STORAGE_PDF, stored)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(os.path.exists(tmp))
+
+        await self.files.delete(file_id, user["id"])
+        self.assertFalse(os.path.exists(path))
+
+    async def test_delete_unfinished_frees_quota(self):
+        user = await self.users.get_or_create(1)
+        stale = await self.files.create(user["id"], "crashed", "")
+        await self.files.create(user["id"], "in progress", "")
+        await self.db.run(
+            lambda: self.db.conn.execute(
+                "UPDATE files SET created_at=datetime('now', '-2 hours') WHERE id=?", (stale,)
+            ),
+            write=True,
+        )
+
+        self.assertEqual(await self.files.delete_unfinished(3600), 1)
+        self.assertIsNone(await self.files.get(stale, user["id"]))
+        self.assertEqual(await self.users.usage(user["id"]), (0, 1))
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="dbtest_")
+        self.path = os.path.join(self.workdir, "test.db")
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+
+    def _open(self, migrations: list) -> Database:
+        with mock.patch.object(database, "MIGRATIONS", migrations):
+            db = Database(self.path)
+        self.addCleanup(db.close)
+        return db
+
+    def test_failed_migration_leaves_no_partial_schema(self):
+        db = self._open(database.MIGRATIONS[:2])
+        db.conn.execute("INSERT INTO users (telegram_id) VALUES (1)")
+        db.conn.execute("INSERT INTO files (user_id, original_name) VALUES (1, 'doc')")
+        db.conn.commit()
+
+        def crashed(cur):
+            # как _m003, упавшая между пересборкой и переименованием
+            cur.execute("CREATE TABLE files_new (id INTEGER PRIMARY KEY)")
+            cur.execute("DROP TABLE files")
+            raise sqlite3.OperationalError("disk I/O error")
+
+        with self.assertRaises(sqlite3.OperationalError):
+            self._open(database.MIGRATIONS[:2] + [crashed])
+
+        db = self._open(database.MIGRATIONS)
+        names = [r["original_name"] for r in db.conn.execute("SELECT original_name FROM files")]
+        self.assertEqual(names, ["doc"])
+        version = db.conn.execute("SELECT version FROM schema_version").fetchone()[0]
+        self.assertEqual(version, len(database.MIGRATIONS))
+
+
+class SharedFileTest(unittest.IsolatedAsyncioTestCase):
+    """
+    Два Database на одном файле — как воркеры при WORKERS > 1:
+    у каждого своё соединение и свой поток БД
+    """
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="dbtest_")
+        patcher = mock.patch.object(database, "STORAGE_PDF", os.path.join(self.workdir, "pdf"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        path = os.path.join(self.workdir, "test.db")
+        self.first = Database(path)
+        self.second = Database(path)
+
+    def tearDown(self):
+        self.first.close()
+        self.second.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    async def test_write_after_read_sees_other_process_commit(self):
+        first_users, first_files = UserRepo(self.first), FileRepo(self.first)
+        user = await first_users.get_or_create(1)
+
+        read = threading.Event()
+        resume = threading.Event()
+
+        def slow_read():
+            # чтение открывает транзакцию пачки, дальше другой процесс коммитит
+            self.first.conn.execute("SELECT COUNT(*) FROM files").fetchone()
+            read.set()
+            resume.wait(2)
+
+        reading = asyncio.ensure_future(self.first.run(slow_read))
+        writing = asyncio.ensure_future(first_files.create(user["id"], "first", ""))
+        await asyncio.to_thread(read.wait, 2)
+
+        await FileRepo(self.second).create(user["id"], "second", "")
+        resume.set()
+
+        await asyncio.wait_for(reading, timeout=2)
+        await asyncio.wait_for(writing, timeout=2)
+        self.assertEqual(await first_users.usage(user["id"]), (0, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
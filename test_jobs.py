@@ -0,0 +1,127 @@
+"""
+JobEngine: отмена, таймаут и убийство зависшей задачи —
+после каждого из них слот пула должен вернуться.
+
+    python -m pytest test_jobs.py
+"""
+import asyncio
+import time
+import unittest
+from unittest import mock
+
+import jobs
+from jobs import JobCancelled, JobEngine, JobQueueFull, JobTimeout
+
+
+# задачи выполняются в процессах пула — только функции уровня модуля
+
+def _steps(count: int, delay: float, progress):
+    for done in range(count):
+        progress(done, count)
+        time.sleep(delay)
+    progress(count, count)
+    return count
+
+
+def _stuck(seconds: float, progress):
+    # одна долгая операция без progress(), как декодирование большого фото
+    time.sleep(seconds)
+    return "late"
+
+
+def _fail(progress):
+    raise ValueError("boom")
+
+
+class JobEngineTest(unittest.IsolatedAsyncioTestCase):
+
+    def engine(self, workers: int = 1, queue_size: int = 4, timeout: float = 10) -> JobEngine:
+        engine = JobEngine(workers=workers, queue_size=queue_size, timeout=timeout)
+        self.addCleanup(engine.shutdown)
+        return engine
+
+    async def wait_free_slots(self, engine: JobEngine):
+        # слот освобождается колбэком, когда процесс реально закончил
+        for _ in range(100):
+            if engine._free_slots.qsize() == engine.workers:
+                return
+            await asyncio.sleep(0.05)
+        self.fail(f"{engine._free_slots.qsize()} of {engine.workers} slots are free")
+
+    async def test_result_and_progress(self):
+        engine = self.engine()
+        seen = []
+
+        async def on_progress(done, total):
+            seen.append((done, total))
+
+        with mock.patch.object(jobs, "PDF_PROGRESS_INTERVAL", 0.01):
+            self.assertEqual(await engine.run(_steps, 5, 0.05, on_progress=on_progress), 5)
+        self.assertTrue(seen)
+        self.assertTrue(all(total == 5 for _, total in seen))
+
+    async def test_error_is_raised_and_slot_freed(self):
+        engine = self.engine()
+        with self.assertRaises(ValueError):
+            await engine.run(_fail)
+        await self.wait_free_slots(engine)
+
+    async def test_cancel_running_job(self):
+        engine = self.engine()
+        task = asyncio.ensure_future(engine.run(_steps, 100, 0.05, job_id="job"))
+        await asyncio.sleep(0.3)
+
+        self.assertTrue(engine.cancel("job"))
+        with self.assertRaises(JobCancelled):
+            await task
+        await self.wait_free_slots(engine)
+        self.assertFalse(engine.cancel("job"))
+
+    async def test_cancel_waiting_job(self):
+        engine = self.engine()
+        running = asyncio.ensure_future(engine.run(_steps, 4, 0.05))
+        waiting = asyncio.ensure_future(engine.run(_stuck, 10, job_id="waiting"))
+        await asyncio.sleep(0.05)
+
+        self.assertTrue(engine.cancel("waiting"))
+        self.assertEqual(await running, 4)
+        with self.assertRaises(JobCancelled):
+            await asyncio.wait_for(waiting, 2)
+        await self.wait_free_slots(engine)
+
+    async def test_queue_full(self):
+        engine = self.engine(queue_size=1)
+        running = asyncio.ensure_future(engine.run(_steps, 4, 0.05))
+        waiting = asyncio.ensure_future(engine.run(_steps, 1, 0))
+        await asyncio.sleep(0.05)
+
+        with self.assertRaises(JobQueueFull):
+            await engine.run(_steps, 1, 0)
+        self.assertEqual(await running, 4)
+        self.assertEqual(await waiting, 1)
+
+    async def test_timeout_stops_job_at_progress(self):
+        engine = self.engine(timeout=0.3)
+        with self.assertRaises(JobTimeout):
+            await engine.run(_steps, 100, 0.05)
+        await self.wait_free_slots(engine)
+
+    async def test_stuck_job_is_killed_and_slot_released(self):
+        engine = self.engine(workers=2, timeout=0.2)
+        with mock.patch.object(jobs, "PDF_KILL_GRACE", 0.2):
+            with self.assertRaises(JobTimeout):
+                await engine.run(_stuck, 30)
+            pool = engine._pool
+
+            # без убийства слот был бы занят ещё 30 секунд
+            start = time.monotonic()
+            await self.wait_free_slots(engine)
+            self.assertLess(time.monotonic() - start, 5)
+
+        self.assertIsNot(engine._pool, pool)
+        self.assertEqual(await engine.run(_steps, 2, 0), 2)
+        await self.wait_free_slots(engine)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+"""
+SQLitePersistence: в базу уходят только изменившиеся данные,
+одна запись на цикл, множества переживают сохранение.
+
+    python -m pytest test_persistence.py
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import database
+from database import Database, StateRepo
+from persistence import SQLitePersistence, dumps, loads
+
+
+class EncodingTest(unittest.TestCase):
+
+    def test_sets_round_trip(self):
+        data = {"merge_ids": {3, 1, 2}, "lang": "ru", "page": [5, "next"]}
+        encoded = dumps(data)
+        self.assertIn('{"__set__": [1, 2, 3]}', encoded)
+        self.assertEqual(loads(encoded), data)
+
+    def test_same_data_same_json(self):
+        # сравнение с сохранённым JSON не должно зависеть от порядка вставки
+        self.assertEqual(dumps({"b": {2, 1}, "a": 1}), dumps({"a": 1, "b": {1, 2}}))
+
+
+class SQLitePersistenceTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="persisttest_")
+        patcher = mock.patch.object(database, "STORAGE_PDF", os.path.join(self.workdir, "pdf"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.db = Database(os.path.join(self.workdir, "test.db"))
+        self.repo = StateRepo(self.db)
+        self.saves = mock.AsyncMock(wraps=self.repo.save)
+        self.repo.save = self.saves
+        self.persistence = SQLitePersistence(self.repo)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+    def reopen(self) -> SQLitePersistence:
+        # как после перезапуска: ничего не загружено
+        return SQLitePersistence(StateRepo(self.db))
+
+    async def test_only_changed_user_data_is_written(self):
+        await self.persistence.update_user_data(1, {"lang": "en"})
+        await self.persistence.update_user_data(1, {"lang": "en"})
+        self.assertEqual(self.saves.await_count, 1)
+
+        await self.persistence.update_user_data(1, {"lang": "ru"})
+        self.assertEqual(self.saves.await_count, 2)
+
+    async def test_one_cycle_is_one_write(self):
+        await asyncio.gather(
+            self.persistence.update_user_data(1, {"lang": "en"}),
+            self.persistence.update_user_data(2, {"lang": "ru"}),
+            self.persistence.update_conversation("main", (1, 1), 3),
+        )
+        self.assertEqual(self.saves.await_count, 1)
+        users, conversations = self.saves.await_args.args
+        self.assertEqual(set(users), {1, 2})
+        self.assertEqual(len(conversations), 1)
+
+    async def test_user_data_is_loaded_lazily(self):
+        await self.persistence.update_user_data(1, {"lang": "uz", "merge_ids": {2, 1}})
+
+        restored = self.reopen()
+        self.assertEqual(await restored.get_user_data(), {})
+        user_data = {"lang": "en"}
+        await restored.refresh_user_data(1, user_data)
+        # записанное текущим апдейтом важнее сохранённого
+        self.assertEqual(user_data, {"lang": "en", "merge_ids": {1, 2}})
+
+        # повторно не читается — иначе затёр бы изменения сессии
+        user_data.pop("merge_ids")
+        await restored.refresh_user_data(1, user_data)
+        self.assertEqual(user_data, {"lang": "en"})
+
+    async def test_conversations_round_trip(self):
+        await self.persistence.update_conversation("main", (1, 1), 3)
+        await self.persistence.update_conversation("main", (2, 2), 4)
+        await self.persistence.update_conversation("main", (2, 2), None)
+
+        restored = self.reopen()
+        self.assertEqual(await restored.get_conversations("main"), {(1, 1): 3})
+
+    async def test_conversation_states_follow_updates(self):
+        await self.persistence.update_conversation("main", (1, 1), 3)
+        await self.persistence.update_conversation("main", (2, 2), 4)
+        await self.persistence.update_conversation("main", (2, 2), None)
+        self.assertEqual(self.persistence.conversation_states("main"), {(1, 1): 3})
+
+        restored = self.reopen()
+        self.assertEqual(restored.conversation_states("main"), {})
+        await restored.get_conversations("main")
+        self.assertEqual(restored.conversation_states("main"), {(1, 1): 3})
+
+    async def test_failed_flush_is_retried(self):
+        self.saves.side_effect = [OSError("disk full"), None]
+        await self.persistence.update_user_data(1, {"lang": "ru"})
+        await self.persistence.flush()
+
+        self.assertEqual(self.saves.await_count, 2)
+        self.assertEqual(self.saves.await_args.args[0], {1: dumps({"lang": "ru"})})
+
+
+if __name__ == "__main__":
+    unittest.main()
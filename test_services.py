@@ -0,0 +1,103 @@
+"""
+Потоковая склейка PDF (_StreamingMerge): дерево страниц пишется заново,
+ссылки страниц на чужие страницы не тянут их за собой.
+
+    python -m pytest test_services.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+
+from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2.generic import NameObject, NullObject
+
+from services import PDFService, _StreamingMerge
+
+
+def _text_pdf(path: str, lines: list[str]):
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=(200, 200))
+    for line in lines:
+        c.drawString(20, 100, line)
+        c.showPage()
+    c.save()
+
+
+def _linked_pdf(path: str):
+    """
+    Три пустые страницы; первая ссылается на вторую и на третью
+    (как аннотации или закладки с /Dest на страницу)
+    """
+    writer = PdfWriter()
+    for _ in range(3):
+        writer.add_blank_page(100, 100)
+    first = writer.pages[0]
+    first[NameObject("/Next")] = writer.pages[1].indirect_reference
+    first[NameObject("/Far")] = writer.pages[2].indirect_reference
+    with open(path, "wb") as f:
+        writer.write(f)
+
+
+class StreamingMergeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp(prefix="mergetest_")
+        self.addCleanup(shutil.rmtree, self.workdir, True)
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.workdir, name)
+
+    def test_pages_are_reparented_to_new_tree(self):
+        _text_pdf(self.path("a.pdf"), ["A0", "A1"])
+        _text_pdf(self.path("b.pdf"), ["B0"])
+        calls = []
+
+        count = _StreamingMerge(self.path("out.pdf")).run(
+            [(self.path("a.pdf"), None), (self.path("b.pdf"), None)],
+            progress=lambda done, total: calls.append((done, total)),
+        )
+
+        reader = PdfReader(self.path("out.pdf"))
+        self.assertEqual(count, 3)
+        self.assertEqual([p.extract_text().strip() for p in reader.pages], ["A0", "A1", "B0"])
+        # /Parent каждой страницы — новый корень /Pages (объект 1), а не дерево исходника
+        self.assertEqual({p.raw_get("/Parent").idnum for p in reader.pages}, {1})
+        self.assertEqual(reader.trailer["/Root"].indirect_reference.idnum, 2)
+        self.assertEqual(calls, [(1, 2), (2, 2)])
+
+    def test_links_to_copied_and_foreign_pages(self):
+        _linked_pdf(self.path("linked.pdf"))
+        _text_pdf(self.path("b.pdf"), ["B0"])
+
+        _StreamingMerge(self.path("out.pdf")).run(
+            [(self.path("linked.pdf"), (0, 2)), (self.path("b.pdf"), None)]
+        )
+
+        reader = PdfReader(self.path("out.pdf"))
+        self.assertEqual(len(reader.pages), 3)
+        first = reader.pages[0]
+        # вторая страница скопирована — ссылка ведёт на её копию
+        self.assertEqual(first.raw_get("/Next").idnum, reader.pages[1].indirect_reference.idnum)
+        # третья не выбрана — вместо неё null, а не лишняя страница в файле
+        self.assertIsInstance(first["/Far"], NullObject)
+
+    def test_streaming_matches_pdfmerger(self):
+        _text_pdf(self.path("a.pdf"), ["A0", "A1", "A2"])
+        _text_pdf(self.path("b.pdf"), ["B0"])
+        inputs = [(self.path("a.pdf"), (1, 3)), self.path("b.pdf")]
+
+        texts = []
+        for streaming in (True, False):
+            out = self.path(f"out_{streaming}.pdf")
+            info = PDFService.merge_pdfs(inputs, out, streaming=streaming)
+            self.assertEqual(info["pages"], 3)
+            texts.append([p.extract_text().strip() for p in PdfReader(out).pages])
+
+        self.assertEqual(texts[0], ["A1", "A2", "B0"])
+        self.assertEqual(texts[0], texts[1])
+
+
+if __name__ == "__main__":
+    unittest.main()
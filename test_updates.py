@@ -0,0 +1,81 @@
+"""
+PerUserUpdateProcessor: апдейты одного пользователя — по очереди
+и в порядке получения, разных пользователей — параллельно.
+
+    python -m pytest test_updates.py
+"""
+import asyncio
+import time
+import unittest
+
+from telegram import CallbackQuery, Update, User
+
+from updates import PerUserUpdateProcessor, shard, update_key
+
+
+def _update(update_id: int, user_id: int) -> Update:
+    user = User(id=user_id, first_name="user", is_bot=False)
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), user, "chat"))
+
+
+class PerUserUpdateProcessorTest(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.log = []
+        self.running = 0
+        self.peak = 0
+
+    async def handle(self, name, seconds: float):
+        self.running += 1
+        self.peak = max(self.peak, self.running)
+        self.log.append(("start", name))
+        await asyncio.sleep(seconds)
+        self.log.append(("end", name))
+        self.running -= 1
+
+    def submit(self, processor, update_id: int, user_id: int, seconds: float):
+        return asyncio.create_task(
+            processor.process_update(_update(update_id, user_id), self.handle((user_id, update_id), seconds))
+        )
+
+    async def test_same_user_in_order_without_overlap(self):
+        processor = PerUserUpdateProcessor(4)
+        # более ранние апдейты дольше — без очереди их обогнали бы поздние
+        await asyncio.gather(*(
+            self.submit(processor, i, 1, 0.05 - i * 0.01) for i in range(5)
+        ))
+
+        expected = []
+        for i in range(5):
+            expected += [("start", (1, i)), ("end", (1, i))]
+        self.assertEqual(self.log, expected)
+        self.assertEqual(processor._queues, {})
+
+    async def test_users_run_in_parallel_up_to_concurrency(self):
+        processor = PerUserUpdateProcessor(2)
+        start = time.monotonic()
+        await asyncio.gather(*(self.submit(processor, i, 10 + i, 0.1) for i in range(4)))
+
+        self.assertEqual(self.peak, 2)
+        # 4 апдейта по 0.1 с при двух слотах — две волны, а не четыре
+        self.assertLess(time.monotonic() - start, 0.35)
+
+    async def test_queued_updates_do_not_hold_slots(self):
+        processor = PerUserUpdateProcessor(2)
+        spam = [self.submit(processor, i, 1, 0.05) for i in range(6)]
+        other = self.submit(processor, 100, 2, 0)
+
+        # ждущие своей очереди апдейты пользователя 1 не занимают слоты
+        await asyncio.wait_for(other, 0.1)
+        self.assertIn(("end", (2, 100)), self.log)
+        await asyncio.gather(*spam)
+
+    def test_update_key_and_shard(self):
+        update = _update(1, 42)
+        self.assertEqual(update_key(update), 42)
+        self.assertEqual(shard(update, 4), 42 % 4)
+        self.assertIsNone(update_key(object()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,6 +6,10 @@ TEXT = {
         "back_to_menu": "⬅ Back to main menu",
         "cancelled": "❌ Operation cancelled.",
         "error": "❌ Something went wrong. Please try again.",
+        "busy": "⏳ Server is busy right now. Please try again in a moment.",
+        "working": "⏳ Working…",
+        "progress": "⏳ Working… {done}/{total}",
+        "job_running": "⏳ Still working on your PDF, try again in a moment",
 
         # --- main menu ---
         "menu_title": "📋 Main menu. Choose an option:",
@@ -16,8 +20,10 @@ TEXT = {
         # --- create pdf ---
         "collect_images": "📸 Send images.\nWhen finished, press Done.",
         "no_images": "⚠️ No images received.",
+        "quota_exceeded": "💾 Storage limit reached: {used} of {limit}, files: {files} of {max_files}.\nDelete some files and try again.",
         "enter_pdf_name": "📝 Enter PDF file name:",
         "pdf_created": "✅ PDF created successfully!",
+        "pages_dropped": "⚠️ Images skipped because they could not be processed: {count}",
 
         # --- files ---
         "no_files": "📂 You have no files yet.",
@@ -25,6 +31,7 @@ TEXT = {
         "file_deleted": "🗑 File deleted.",
         "file_not_found": "❌ File not found.",
         "file_renamed": "✏️ File renamed successfully.",
+        "file_info": "📑 Pages: {pages} · 💾 {size}",
 
         # --- merge ---
         "merge": "🔗 Merge PDFs",
@@ -41,6 +48,15 @@ TEXT = {
         "download": "📤 Download",
         "delete": "🗑 Delete",
         "rename": "✏ Rename",
+        "optimize": "🗜 Optimize",
+        "optimize_choose": "🗜 Choose quality:\n📱 Screen — smallest file\n📖 E-book — balanced\n🖨 Print — best quality",
+        "preset_screen": "📱 Screen",
+        "preset_ebook": "📖 E-book",
+        "preset_print": "🖨 Print",
+        "optimized": "✅ Optimized: {before} → {after}",
+        "optimize_no_gain": "ℹ️ The file is already optimal.",
+        "prev_page": "◀ Back",
+        "next_page": "Next ▶",
     },
 
     "ru": {
@@ -50,6 +66,10 @@ TEXT = {
         "back_to_menu": "⬅ Назад в главное меню",
         "cancelled": "❌ Операция отменена.",
         "error": "❌ Произошла ошибка. Попробуйте ещё раз.",
+        "busy": "⏳ Сервер сейчас занят. Попробуйте ещё раз чуть позже.",
+        "working": "⏳ Обработка…",
+        "progress": "⏳ Обработка… {done}/{total}",
+        "job_running": "⏳ Ещё работаю над PDF, повторите через пару секунд",
 
         # --- main menu ---
         "menu_title": "📋 Главное меню. Выберите действие:",
@@ -60,8 +80,10 @@ TEXT = {
         # --- create pdf ---
         "collect_images": "📸 Отправьте изображения.\nКогда закончите — нажмите Готово.",
         "no_images": "⚠️ Изображения не получены.",
+        "quota_exceeded": "💾 Лимит хранилища: занято {used} из {limit}, файлов: {files} из {max_files}.\nУдалите ненужные файлы и попробуйте снова.",
         "enter_pdf_name": "📝 Введите имя PDF файла:",
         "pdf_created": "✅ PDF успешно создан!",
+        "pages_dropped": "⚠️ Пропущено изображений, которые не удалось обработать: {count}",
 
         # --- files ---
         "no_files": "📂 У вас пока нет файлов.",
@@ -69,6 +91,7 @@ TEXT = {
         "file_deleted": "🗑 Файл удалён.",
         "file_not_found": "❌ Файл не найден.",
         "file_renamed": "✏️ Файл успешно переименован.",
+        "file_info": "📑 Страниц: {pages} · 💾 {size}",
 
         # --- merge ---
         "merge": "🔗 Объединить PDF",
@@ -85,6 +108,15 @@ TEXT = {
         "download": "📤 Скачать",
         "delete": "🗑 Удалить",
         "rename": "✏ Переименовать",
+        "optimize": "🗜 Сжать",
+        "optimize_choose": "🗜 Выберите качество:\n📱 Экран — минимальный размер\n📖 Электронная книга — баланс\n🖨 Печать — лучшее качество",
+        "preset_screen": "📱 Экран",
+        "preset_ebook": "📖 Эл. книга",
+        "preset_print": "🖨 Печать",
+        "optimized": "✅ Сжато: {before} → {after}",
+        "optimize_no_gain": "ℹ️ Файл уже оптимален.",
+        "prev_page": "◀ Назад",
+        "next_page": "Далее ▶",
     },
 
     "uz": {
@@ -94,6 +126,10 @@ TEXT = {
         "back_to_menu": "⬅ Asosiy menyuga qaytish",
         "cancelled": "❌ Amal bekor qilindi.",
         "error": "❌ Xatolik yuz berdi. Qayta urinib ko‘ring.",
+        "busy": "⏳ Server hozir band. Birozdan so‘ng qayta urinib ko‘ring.",
+        "working": "⏳ Bajarilmoqda…",
+        "progress": "⏳ Bajarilmoqda… {done}/{total}",
+        "job_running": "⏳ PDF ustida ishlanmoqda, birozdan so‘ng qayta urinib ko‘ring",
 
         # --- main menu ---
         "menu_title": "📋 Asosiy menyu. Tanlang:",
@@ -104,8 +140,10 @@ TEXT = {
         # --- create pdf ---
         "collect_images": "📸 Rasmlarni yuboring.\nTugatgach — Tayyor tugmasini bosing.",
         "no_images": "⚠️ Rasmlar olinmadi.",
+        "quota_exceeded": "💾 Xotira limiti: {used} / {limit}, fayllar: {files} / {max_files}.\nKeraksiz fayllarni o‘chirib, qayta urinib ko‘ring.",
         "enter_pdf_name": "📝 PDF fayl nomini kiriting:",
         "pdf_created": "✅ PDF muvaffaqiyatli yaratildi!",
+        "pages_dropped": "⚠️ Qayta ishlab bo‘lmagan rasmlar tashlab ketildi: {count}",
 
         # --- files ---
         "no_files": "📂 Sizda hali fayllar yo‘q.",
@@ -113,6 +151,7 @@ TEXT = {
         "file_deleted": "🗑 Fayl o‘chirildi.",
         "file_not_found": "❌ Fayl topilmadi.",
         "file_renamed": "✏️ Fayl nomi o‘zgartirildi.",
+        "file_info": "📑 Sahifalar: {pages} · 💾 {size}",
 
         # --- merge ---
         "merge": "🔗 PDF birlashtirish",
@@ -129,5 +168,14 @@ TEXT = {
         "download": "📤 Yuklab olish",
         "delete": "🗑 O‘chirish",
         "rename": "✏ Nomini o‘zgartirish",
+        "optimize": "🗜 Siqish",
+        "optimize_choose": "🗜 Sifatni tanlang:\n📱 Ekran — eng kichik hajm\n📖 Elektron kitob — muvozanat\n🖨 Chop etish — eng yaxshi sifat",
+        "preset_screen": "📱 Ekran",
+        "preset_ebook": "📖 E-kitob",
+        "preset_print": "🖨 Chop etish",
+        "optimized": "✅ Siqildi: {before} → {after}",
+        "optimize_no_gain": "ℹ️ Fayl allaqachon optimal.",
+        "prev_page": "◀ Orqaga",
+        "next_page": "Keyingi ▶",
     }
 }
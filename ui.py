@@ -1,6 +1,124 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
 from telegram import Update
 from telegram.ext import ContextTypes
-from telegram.error import BadRequest
+from telegram.error import BadRequest, RetryAfter
+
+import config
+import metrics
+
+# лимиты Telegram: ~30 сообщений в секунду на бота, ~1 в секунду на чат
+UI_GLOBAL_RATE = getattr(config, "UI_GLOBAL_RATE", 30)
+UI_CHAT_RATE = getattr(config, "UI_CHAT_RATE", 1)
+UI_CHAT_BURST = getattr(config, "UI_CHAT_BURST", 3)
+UI_MAX_CHATS = getattr(config, "UI_MAX_CHATS", 10000)
+# сколько ждать отложенные обновления при остановке бота, секунды
+UI_SHUTDOWN_TIMEOUT = getattr(config, "UI_SHUTDOWN_TIMEOUT", 5)
+
+
+API_SECONDS = metrics.histogram(
+    "telegram_api_seconds", "Bot API call latency from ui.py", ("method",)
+)
+API_ERRORS = metrics.counter(
+    "telegram_api_errors_total", "Failed Bot API calls from ui.py", ("method", "error")
+)
+
+
+# ===================== RATE LIMIT =====================
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Ни одного токена в ближайшие seconds секунд (после RetryAfter)
+        """
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class _ChatUI:
+    """
+    Состояние UI одного чата: лимит, последнее показанное состояние
+    и отложенное обновление, которое пришло, пока шёл запрос.
+    waiters — futures тех, кто ждёт отрисовки отложенного обновления.
+    """
+    __slots__ = ("bucket", "shown", "pending", "busy", "waiters")
+
+    def __init__(self):
+        self.bucket = TokenBucket(UI_CHAT_RATE, UI_CHAT_BURST)
+        self.shown = None
+        self.pending = None
+        self.busy = False
+        self.waiters = []
+
+
+_global_bucket = TokenBucket(UI_GLOBAL_RATE, UI_GLOBAL_RATE)
+_chats: "OrderedDict[int, _ChatUI]" = OrderedDict()
+_background = set()
+
+
+def _chat(chat_id: int) -> _ChatUI:
+    chat = _chats.get(chat_id)
+    if chat is None:
+        chat = _chats[chat_id] = _ChatUI()
+        # вытесняем самый давний чат; занятый отрисовкой — в конец, до следующего раза
+        if len(_chats) > UI_MAX_CHATS:
+            old_id, old = _chats.popitem(last=False)
+            if old.busy:
+                _chats[old_id] = old
+    _chats.move_to_end(chat_id)
+    return chat
+
+
+def _seconds(delay) -> float:
+    if isinstance(delay, timedelta):
+        return delay.total_seconds()
+    return float(delay)
+
+
+async def _api(chat: _ChatUI, method, **kwargs):
+    """
+    Вызов Bot API с учётом лимитов и RetryAfter
+    """
+    name = method.__name__
+    while True:
+        await chat.bucket.acquire()
+        await _global_bucket.acquire()
+        start = time.perf_counter()
+        try:
+            return await method(**kwargs)
+        except RetryAfter as e:
+            API_ERRORS.inc(name, "RetryAfter")
+            delay = _seconds(e.retry_after)
+            logging.warning("⏳ Flood control, retry in %.1fs", delay)
+            chat.bucket.pause(delay)
+        except Exception as e:
+            API_ERRORS.inc(name, type(e).__name__)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - start, name)
 
 
 def _get_chat_id(update: Update) -> int:
@@ -13,45 +131,178 @@ def _get_chat_id(update: Update) -> int:
     raise RuntimeError("Cannot determine chat_id")
 
 
-async def update_ui(
-    update: Update,
-    context: ContextTypes.DEFAULT_TYPE,
-    text: str,
-    reply_markup=None
-):
+# ===================== DISPATCH =====================
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+def _enqueue(chat: _ChatUI, item: tuple) -> bool:
     """
-    Обновляет существующее UI-сообщение.
-    Если редактирование невозможно — создаёт новое.
+    Пока идёт запрос, новые состояния не копятся — остаётся только
+    последнее (быстрые нажатия схлопываются в одно редактирование).
+    True — состояние отложено, его отрисует уже идущий цикл чата.
     """
-    chat_id = _get_chat_id(update)
+    if not chat.busy:
+        chat.busy = True
+        return False
+
+    # reset должен выполниться, даже если поверх пришёл обычный update
+    if chat.pending and chat.pending[0] == "reset":
+        item = ("reset",) + item[1:]
+    chat.pending = item
+    return True
+
+
+async def _dispatch(chat_id: int, item: tuple):
+    """
+    Запросы одного чата выполняются по очереди (см. _enqueue).
+    Возвращается после отрисовки item — или более свежего
+    состояния, которое его заменило, пока чат был занят.
+    """
+    chat = _chat(chat_id)
+    if not _enqueue(chat, item):
+        await _drain(chat_id, chat, item)
+        return
+
+    fut = asyncio.get_running_loop().create_future()
+    chat.waiters.append(fut)
+    await fut
+
+
+def _schedule(chat_id: int, item: tuple):
+    """
+    Как _dispatch, но не ждёт отрисовки: обработчик сразу завершается,
+    и следующие нажатия успевают схлопнуться с этим состоянием
+    """
+    chat = _chat(chat_id)
+    if not _enqueue(chat, item):
+        _spawn(_drain(chat_id, chat, item))
+
+
+async def _drain(chat_id: int, chat: _ChatUI, item: tuple):
+    waiters = []
+    try:
+        while item:
+            try:
+                await _render(chat_id, chat, *item)
+            except Exception as e:
+                logging.warning("⚠️ UI update for chat %s failed: %r", chat_id, e)
+            _wake(waiters)
+            item, chat.pending = chat.pending, None
+            waiters, chat.waiters = chat.waiters, []
+    finally:
+        chat.busy = False
+        # цикл прерван (отмена при остановке) — ожидающие не должны зависнуть
+        _wake(waiters + chat.waiters)
+        chat.waiters = []
+
+
+def _wake(waiters: list):
+    for fut in waiters:
+        if not fut.done():
+            fut.set_result(None)
+
+
+async def _render(
+    chat_id: int,
+    chat: _ChatUI,
+    kind: str,
+    context,
+    text: str,
+    reply_markup,
+    photo=None,
+    on_photo=None,
+):
+    key = (text, reply_markup.to_json() if reply_markup else None, photo is not None)
     msg_id = context.user_data.get("ui_message_id")
 
-    if msg_id:
+    if kind == "edit" and msg_id:
+        # то же самое уже на экране — запрос не нужен
+        if chat.shown == (msg_id, key):
+            return
+
+        # фото не превратить в текст редактированием — только заменить сообщение
+        if msg_id == context.user_data.get("ui_photo_id"):
+            kind = "reset"
+
+    if kind == "edit" and msg_id:
         try:
-            await context.bot.edit_message_text(
+            await _api(
+                chat,
+                context.bot.edit_message_text,
                 chat_id=chat_id,
                 message_id=msg_id,
                 text=text,
                 reply_markup=reply_markup,
             )
+            chat.shown = (msg_id, key)
             return
 
         except BadRequest as e:
             # ❗ Сообщение не изменилось — это нормально
             if "message is not modified" in str(e).lower():
+                chat.shown = (msg_id, key)
                 return
 
             # ❗ Сообщение удалено / устарело — создадим новое
         except Exception:
             pass
 
-    # 🔁 fallback — создаём новое UI-сообщение
-    msg = await context.bot.send_message(
-        chat_id=chat_id,
-        text=text,
-        reply_markup=reply_markup,
-    )
+    # 🔁 создаём новое UI-сообщение
+    if photo is not None:
+        msg = await _api(
+            chat,
+            context.bot.send_photo,
+            chat_id=chat_id,
+            photo=photo,
+            caption=text,
+            reply_markup=reply_markup,
+        )
+        context.user_data["ui_photo_id"] = msg.message_id
+        if on_photo and msg.photo:
+            on_photo(msg.photo[-1].file_id)
+    else:
+        msg = await _api(
+            chat,
+            context.bot.send_message,
+            chat_id=chat_id,
+            text=text,
+            reply_markup=reply_markup,
+        )
+        context.user_data.pop("ui_photo_id", None)
     context.user_data["ui_message_id"] = msg.message_id
+    chat.shown = (msg.message_id, key)
+
+    # старое сообщение удаляем в фоне — пользователь не ждёт этот запрос
+    if kind == "reset" and msg_id:
+        _spawn(_delete_quietly(chat, context.bot, chat_id, msg_id))
+
+
+async def _delete_quietly(chat: _ChatUI, bot, chat_id: int, msg_id: int):
+    try:
+        await _api(chat, bot.delete_message, chat_id=chat_id, message_id=msg_id)
+    except Exception:
+        pass
+
+
+# ===================== PUBLIC =====================
+
+async def update_ui(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    text: str,
+    reply_markup=None
+):
+    """
+    Обновляет существующее UI-сообщение.
+    Если редактирование невозможно — создаёт новое.
+    Запрос выполняется в фоне: до него из очереди чата остаётся
+    только последнее состояние.
+    """
+    _schedule(_get_chat_id(update), ("edit", context, text, reply_markup))
 
 
 async def reset_ui(
@@ -64,24 +315,36 @@ async def reset_ui(
     Полностью удаляет старое UI-сообщение и создаёт новое.
     Использовать после завершённых действий
     (Create / Download / Merge / Rename).
+    Возвращается, когда новое сообщение уже отправлено.
     """
-    chat_id = _get_chat_id(update)
-    msg_id = context.user_data.get("ui_message_id")
+    await _dispatch(_get_chat_id(update), ("reset", context, text, reply_markup))
 
-    if msg_id:
-        try:
-            await context.bot.delete_message(
-                chat_id=chat_id,
-                message_id=msg_id,
-            )
-        except Exception:
-            pass
 
-        context.user_data.pop("ui_message_id", None)
+async def photo_ui(
+    update: Update,
+    context: ContextTypes.DEFAULT_TYPE,
+    photo,
+    text: str,
+    reply_markup=None,
+    on_photo=None,
+):
+    """
+    Заменяет UI-сообщение фото с подписью text.
+    photo — file_id или байты; on_photo(file_id) получает file_id
+    загруженного фото, чтобы в следующий раз не загружать его снова.
+    Возвращается, когда фото уже отправлено.
+    """
+    await _dispatch(_get_chat_id(update), ("reset", context, text, reply_markup, photo, on_photo))
 
-    msg = await context.bot.send_message(
-        chat_id=chat_id,
-        text=text,
-        reply_markup=reply_markup,
-    )
-    context.user_data["ui_message_id"] = msg.message_id
+
+async def shutdown(timeout: float = UI_SHUTDOWN_TIMEOUT):
+    """
+    Ждёт отложенные обновления и удаления сообщений, оставшиеся — отменяет.
+    Вызывать, пока бот ещё может выполнять запросы (post_stop).
+    """
+    if _background:
+        await asyncio.wait(set(_background), timeout=timeout)
+    tasks = set(_background)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,91 @@
+import asyncio
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+import config
+
+# WEBHOOK_URL задан — апдейты принимаются вебхуком вместо long polling
+WEBHOOK_URL = getattr(config, "WEBHOOK_URL", None)
+WEBHOOK_LISTEN = getattr(config, "WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = getattr(config, "WEBHOOK_PORT", 8443)
+WEBHOOK_PATH = getattr(config, "WEBHOOK_PATH", "webhook")
+WEBHOOK_SECRET = getattr(config, "WEBHOOK_SECRET", None)
+
+
+def webhook_settings() -> dict:
+    """
+    Аргументы для Application.run_webhook / Updater.start_webhook.
+    Нужен python-telegram-bot[webhooks].
+    """
+    return {
+        "listen": WEBHOOK_LISTEN,
+        "port": WEBHOOK_PORT,
+        "url_path": WEBHOOK_PATH,
+        "webhook_url": f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+        "secret_token": WEBHOOK_SECRET,
+    }
+
+
+def update_key(update: object) -> int | None:
+    """
+    Чей это апдейт: пользователь, иначе чат. None — ничей (например, poll)
+    """
+    if isinstance(update, Update):
+        if update.effective_user:
+            return update.effective_user.id
+        if update.effective_chat:
+            return update.effective_chat.id
+    return None
+
+
+def shard(update: object, shards: int) -> int:
+    """
+    Номер воркера для апдейта (cluster.py): все апдейты одного
+    пользователя попадают в один и тот же процесс
+    """
+    return (update_key(update) or 0) % shards
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Апдейты разных пользователей обрабатываются параллельно
+    (не больше concurrency одновременно), апдейты одного пользователя —
+    строго по очереди, в порядке получения.
+    Так состояние ConversationHandler пользователя не обгоняет само себя.
+    """
+
+    def __init__(self, concurrency: int):
+        # семафор базового класса не ограничивает: слот занимает только апдейт,
+        # дошедший до начала очереди своего пользователя — иначе один
+        # пользователь, наспамивший кнопками, занял бы все слоты ожиданием
+        super().__init__(max_concurrent_updates=2 ** 30)
+        self.concurrency = concurrency
+        self._slots = asyncio.Semaphore(concurrency)
+        # ключ → [lock, сколько апдейтов ждёт или выполняется]
+        self._queues = {}
+
+    async def do_process_update(self, update: object, coroutine):
+        key = update_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        # задачи апдейтов создаются в порядке получения, а asyncio.Lock
+        # отдаёт блокировку в порядке ожидания — порядок сохраняется
+        entry = self._queues.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._queues[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
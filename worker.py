@@ -0,0 +1,99 @@
+"""
+Воркер режима нескольких процессов, запускается приёмником (cluster.py):
+
+    python worker.py <номер> <всего воркеров> <fd сокета>
+
+Апдейты приходят по сокету строками JSON, в ответ воркер раз в
+WORKER_HEARTBEAT секунд пишет пустую строку. Сокет закрыт — воркер
+дорабатывает полученные апдейты и завершается.
+"""
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+
+import config
+
+# до изменения config модули, читающие его при импорте (logs, metrics, bot), не импортируем
+
+
+def _apply_config(index: int, count: int):
+    for name, value in json.loads(os.environ.pop("BOT_WORKER_CONFIG", "{}")).items():
+        setattr(config, name, value)
+
+    # свои временные файлы у каждого воркера — janitor не видит чужие альбомы
+    config.STORAGE_TEMP = os.path.join(config.STORAGE_TEMP, f"worker{index}")
+    if getattr(config, "METRICS_PORT", None):
+        config.METRICS_PORT += 1 + index
+    if not getattr(config, "PDF_WORKERS", None):
+        config.PDF_WORKERS = max(1, (os.cpu_count() or 1) // count)
+    config.WORKERS = 1
+
+
+async def _heartbeat(writer: asyncio.StreamWriter, interval: float):
+    try:
+        while True:
+            writer.write(b"\n")
+            await writer.drain()
+            await asyncio.sleep(interval)
+    except ConnectionError:
+        pass
+
+
+async def _serve(index: int, fd: int):
+    from telegram import Update
+    from logs import log_context
+
+    log_context.set({"worker": index})
+    import bot
+    from cluster import WORKER_HEARTBEAT
+
+    app = bot.build_app()
+    reader, writer = await asyncio.open_connection(
+        sock=socket.socket(fileno=fd), limit=2 ** 24
+    )
+
+    await app.initialize()
+    try:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        heartbeat = asyncio.create_task(_heartbeat(writer, WORKER_HEARTBEAT))
+
+        while line := await reader.readline():
+            await app.update_queue.put(Update.de_json(json.loads(line), app.bot))
+
+        heartbeat.cancel()
+        writer.close()
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+    finally:
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+def main():
+    index, count, fd = map(int, sys.argv[1:4])
+    _apply_config(index, count)
+    # Ctrl+C (и SIGTERM от systemd) получает вся группа процессов,
+    # а останавливает воркер приёмник — закрывая сокет
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+    from logs import setup_logging
+    import logging
+
+    listener = setup_logging()
+    try:
+        asyncio.run(_serve(index, fd))
+        logging.info("👷 Worker %s stopped", index)
+    finally:
+        listener.stop()
+
+
+if __name__ == "__main__":
+    main()